@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+"""
+analytics.py
+
+Fleet counts for maintenance planning, answered from the item_rollups table
+instead of GROUP BY scans over items/statuses (scanning_service's /analytics).
+
+- item_rollups holds one row per (vendor_id, lot_no, component_type, status)
+  with the number of items currently in that status; NULL dimensions are stored
+  as '' (and reported as null)
+- Every status write path adds its deltas (-1 old status, +1 new status) in the
+  same transaction as the items update, so counts never lag a commit. Rollup rows
+  are updated in sorted key order, so concurrent writers cannot deadlock on them
+- reconcile() recomputes the counts from items one vendor at a time and fixes any
+  drift (items written by other tools, rows edited by hand). It locks that vendor's
+  rollup rows first, so writers for the vendor wait for the few milliseconds it
+  takes and no update is lost in between
+- Failure rate: share of items currently in FAILURE_STATUSES
+
+CLI:
+  python analytics.py reconcile
+  python analytics.py reconcile --every 3600     # keep running, once an hour
+  python analytics.py show --group-by vendor status
+"""
+
+import argparse
+import json
+import sys
+import time
+from collections import Counter
+
+from mysql.connector import IntegrityError
+
+DIMENSIONS = {  # API name → rollup column
+    "vendor": "vendor_id",
+    "lot": "lot_no",
+    "component": "component_type",
+    "status": "status",
+}
+FILTERS = {"vendor_id": "vendor_id", "lot_no": "lot_no", "component": "component_type", "status": "status"}
+FAILURE_STATUSES = ("Replacement Needed", "Replaced")
+
+
+def rollup_key(dims, status):
+    """dims: (vendor_id, lot_no, component_type) → item_rollups primary key"""
+    return tuple("" if v is None else str(v) for v in (*dims, status))
+
+
+def add_move(deltas, dims, old_status, new_status):
+    """Record one item moving old_status → new_status (None: legacy row without a status)"""
+    if old_status == new_status:
+        return
+    deltas[rollup_key(dims, old_status)] -= 1
+    deltas[rollup_key(dims, new_status)] += 1
+
+
+ROLLUP_UPDATE = ("UPDATE item_rollups SET item_count = item_count + %s "
+                 "WHERE vendor_id=%s AND lot_no=%s AND component_type=%s AND status=%s")
+ROLLUP_INSERT = ("INSERT INTO item_rollups (vendor_id, lot_no, component_type, status, item_count) "
+                 "VALUES (%s, %s, %s, %s, %s)")
+
+
+def apply_deltas(cur, deltas):
+    """deltas: Counter {rollup key: change}; run inside the writer's transaction"""
+    for key in sorted(deltas):
+        delta = deltas[key]
+        if not delta:
+            continue
+        cur.execute(ROLLUP_UPDATE, (delta, *key))
+        if cur.rowcount:
+            continue
+        try:
+            cur.execute(ROLLUP_INSERT, (*key, delta))
+        except IntegrityError:
+            # A concurrent writer created the row first
+            cur.execute(ROLLUP_UPDATE, (delta, *key))
+
+
+async def apply_deltas_async(conn, deltas):
+    """apply_deltas() for async_scanning_service connections (execute() returns the rowcount)"""
+    for key in sorted(deltas):
+        delta = deltas[key]
+        if not delta or await conn.execute(ROLLUP_UPDATE, (delta, *key)):
+            continue
+        try:
+            await conn.execute(ROLLUP_INSERT, (*key, delta))
+        except Exception:
+            # IntegrityError of whichever driver: a concurrent writer created the row first
+            if not await conn.execute(ROLLUP_UPDATE, (delta, *key)):
+                raise
+
+
+def apply_move(cur, dims, old_status, new_status):
+    """Single-item shortcut for add_move() + apply_deltas()"""
+    deltas = Counter()
+    add_move(deltas, dims, old_status, new_status)
+    apply_deltas(cur, deltas)
+
+
+def status_moves(items, final_status):
+    """
+    items: {uid: (status before, dims)}; final_status: {uid: status after}
+    → Counter of rollup deltas
+    """
+    deltas = Counter()
+    for uid, status in final_status.items():
+        before, dims = items[uid]
+        add_move(deltas, dims, before, status)
+    return deltas
+
+
+# ---------------- READS ----------------
+def query_counts(conn, group_by, filters=None):
+    """
+    group_by: API dimension names (see DIMENSIONS); filters: {FILTERS key: value}
+    Returns [{column: value, ..., "count": n}] largest first.
+    """
+    columns = [DIMENSIONS[d] for d in group_by]
+    where, params = [], []
+    for name, value in (filters or {}).items():
+        if value:
+            where.append(f"{FILTERS[name]} = %s")
+            params.append(value)
+    select = ", ".join(columns + ["SUM(item_count)"])
+    sql = f"""
+        SELECT {select} FROM item_rollups
+        {"WHERE " + " AND ".join(where) if where else ""}
+        {"GROUP BY " + ", ".join(columns) if columns else ""}
+    """
+    cur = conn.cursor()
+    try:
+        cur.execute(sql, params)
+        rows = cur.fetchall()
+    finally:
+        cur.close()
+    out = []
+    for row in rows:
+        count = int(row[-1] or 0)
+        if count:
+            out.append({**{c: (v if v != "" else None) for c, v in zip(columns, row)}, "count": count})
+    out.sort(key=lambda r: (-r["count"], [str(r[c]) for c in columns]))
+    return out
+
+
+def failure_rates(conn, group_by=("vendor",), filters=None):
+    """[{dims..., "items": n, "failed": m, "failure_rate": m / n}] worst first"""
+    dims = [d for d in group_by if d != "status"]
+    columns = [DIMENSIONS[d] for d in dims]
+    totals = {}
+    for row in query_counts(conn, list(dims) + ["status"], filters):
+        key = tuple(row[c] for c in columns)
+        entry = totals.setdefault(key, {**{c: row[c] for c in columns}, "items": 0, "failed": 0})
+        entry["items"] += row["count"]
+        if row["status"] in FAILURE_STATUSES:
+            entry["failed"] += row["count"]
+    out = list(totals.values())
+    for entry in out:
+        entry["failure_rate"] = round(entry["failed"] / entry["items"], 4) if entry["items"] else 0.0
+    out.sort(key=lambda e: (-e["failure_rate"], -e["items"]))
+    return out
+
+
+# ---------------- RECONCILE ----------------
+def _vendor_predicate(vendor):
+    return ("(vendor_id IS NULL OR vendor_id = '')", []) if vendor == "" else ("vendor_id = %s", [vendor])
+
+
+def reconcile(conn):
+    """
+    Rebuild item_rollups from items, one transaction per vendor.
+    Returns {"vendors": n, "corrected": rows fixed, "elapsed_s": ...}.
+    """
+    started = time.perf_counter()
+    cur = conn.cursor()
+    corrected = 0
+    try:
+        cur.execute("SELECT DISTINCT vendor_id FROM items")
+        vendors = {"" if r[0] is None else r[0] for r in cur.fetchall()}
+        cur.execute("SELECT DISTINCT vendor_id FROM item_rollups")
+        vendors |= {r[0] for r in cur.fetchall()}
+        conn.commit()  # each vendor below starts a fresh transaction
+
+        for vendor in sorted(vendors):
+            # Lock first: writers for this vendor wait, so the count below is exact
+            cur.execute("SELECT lot_no, component_type, status, item_count FROM item_rollups "
+                        "WHERE vendor_id=%s FOR UPDATE", (vendor,))
+            stored = {tuple(r[:3]): r[3] for r in cur.fetchall()}
+            predicate, params = _vendor_predicate(vendor)
+            cur.execute(f"""
+                SELECT lot_no, component_type, current_status, COUNT(*) FROM items
+                WHERE {predicate} GROUP BY lot_no, component_type, current_status
+            """, params)
+            actual = Counter()
+            for lot_no, component, status, count in cur.fetchall():
+                actual[rollup_key((vendor, lot_no, component), status)[1:]] += count
+
+            for key in sorted(set(stored) | set(actual)):
+                want = actual.get(key, 0)
+                if stored.get(key) == want:
+                    continue
+                corrected += 1
+                if key in stored:
+                    if want:
+                        cur.execute("UPDATE item_rollups SET item_count=%s WHERE vendor_id=%s AND lot_no=%s "
+                                    "AND component_type=%s AND status=%s", (want, vendor, *key))
+                    else:
+                        cur.execute("DELETE FROM item_rollups WHERE vendor_id=%s AND lot_no=%s "
+                                    "AND component_type=%s AND status=%s", (vendor, *key))
+                else:
+                    cur.execute("INSERT INTO item_rollups (vendor_id, lot_no, component_type, status, item_count) "
+                                "VALUES (%s, %s, %s, %s, %s)", (vendor, *key, want))
+            conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+    return {"vendors": len(vendors), "corrected": corrected,
+            "elapsed_s": round(time.perf_counter() - started, 3)}
+
+
+# ---------------- CLI ----------------
+def main():
+    parser = argparse.ArgumentParser(description="Fleet analytics rollups")
+    sub = parser.add_subparsers(dest="command", required=True)
+    rec = sub.add_parser("reconcile", help="recompute item_rollups from items")
+    rec.add_argument("--every", type=float, help="repeat every N seconds instead of exiting")
+    show = sub.add_parser("show", help="print counts")
+    show.add_argument("--group-by", nargs="+", choices=list(DIMENSIONS), default=["status"])
+    show.add_argument("--failures", action="store_true", help="failure rates instead of counts")
+    args = parser.parse_args()
+
+    import db
+
+    conn = db.connect()
+    try:
+        if args.command == "show":
+            fn = failure_rates if args.failures else query_counts
+            json.dump(fn(conn, args.group_by), sys.stdout, indent=2)
+            print()
+            return
+        while True:
+            result = reconcile(conn)
+            print(f"reconciled {result['vendors']} vendors, corrected {result['corrected']} rollup rows "
+                  f"in {result['elapsed_s']}s", file=sys.stderr, flush=True)
+            if not args.every:
+                break
+            time.sleep(args.every)
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
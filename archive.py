@@ -0,0 +1,350 @@
+#!/usr/bin/env python3
+"""
+archive.py
+
+Hot/cold split for the 'statuses' audit table. Events older than the retention
+window move out of MySQL into compressed segment files; item history reads merge
+both transparently (scanning_service's /history/<uid>).
+
+- One segment per calendar month per run: <archive_dir>/statuses-YYYY-MM-<run>.ndjson.gz
+  holding the month's rows sorted by (uid, updated_at, id); uids in binary order (what
+  Python's str comparison bisects), not the column's case-insensitive collation
+- A segment is a series of gzip members of BLOCK_ROWS rows each, so the file is an
+  ordinary .ndjson.gz (zcat works) but a single block can be read on its own
+- <segment>.json is the manifest: period, row count, id range and per block
+  [first uid, last uid, byte offset, byte length]; a UID lookup bisects the block
+  list and decompresses only the blocks that can contain it
+- Order of work: segment (fsync, rename) → manifest (fsync, rename) → delete the
+  archived ids from 'statuses' in DELETE_BATCH batches → manifest marked purged.
+  A run that dies part way is finished by the next run, which purges any
+  unpurged segment first; readers drop duplicate ids, so nothing shows twice
+- items.current_status / last_updated are untouched, so /scan never needs the
+  archive. Archived rows also leave the /changes feed and the /sync idempotency
+  check, which only matter for events younger than the retention window
+- archive_dir must be shared storage when several service replicas read it
+
+CLI:
+  python archive.py --older-than-days 365
+  python archive.py --uid UID-0001        # print one item's full history
+"""
+
+import argparse
+import bisect
+import gzip
+import json
+import os
+import sys
+import threading
+import zlib
+from datetime import datetime, timedelta
+
+from export_history import json_value
+
+ARCHIVE_DIR = os.getenv("STATUS_ARCHIVE_DIR",
+                        os.path.join(os.path.dirname(os.path.abspath(__file__)), "status_archive"))
+RETENTION_DAYS = int(os.getenv("STATUS_RETENTION_DAYS", 365))
+BLOCK_ROWS = 2000
+DELETE_BATCH = 1000
+
+COLUMNS = ("id", "uid", "status", "location", "note", "updated_at", "recorded_at", "employee_id",
+           "idempotency_key")
+HISTORY_COLUMNS = COLUMNS[:-1]
+
+
+def _month_start(ts):
+    return datetime(ts.year, ts.month, 1)
+
+
+def _next_month(ts):
+    return datetime(ts.year + ts.month // 12, ts.month % 12 + 1, 1)
+
+
+def _write_atomic(path, data):
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+# ---------------- WRITER ----------------
+class SegmentWriter:
+    """Writes sorted rows as independently readable gzip blocks"""
+
+    def __init__(self, path, block_rows=BLOCK_ROWS):
+        self.path = path
+        self.tmp = f"{path}.{os.getpid()}.tmp"
+        self.block_rows = block_rows
+        self._f = open(self.tmp, "wb")
+        self._pending = []
+        self.blocks = []
+        self.rows = 0
+        self.min_id = self.max_id = None
+
+    def add(self, row):
+        self._pending.append(row)
+        row_id = row["id"]
+        self.min_id = row_id if self.min_id is None else min(self.min_id, row_id)
+        self.max_id = row_id if self.max_id is None else max(self.max_id, row_id)
+        if len(self._pending) >= self.block_rows:
+            self._flush_block()
+
+    def _flush_block(self):
+        if not self._pending:
+            return
+        rows = self._pending
+        body = "".join(json.dumps({c: json_value(r.get(c)) for c in COLUMNS}) + "\n" for r in rows).encode()
+        member = gzip.compress(body, compresslevel=6, mtime=0)
+        offset = self._f.tell()
+        self._f.write(member)
+        self.blocks.append([rows[0]["uid"], rows[-1]["uid"], offset, len(member)])
+        self.rows += len(rows)
+        self._pending = []
+
+    def finish(self):
+        """Returns False (and writes nothing) if no rows were added"""
+        self._flush_block()
+        self._f.flush()
+        os.fsync(self._f.fileno())
+        self._f.close()
+        if not self.rows:
+            os.unlink(self.tmp)
+            return False
+        os.replace(self.tmp, self.path)
+        return True
+
+    def abort(self):
+        self._f.close()
+        if os.path.exists(self.tmp):
+            os.unlink(self.tmp)
+
+
+def read_block(path, offset, length):
+    with open(path, "rb") as f:
+        f.seek(offset)
+        data = f.read(length)
+    return [json.loads(line) for line in zlib.decompress(data, 31).decode().splitlines()]
+
+
+# ---------------- ARCHIVE JOB ----------------
+def write_manifest(archive_dir, manifest):
+    _write_atomic(os.path.join(archive_dir, manifest["segment"] + ".json"),
+                  json.dumps(manifest, indent=1).encode())
+
+
+def purge_segment(conn, archive_dir, manifest, batch=DELETE_BATCH):
+    """Delete the segment's rows from 'statuses' (ids read back from the file), then mark it purged"""
+    path = os.path.join(archive_dir, manifest["segment"])
+    cur = conn.cursor()
+    deleted = 0
+    try:
+        for _, _, offset, length in manifest["blocks"]:
+            ids = [row["id"] for row in read_block(path, offset, length)]
+            for start in range(0, len(ids), batch):
+                part = ids[start:start + batch]
+                cur.execute(f"DELETE FROM statuses WHERE id IN ({','.join(['%s'] * len(part))})", part)
+                deleted += cur.rowcount
+                conn.commit()
+    finally:
+        cur.close()
+    manifest["purged"] = True
+    write_manifest(archive_dir, manifest)
+    return deleted
+
+
+def archive_month(conn, archive_dir, start, end, run_id, block_rows=BLOCK_ROWS):
+    """Write one segment for statuses rows in [start, end); returns its manifest or None"""
+    segment = f"statuses-{start:%Y-%m}-{run_id}.ndjson.gz"
+    writer = SegmentWriter(os.path.join(archive_dir, segment), block_rows)
+    binary_uid = "uid COLLATE BINARY" if getattr(conn, "dialect", "mysql") == "sqlite" else "BINARY uid"
+    cur = conn.cursor(dictionary=True, buffered=False)
+    try:
+        cur.execute(f"""
+            SELECT {', '.join(COLUMNS)} FROM statuses
+            WHERE updated_at >= %s AND updated_at < %s
+            ORDER BY {binary_uid}, updated_at, id
+        """, (str(start), str(end)))
+        for row in cur:
+            writer.add(row)
+    except BaseException:
+        writer.abort()
+        raise
+    finally:
+        cur.close()
+    if not writer.finish():
+        return None
+
+    manifest = {
+        "segment": segment,
+        "period": f"{start:%Y-%m}",
+        "from": str(start),
+        "until": str(end),
+        "rows": writer.rows,
+        "min_id": writer.min_id,
+        "max_id": writer.max_id,
+        "min_uid": writer.blocks[0][0],
+        "max_uid": writer.blocks[-1][1],
+        "blocks": writer.blocks,
+        "created_at": datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S'),
+        "purged": False
+    }
+    write_manifest(archive_dir, manifest)
+    return manifest
+
+
+def load_manifests(archive_dir):
+    manifests = []
+    if not os.path.isdir(archive_dir):
+        return manifests
+    for entry in sorted(os.scandir(archive_dir), key=lambda e: e.name):
+        if entry.name.endswith(".ndjson.gz.json"):
+            with open(entry.path, "rb") as f:
+                manifests.append(json.load(f))
+    return manifests
+
+
+def archive_statuses(conn, before=None, archive_dir=ARCHIVE_DIR, block_rows=BLOCK_ROWS):
+    """
+    Move every statuses row with updated_at < before (default: RETENTION_DAYS ago)
+    into monthly segments. Returns {"segments": [...], "archived": n, "deleted": n, "resumed": n}.
+    """
+    before = before or datetime.utcnow() - timedelta(days=RETENTION_DAYS)
+    os.makedirs(archive_dir, exist_ok=True)
+    summary = {"segments": [], "archived": 0, "deleted": 0, "resumed": 0}
+
+    for manifest in load_manifests(archive_dir):
+        if not manifest["purged"]:
+            summary["deleted"] += purge_segment(conn, archive_dir, manifest)
+            summary["resumed"] += 1
+
+    cur = conn.cursor()
+    try:
+        cur.execute("SELECT MIN(updated_at) FROM statuses WHERE updated_at < %s", (str(before),))
+        oldest = cur.fetchone()[0]
+    finally:
+        cur.close()
+    conn.commit()  # end the read snapshot so the month queries see current data
+    if oldest is None:
+        return summary
+    if isinstance(oldest, str):  # SQLite: aggregates lose the DATETIME conversion
+        oldest = datetime.fromisoformat(oldest)
+
+    run_id = f"{datetime.utcnow():%Y%m%dT%H%M%S}-{os.getpid()}"
+    start = _month_start(oldest)
+    while start < before:
+        end = min(_next_month(start), before)
+        manifest = archive_month(conn, archive_dir, start, end, run_id, block_rows)
+        if manifest:
+            summary["segments"].append(manifest["segment"])
+            summary["archived"] += manifest["rows"]
+            summary["deleted"] += purge_segment(conn, archive_dir, manifest)
+        start = end
+    return summary
+
+
+# ---------------- READ PATH ----------------
+class ArchiveReader:
+    """UID lookups across segments; manifests are cached until their file changes"""
+
+    def __init__(self, archive_dir=ARCHIVE_DIR):
+        self.archive_dir = archive_dir
+        self._manifests = {}  # path → (mtime, manifest, block last uids)
+        self._lock = threading.Lock()
+
+    def _segments(self):
+        if not os.path.isdir(self.archive_dir):
+            return []
+        found = []
+        with self._lock:
+            seen = set()
+            for entry in os.scandir(self.archive_dir):
+                if not entry.name.endswith(".ndjson.gz.json"):
+                    continue
+                seen.add(entry.path)
+                mtime = entry.stat().st_mtime
+                cached = self._manifests.get(entry.path)
+                if cached is None or cached[0] != mtime:
+                    with open(entry.path, "rb") as f:
+                        manifest = json.load(f)
+                    cached = (mtime, manifest, [b[1] for b in manifest["blocks"]])
+                    self._manifests[entry.path] = cached
+                found.append(cached)
+            for path in set(self._manifests) - seen:
+                del self._manifests[path]
+        return found
+
+    def rows_for(self, uid):
+        """Archived rows of one UID (unordered)"""
+        rows = []
+        for _, manifest, lasts in self._segments():
+            if not manifest["min_uid"] <= uid <= manifest["max_uid"]:
+                continue
+            path = os.path.join(self.archive_dir, manifest["segment"])
+            blocks = manifest["blocks"]
+            i = bisect.bisect_left(lasts, uid)  # first block that can end at or after uid
+            while i < len(blocks) and blocks[i][0] <= uid:
+                rows += [r for r in read_block(path, blocks[i][2], blocks[i][3]) if r["uid"] == uid]
+                i += 1
+        return rows
+
+    def stats(self):
+        segments = self._segments()
+        return {"segments": len(segments),
+                "rows": sum(m["rows"] for _, m, _ in segments),
+                "unpurged": sum(1 for _, m, _ in segments if not m["purged"]),
+                "bytes": sum(os.path.getsize(os.path.join(self.archive_dir, m["segment"]))
+                             for _, m, _ in segments)}
+
+
+def item_history(conn, uid, reader):
+    """
+    Full history of one UID, hot rows merged with archived ones, oldest first.
+    Returns (rows, number of rows that came from the archive).
+    """
+    cur = conn.cursor(dictionary=True)
+    try:
+        cur.execute(f"SELECT {', '.join(HISTORY_COLUMNS)} FROM statuses WHERE uid=%s ORDER BY updated_at, id",
+                    (uid,))
+        hot = [{c: json_value(r[c]) for c in HISTORY_COLUMNS} for r in cur.fetchall()]
+    finally:
+        cur.close()
+    merged = {r["id"]: r for r in hot}
+    archived = 0
+    for r in reader.rows_for(uid):
+        if r["id"] not in merged:
+            merged[r["id"]] = {c: r.get(c) for c in HISTORY_COLUMNS}
+            archived += 1
+    return sorted(merged.values(), key=lambda r: (r["updated_at"], r["id"])), archived
+
+
+# ---------------- CLI ----------------
+def main():
+    parser = argparse.ArgumentParser(description="Archive old status events / read archived history")
+    parser.add_argument("--older-than-days", type=int, default=RETENTION_DAYS)
+    parser.add_argument("--archive-dir", default=ARCHIVE_DIR)
+    parser.add_argument("--block-rows", type=int, default=BLOCK_ROWS)
+    parser.add_argument("--uid", help="print this item's full history instead of archiving")
+    args = parser.parse_args()
+
+    import db
+
+    conn = db.connect()
+    try:
+        if args.uid:
+            rows, _ = item_history(conn, args.uid, ArchiveReader(args.archive_dir))
+            for row in rows:
+                print(json.dumps(row))
+            return
+        before = datetime.utcnow() - timedelta(days=args.older_than_days)
+        summary = archive_statuses(conn, before, args.archive_dir, args.block_rows)
+    finally:
+        conn.close()
+    print(f"archived {summary['archived']} rows into {len(summary['segments'])} segment(s), "
+          f"deleted {summary['deleted']} from statuses", file=sys.stderr)
+    json.dump(summary, sys.stdout, indent=2)
+    print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,457 @@
+"""
+async_scanning_service.py
+
+Async variant of scanning_service on an ASGI server (Quart + uvicorn).
+
+Serves the same contracts as the Flask app:
+1) /scan
+2) /allowed_statuses
+3) /update_status
+4) /pool_stats
+5) /metrics (same instrumentation as the sync app, see metrics.py)
+
+DB access never blocks the event loop: handlers share async pools (aiomysql by
+default), one per node behind an AsyncRouter that applies db.Router's rules:
+writes on the primary, reads on DB_REPLICAS, read-your-writes for DB_STICKY_SECONDS.
+ThreadedDB adapts a regular db_pool.ConnectionPool (e.g. the SQLite stand-in) for tests.
+
+Run: python scanning_service.py --app async
+ or: uvicorn async_scanning_service:app --host 0.0.0.0 --port 5001
+"""
+
+import asyncio
+import time
+from contextlib import AsyncExitStack, asynccontextmanager
+from collections import Counter
+from datetime import datetime
+
+from quart import Quart, request, jsonify
+
+try:
+    import aiomysql
+except ImportError:  # only needed for AiomysqlDB
+    aiomysql = None
+
+import analytics
+import metrics
+from cache import MISSING
+from db import Router, replica_configs
+from db_pool import PoolTimeout
+from scanning_service import (DB_CONFIG, POOL_CONFIG, ROLE_CACHE_NEGATIVE_TTL, authorizer,
+                              build_scan_result, check_status_write_deadline, db_gauges, role_cache,
+                              scan_cache, transition_conflict)
+
+
+# ---------------- ASYNC DB ACCESS ----------------
+class AiomysqlConn:
+    def __init__(self, raw):
+        self._raw = raw
+
+    async def _run(self, sql, params, dictionary, fetch):
+        metrics.count_query()
+        cursor_cls = aiomysql.DictCursor if dictionary else aiomysql.Cursor
+        async with self._raw.cursor(cursor_cls) as cur:
+            await cur.execute(sql, params)
+            if fetch == "one":
+                return await cur.fetchone()
+            if fetch == "all":
+                return await cur.fetchall()
+            return cur.rowcount
+
+    async def fetchone(self, sql, params=(), dictionary=False):
+        return await self._run(sql, params, dictionary, "one")
+
+    async def fetchall(self, sql, params=(), dictionary=False):
+        return await self._run(sql, params, dictionary, "all")
+
+    async def execute(self, sql, params=()):
+        return await self._run(sql, params, False, None)
+
+    async def commit(self):
+        with metrics.phase("commit"):
+            await self._raw.commit()
+
+    async def rollback(self):
+        await self._raw.rollback()
+
+
+class AiomysqlDB:
+    """Shared aiomysql pool sized/timed from scanning_service.POOL_CONFIG"""
+
+    def __init__(self, config=DB_CONFIG, size=POOL_CONFIG['size'], timeout=POOL_CONFIG['timeout'],
+                 max_lifetime=POOL_CONFIG['max_lifetime']):
+        self.config = config
+        self.size = size
+        self.timeout = timeout
+        self.max_lifetime = max_lifetime
+        self._pool = None
+        self._start_lock = asyncio.Lock()
+        self._checkouts = 0
+        self._timeouts = 0
+        self._wait_total = 0.0
+
+    async def start(self):
+        if aiomysql is None:
+            raise RuntimeError("AiomysqlDB needs the 'aiomysql' package (pip install aiomysql)")
+        self._pool = await aiomysql.create_pool(
+            host=self.config['host'], port=self.config.get('port', 3306),
+            user=self.config['user'], password=self.config['password'],
+            db=self.config['database'], minsize=1, maxsize=self.size,
+            pool_recycle=int(self.max_lifetime), autocommit=False)
+
+    async def close(self):
+        if self._pool is not None:
+            self._pool.close()
+            await self._pool.wait_closed()
+
+    @asynccontextmanager
+    async def acquire(self):
+        if self._pool is None:  # replicas start on their first read
+            async with self._start_lock:
+                if self._pool is None:
+                    await self.start()
+        start = time.monotonic()
+        with metrics.phase("connect"):
+            try:
+                raw = await asyncio.wait_for(self._pool.acquire(), self.timeout)
+            except asyncio.TimeoutError:
+                self._timeouts += 1
+                raise PoolTimeout(f"no DB connection available after {self.timeout}s (pool size {self.size})")
+            self._checkouts += 1
+            self._wait_total += time.monotonic() - start
+        try:
+            with metrics.phase("connect"):
+                await raw.ping(reconnect=True)  # health check on checkout
+            yield AiomysqlConn(raw)
+        finally:
+            if raw.get_transaction_status():
+                await raw.rollback()
+            self._pool.release(raw)
+
+    def stats(self):
+        open_conns = self._pool.size if self._pool else 0
+        idle = self._pool.freesize if self._pool else 0
+        return {
+            "size": self.size,
+            "open": open_conns,
+            "in_use": open_conns - idle,
+            "idle": idle,
+            "checkouts": self._checkouts,
+            "timeouts": self._timeouts,
+            "avg_wait_ms": round(1000 * self._wait_total / self._checkouts, 3) if self._checkouts else 0.0,
+        }
+
+
+class ThreadedConn:
+    def __init__(self, raw):
+        self._raw = raw
+
+    def _run(self, sql, params, dictionary, fetch):
+        metrics.count_query()
+        cur = self._raw.cursor(dictionary=dictionary)
+        try:
+            cur.execute(sql, params)
+            if fetch == "one":
+                return cur.fetchone()
+            if fetch == "all":
+                return cur.fetchall()
+            return cur.rowcount
+        finally:
+            cur.close()
+
+    async def fetchone(self, sql, params=(), dictionary=False):
+        return await asyncio.to_thread(self._run, sql, params, dictionary, "one")
+
+    async def fetchall(self, sql, params=(), dictionary=False):
+        return await asyncio.to_thread(self._run, sql, params, dictionary, "all")
+
+    async def execute(self, sql, params=()):
+        return await asyncio.to_thread(self._run, sql, params, False, None)
+
+    async def commit(self):
+        with metrics.phase("commit"):
+            await asyncio.to_thread(self._raw.commit)
+
+    async def rollback(self):
+        await asyncio.to_thread(self._raw.rollback)
+
+
+class ThreadedDB:
+    """Runs a blocking db_pool.ConnectionPool off the event loop"""
+
+    def __init__(self, pool):
+        self.pool = pool
+
+    async def start(self):
+        pass
+
+    async def close(self):
+        self.pool.close_all()
+
+    @asynccontextmanager
+    async def acquire(self):
+        with metrics.phase("connect"):
+            conn = await asyncio.to_thread(self.pool.get)
+        try:
+            yield ThreadedConn(conn)
+        finally:
+            await asyncio.to_thread(conn.close)
+
+    def stats(self):
+        return self.pool.stats()
+
+
+class AsyncRouter:
+    """
+    db.Router over async pools (AiomysqlDB / ThreadedDB). `router` holds the sticky keys,
+    down replicas and counters, so routing works exactly as in the sync app.
+    """
+
+    def __init__(self, primary, replicas=(), **router_options):
+        """primary: async pool; replicas: [(name, async pool), ...]"""
+        self.router = Router(primary, replicas, **router_options)
+
+    async def start(self):
+        await self.router.primary.start()
+
+    async def close(self):
+        for pool in [self.router.primary, *(pool for _, pool in self.router.replicas)]:
+            await pool.close()
+
+    def acquire(self):
+        """Primary connection (writes, and reads that must see the latest commit)"""
+        return self.router.primary.acquire()
+
+    @asynccontextmanager
+    async def acquire_read(self, *keys):
+        """Connection for a read of keys: a healthy replica unless sticky (db.Router.read)"""
+        router = self.router
+        candidates = router.read_candidates(keys)
+        async with AsyncExitStack() as stack:
+            conn = None
+            for index, pool in candidates or ():
+                try:
+                    conn = await stack.enter_async_context(pool.acquire())
+                except PoolTimeout:
+                    continue  # busy, not down
+                except Exception:
+                    router.replica_failed(index)
+                    continue
+                router.count("replica_reads")
+                break
+            if conn is None:
+                if candidates is not None:
+                    router.count("primary_fallbacks")
+                conn = await stack.enter_async_context(router.primary.acquire())
+            yield conn
+
+    def mark_written(self, *keys):
+        self.router.mark_written(*keys)
+
+    def is_sticky(self, keys):
+        return self.router.is_sticky(keys)
+
+    def stats(self):
+        return self.router.stats()
+
+
+db = None  # set at startup (or by tests before the first request)
+
+async def get_employee_role(emp_id):
+    """Fetch employee role (from the shared role_cache, falling back to DB)"""
+    key = str(emp_id)
+    role = role_cache.get(key)
+    if role is not MISSING:
+        return role
+
+    async with db.acquire_read() as conn:
+        with metrics.phase("role_query"):
+            row = await conn.fetchone("SELECT role FROM employees WHERE id=%s", (emp_id,))
+
+    role = row[0] if row else None
+    role_cache.set(key, role, ttl=None if role else ROLE_CACHE_NEGATIVE_TTL)
+    return role
+
+# ---------------- QUART APP ----------------
+app = Quart(__name__)
+
+@app.before_serving
+async def startup():
+    global db
+    if db is None:
+        db = AsyncRouter(AiomysqlDB(), [(name, AiomysqlDB(config))
+                                        for name, config in replica_configs(DB_CONFIG).items()])
+        await db.start()
+
+@app.after_serving
+async def shutdown():
+    if db is not None:
+        await db.close()
+
+@app.before_request
+async def start_request_timer():
+    metrics.begin_request()
+
+@app.after_request
+async def record_request_metrics(response):
+    metrics.end_request(request.endpoint or "unmatched", response.status_code)
+    return response
+
+@app.errorhandler(PoolTimeout)
+async def handle_pool_timeout(e):
+    return jsonify({"error": "Database busy, try again", "detail": str(e)}), 503
+
+# -------- 1) SCAN ENDPOINT -----------------
+@app.route('/scan', methods=['POST'])
+async def scan_qr():
+    """
+    Input: { "uid": "UID-0001" }
+    Output: details + calculated expiry date
+    """
+    data = await request.get_json(force=True)
+    uid = data.get("uid")
+
+    if not uid:
+        return jsonify({"error": "uid required"}), 400
+
+    # Read-your-writes before the cache, as in the sync app's scan_qr
+    if not db.is_sticky([uid]):
+        with metrics.phase("cache"):
+            body = scan_cache.get(uid)
+        if body is not None:
+            return app.response_class(body, mimetype="application/json")
+
+    generation = scan_cache.generations([uid])[uid]
+    async with db.acquire_read(uid) as conn:
+        with metrics.phase("item_query"):
+            item = await conn.fetchone("SELECT * FROM items WHERE uid=%s", (uid,), dictionary=True)
+    if not item:
+        return jsonify({"error": "Item not found"}), 404
+
+    with metrics.phase("serialize"):
+        body = app.json.dumps(build_scan_result(uid, item))
+    scan_cache.set(uid, body, generation)
+    return app.response_class(body, mimetype="application/json")
+
+# -------- 2) ALLOWED STATUSES ENDPOINT -----------------
+@app.route('/allowed_statuses', methods=['POST'])
+async def allowed_statuses():
+    """
+    Input: { "employee_id": 2, "uid": "UID-0001" (optional) }
+    Output: { "role": "inspector", "allowed": ["Inspected"] }
+    """
+    data = await request.get_json(force=True)
+    emp_id = data.get("employee_id")
+    uid = data.get("uid")
+
+    if not emp_id:
+        return jsonify({"error": "employee_id required"}), 400
+
+    policy = authorizer.policy
+    with metrics.phase("role_lookup"):
+        role = await get_employee_role(emp_id)
+    if not role:
+        return jsonify({"error": "Invalid employee_id"}), 404
+
+    if not uid:
+        return jsonify({"role": role, "allowed": policy.role_allowed.get(role, [])})
+
+    async with db.acquire_read(uid) as conn:
+        with metrics.phase("item_query"):
+            row = await conn.fetchone("SELECT current_status FROM items WHERE uid=%s", (uid,))
+    if not row:
+        return jsonify({"error": "Item not found"}), 404
+    return jsonify({"role": role, "uid": uid, "current_status": row[0],
+                    "allowed": policy.allowed_for(role, row[0])})
+
+# -------- 3) UPDATE STATUS ENDPOINT -----------------
+@app.route('/update_status', methods=['POST'])
+async def update_status():
+    """
+    Input JSON: { "uid": "UID-0001", "new_status": "Inspected", "employee_id": 2, "note": "ok" }
+    - Inserts row in 'statuses'
+    - Updates 'items.current_status' / 'items.last_updated' in the same transaction
+    - 409 when the item's current status can't move to new_status (lifecycle graph)
+    """
+    data = await request.get_json(force=True)
+    uid = data.get("uid")
+    new_status = data.get("new_status")
+    employee_id = data.get("employee_id")
+    note = data.get("note", "")
+
+    if not uid or not new_status or not employee_id:
+        return jsonify({"error": "uid, new_status, employee_id required"}), 400
+
+    policy = authorizer.policy
+    with metrics.phase("role_lookup"):
+        role = await get_employee_role(employee_id)
+    if not role:
+        return jsonify({"error": "Invalid employee"}), 403
+
+    if not policy.can_set(role, new_status):
+        return jsonify({
+            "error": f"Role '{role}' not allowed to set status '{new_status}'",
+            "allowed_statuses": policy.role_allowed.get(role, [])
+        }), 403
+
+    async with db.acquire() as conn:
+        try:
+            now = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
+            with metrics.phase("item_query"):
+                row = await conn.fetchone(
+                    "SELECT current_status, vendor_id, lot_no, component_type FROM items WHERE uid=%s FOR UPDATE",
+                    (uid,))
+            if not row:
+                await conn.rollback()
+                return jsonify({"error": "Item not found"}), 404
+            conflict = transition_conflict(policy, uid, row[0], new_status, role)
+            if conflict:
+                await conn.rollback()
+                return jsonify(conflict), 409
+            with metrics.phase("insert"):
+                await conn.execute("""
+                    INSERT INTO statuses (uid, status, location, note, updated_at, employee_id)
+                    VALUES (%s, %s, %s, %s, %s, %s)
+                """, (uid, new_status, "MobileApp", note, now, employee_id))
+            with metrics.phase("update"):
+                await conn.execute("UPDATE items SET current_status=%s, last_updated=%s WHERE uid=%s",
+                                   (new_status, now, uid))
+            with metrics.phase("rollup"):
+                deltas = Counter()
+                analytics.add_move(deltas, row[1:], row[0], new_status)
+                await analytics.apply_deltas_async(conn, deltas)
+            check_status_write_deadline(now)
+            await conn.commit()
+        except Exception as e:
+            await conn.rollback()
+            return jsonify({"error": str(e)}), 500
+
+    db.mark_written(uid)
+    scan_cache.invalidate(uid)
+    return jsonify({"ok": True, "uid": uid, "new_status": new_status, "role": role})
+
+# -------- 4) POOL STATS ENDPOINT -----------------
+@app.route('/pool_stats', methods=['GET'])
+async def pool_stats():
+    return jsonify(db.stats())
+
+# -------- 5) METRICS ENDPOINT -----------------
+@app.route('/metrics', methods=['GET'])
+async def prometheus_metrics():
+    """Same series as the sync app's /metrics (no code cache here)"""
+    gauges = db_gauges(db.stats())
+    for name, value in role_cache.stats().items():
+        gauges[f"scanning_role_cache_{name}"] = value
+    for name, value in scan_cache.stats().items():
+        if name != "backend":
+            gauges[f"scanning_scan_cache_{name}"] = value
+    return app.response_class(metrics.render_prometheus(gauges), mimetype="text/plain; version=0.0.4")
+
+# ---------------- MAIN ENTRY ----------------
+def main(host='0.0.0.0', port=5001):
+    import uvicorn
+    print("Starting async scanning_service (ASGI)...")
+    uvicorn.run(app, host=host, port=port)
+
+if __name__ == '__main__':
+    main()
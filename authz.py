@@ -0,0 +1,186 @@
+"""
+authz.py
+
+Compiled authorization for status writes.
+
+Two rules decide whether an employee may set a status on an item:
+- role × status permission matrix ("roles" in authz_config.json)
+- lifecycle transition graph ("transitions"): which statuses may follow the
+  item's current one (a Discarded item can never become Installed again)
+
+The JSON config is compiled into a Policy: every status gets one bit, each role
+and each source status a bitmask of what it may set / move to, so a check is a
+dict lookup and an AND. Policies are immutable; reloading compiles a new one and
+swaps it in with a single assignment, so a request keeps the policy it started with.
+
+- Authorizer.policy: current Policy (re-reads the file when its mtime changes,
+  at most every check_interval seconds, so every worker picks up edits)
+- Authorizer.reload(): force a reload (/authz/reload)
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+log = logging.getLogger("scanning_service.authz")
+
+DEFAULT_CONFIG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "authz_config.json")
+
+
+class Policy:
+    """Compiled, read-only permission matrix + transition graph"""
+
+    def __init__(self, statuses, roles, transitions, override_roles=(), version=None):
+        self.statuses = tuple(statuses)
+        if len(set(self.statuses)) != len(self.statuses):
+            raise ValueError("duplicate status in 'statuses'")
+        self.bit = {s: 1 << i for i, s in enumerate(self.statuses)}
+
+        self.role_mask = {role: self._mask(allowed, f"roles.{role}") for role, allowed in roles.items()}
+        self.next_mask = {src: self._mask(targets, f"transitions.{src}") for src, targets in transitions.items()}
+        unknown = set(self.next_mask) - set(self.bit)
+        if unknown:
+            raise ValueError(f"unknown status in transitions: {sorted(unknown)}")
+        self.override_roles = frozenset(override_roles)
+
+        # Precomputed lists for responses and set-based (SQL) checks
+        self.role_allowed = {role: self._names(mask) for role, mask in self.role_mask.items()}
+        self.sources = {s: tuple(src for src, mask in self.next_mask.items() if mask & bit)
+                        for s, bit in self.bit.items()}
+        self.version = version
+
+    def _mask(self, names, where):
+        mask = 0
+        for name in names:
+            if name not in self.bit:
+                raise ValueError(f"unknown status '{name}' in {where}")
+            mask |= self.bit[name]
+        return mask
+
+    def _names(self, mask):
+        return [s for s in self.statuses if mask & self.bit[s]]
+
+    def can_set(self, role, status):
+        """Role × status matrix"""
+        return bool(self.role_mask.get(role, 0) & self.bit.get(status, 0))
+
+    def can_transition(self, current, status, role=None):
+        """
+        Lifecycle graph. Items with no recorded status (legacy rows) may take any
+        status; a current status missing from the config can't move anywhere.
+        """
+        if current is None or role in self.override_roles:
+            return True
+        return bool(self.next_mask.get(current, 0) & self.bit.get(status, 0))
+
+    def transition_error(self, current, status, role=None):
+        """None when current → status is allowed, else the error message"""
+        if self.can_transition(current, status, role):
+            return None
+        return f"Cannot move item from '{current}' to '{status}'"
+
+    def next_statuses(self, current):
+        if current is None:
+            return list(self.statuses)
+        return self._names(self.next_mask.get(current, 0))
+
+    def allowed_for(self, role, current):
+        """Statuses this role may set on an item currently in `current`"""
+        mask = self.role_mask.get(role, 0)
+        if current is not None and role not in self.override_roles:
+            mask &= self.next_mask.get(current, 0)
+        return self._names(mask)
+
+    def sources_for(self, status, role=None):
+        """
+        Current statuses from which `status` is reachable, or None when any status is
+        (override roles). For set-based writes: WHERE current_status IN (...).
+        """
+        if role in self.override_roles:
+            return None
+        return self.sources.get(status, ())
+
+    def describe(self):
+        return {
+            "version": self.version,
+            "statuses": list(self.statuses),
+            "roles": self.role_allowed,
+            "transitions": {src: self._names(mask) for src, mask in self.next_mask.items()},
+            "override_roles": sorted(self.override_roles)
+        }
+
+
+def compile_policy(config, version=None):
+    """dict (parsed authz_config.json) → Policy; raises ValueError on bad config"""
+    if not isinstance(config, dict) or not config.get("statuses"):
+        raise ValueError("config needs a non-empty 'statuses' list")
+    return Policy(config["statuses"], config.get("roles", {}), config.get("transitions", {}),
+                  config.get("override_roles", ()), version)
+
+
+def load_policy(path):
+    with open(path, "rb") as f:
+        raw = f.read()
+    try:
+        config = json.loads(raw)
+    except json.JSONDecodeError as e:
+        raise ValueError(f"{path}: {e}") from e
+    return compile_policy(config, version=hashlib.sha256(raw).hexdigest()[:12])
+
+
+class Authorizer:
+    def __init__(self, path=DEFAULT_CONFIG_PATH, check_interval=5.0):
+        self.path = path
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._mtime = os.stat(path).st_mtime
+        self._policy = load_policy(path)
+        self._next_check = time.monotonic() + check_interval
+        self.reloads = 0
+        self.reload_errors = 0
+
+    @property
+    def policy(self):
+        if self.check_interval > 0 and time.monotonic() >= self._next_check:
+            self._check_file()
+        return self._policy
+
+    def _check_file(self):
+        if not self._lock.acquire(blocking=False):
+            return  # another thread is already checking
+        try:
+            self._next_check = time.monotonic() + self.check_interval
+            try:
+                mtime = os.stat(self.path).st_mtime
+                if mtime != self._mtime:
+                    # Only remember the mtime once the file compiled: a file read while half
+                    # written must be retried even if the finished file keeps the same mtime
+                    policy = load_policy(self.path)
+                    self._mtime = mtime
+                    self._swap(policy)
+            except (OSError, ValueError) as e:
+                self.reload_errors += 1
+                log.error("authz reload failed, keeping version %s: %s", self._policy.version, e)
+        finally:
+            self._lock.release()
+
+    def _swap(self, policy):
+        self._policy = policy
+        self.reloads += 1
+        log.info("authz policy %s loaded from %s", policy.version, self.path)
+
+    def reload(self):
+        """Re-read the config now; raises (and keeps the old policy) if it is invalid"""
+        with self._lock:
+            mtime = os.stat(self.path).st_mtime
+            policy = load_policy(self.path)
+            self._mtime = mtime
+            self._swap(policy)
+            return policy
+
+    def stats(self):
+        return {"path": self.path, "version": self._policy.version,
+                "reloads": self.reloads, "reload_errors": self.reload_errors}
@@ -0,0 +1,315 @@
+#!/usr/bin/env python3
+"""
+benchmark.py
+
+Load test / latency benchmark for the scanning_service hot paths:
+/scan, /allowed_statuses and /update_status.
+
+- seed_database(): generates N items with a realistic 'statuses' history
+  (lifecycle Manufactured → Received → Inspected → Installed → service events)
+- run_benchmark(): fires a weighted request mix at a given concurrency and
+  reports p50/p95/p99 latency, throughput and error rate per endpoint
+
+Targets:
+  in-process (default): the Flask app on a seeded SQLite file via sqlite_backend,
+                        behind the same ConnectionPool the service uses
+  --backend mysql:      the Flask app on the MySQL in scanning_service.DB_CONFIG
+                        (seeds BENCH-* items unless --no-seed)
+  --url URL:            an already running service over HTTP (sync or async)
+
+Examples:
+  python benchmark.py --items 20000 --history 6 --concurrency 16 --requests 20000
+  python benchmark.py --url http://127.0.0.1:5001 --no-seed --json results.json
+"""
+
+import argparse
+import json
+import math
+import os
+import random
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+
+LIFECYCLE = ["Manufactured", "Received", "Inspected", "Installed"]
+SERVICE_EVENTS = ["Service Needed", "Serviced", "Serviced", "Replacement Needed", "Replaced"]
+COMPONENTS = ["Elastic Rail Clip", "Rail Pad", "Liner", "Sleeper"]
+
+# Mirrors init_employees_db.py sample employees
+EMPLOYEES = [(1, "John Receiver", "receiver"), (2, "Alice Inspector", "inspector"),
+             (3, "Bob Installer", "installer"), (4, "Carol Maintenance", "maintenance"),
+             (5, "Admin User", "admin")]
+
+SEED_CHUNK = 1000
+DEFAULT_MIX = "scan=70,allowed_statuses=20,update_status=10"
+
+
+# ---------------- DATA GENERATOR ----------------
+def item_history(rng, depth, start):
+    """Status events for one item: the lifecycle first, then service events"""
+    events = []
+    ts = start
+    for i in range(depth):
+        status = LIFECYCLE[i] if i < len(LIFECYCLE) else rng.choice(SERVICE_EVENTS)
+        ts += timedelta(days=rng.randint(1, 90), seconds=rng.randint(0, 86399))
+        events.append((status, ts))
+    return events
+
+
+def seed_database(conn, n_items, history=5, uid_prefix="BENCH-", seed=42, employees=True):
+    """
+    Insert n_items items plus their statuses history (mean depth `history`).
+    Returns the list of generated UIDs.
+    """
+    rng = random.Random(seed)
+    cur = conn.cursor()
+
+    if employees:
+        cur.executemany("INSERT INTO employees (id, name, role) VALUES (%s, %s, %s)", EMPLOYEES)
+
+    uids = []
+    items, statuses = [], []
+
+    def flush():
+        cur.executemany("""
+            INSERT INTO items (uid, component_type, vendor_id, lot_no, serial_no, mfg_date,
+                               warranty_years, current_status, last_updated)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+        """, items)
+        cur.executemany("""
+            INSERT INTO statuses (uid, status, location, note, updated_at, employee_id)
+            VALUES (%s, %s, %s, %s, %s, %s)
+        """, statuses)
+        conn.commit()
+        items.clear()
+        statuses.clear()
+
+    for n in range(n_items):
+        uid = f"{uid_prefix}{n:08d}"
+        uids.append(uid)
+        mfg = date(2020, 1, 1) + timedelta(days=rng.randint(0, 1800))
+        depth = max(1, min(2 * history - 1, int(rng.expovariate(1 / history)) + 1))
+        events = item_history(rng, depth, datetime(mfg.year, mfg.month, mfg.day))
+
+        items.append((uid, rng.choice(COMPONENTS), f"V-{rng.randint(1, 40):03d}",
+                      f"LOT-{n // 500:05d}", f"SN{n:09d}", mfg, rng.choice([3, 5, 10]),
+                      events[-1][0], events[-1][1]))
+        for status, ts in events:
+            statuses.append((uid, status, "Bench", "", ts, rng.randint(1, 5)))
+
+        if len(items) >= SEED_CHUNK:
+            flush()
+    flush()
+    cur.close()
+    return uids
+
+
+# ---------------- REQUEST TARGETS ----------------
+class InProcessTarget:
+    """Calls the Flask app through its test client (one client per thread)"""
+
+    def __init__(self, app):
+        self.app = app
+        self._local = threading.local()
+
+    def post(self, path, payload):
+        client = getattr(self._local, "client", None)
+        if client is None:
+            client = self._local.client = self.app.test_client()
+        resp = client.post(path, json=payload)
+        return resp.status_code
+
+
+class HTTPTarget:
+    def __init__(self, base_url, timeout=10):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+
+    def post(self, path, payload):
+        req = urllib.request.Request(self.base_url + path, data=json.dumps(payload).encode(),
+                                     headers={"Content-Type": "application/json"})
+        try:
+            with urllib.request.urlopen(req, timeout=self.timeout) as resp:
+                resp.read()
+                return resp.status
+        except urllib.error.HTTPError as e:
+            return e.code
+
+
+# ---------------- WORKLOAD ----------------
+def parse_mix(spec):
+    mix = {}
+    for part in spec.split(","):
+        name, _, weight = part.partition("=")
+        mix[name.strip()] = float(weight or 1)
+    unknown = set(mix) - {"scan", "allowed_statuses", "update_status"}
+    if unknown:
+        raise ValueError(f"unknown endpoints in mix: {sorted(unknown)}")
+    return mix
+
+
+def make_request(rng, endpoint, uids, role_allowed):
+    """
+    Returns (path, payload). Payloads are always valid (role-permitted statuses) so
+    errors mean real failures; lifecycle conflicts (409) are expected and not errors.
+    """
+    if endpoint == "scan":
+        return "/scan", {"uid": rng.choice(uids)}
+    emp_id, _, role = rng.choice(EMPLOYEES)
+    if endpoint == "allowed_statuses":
+        return "/allowed_statuses", {"employee_id": emp_id}
+    return "/update_status", {"uid": rng.choice(uids), "employee_id": emp_id,
+                              "new_status": rng.choice(role_allowed[role]), "note": "bench"}
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile"""
+    if not sorted_values:
+        return None
+    k = max(0, min(len(sorted_values) - 1, math.ceil(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[k]
+
+
+def summarize(samples, elapsed):
+    """samples: {endpoint: [(latency_s, ok), ...]}"""
+    report = {}
+    for endpoint, rows in samples.items():
+        lat = sorted(l for l, _ in rows)
+        errors = sum(1 for _, ok in rows if not ok)
+        report[endpoint] = {
+            "requests": len(rows),
+            "throughput_rps": round(len(rows) / elapsed, 1) if elapsed else None,
+            "error_rate": round(errors / len(rows), 4) if rows else 0.0,
+            "p50_ms": round(1000 * percentile(lat, 50), 3) if lat else None,
+            "p95_ms": round(1000 * percentile(lat, 95), 3) if lat else None,
+            "p99_ms": round(1000 * percentile(lat, 99), 3) if lat else None,
+            "max_ms": round(1000 * lat[-1], 3) if lat else None,
+        }
+    total = sum(len(rows) for rows in samples.values())
+    report["_total"] = {"requests": total, "elapsed_s": round(elapsed, 3),
+                        "throughput_rps": round(total / elapsed, 1) if elapsed else None}
+    return report
+
+
+def run_benchmark(target, uids, role_allowed, requests=5000, concurrency=8, mix=DEFAULT_MIX,
+                  seed=7, warmup=0):
+    endpoints, weights = zip(*parse_mix(mix).items())
+    plan_rng = random.Random(seed)
+    plan = [make_request(plan_rng, plan_rng.choices(endpoints, weights)[0], uids, role_allowed)
+            for _ in range(warmup + requests)]
+
+    for path, payload in plan[:warmup]:
+        target.post(path, payload)
+    plan = plan[warmup:]
+
+    samples = {e: [] for e in endpoints}
+    lock = threading.Lock()
+
+    def one(step):
+        path, payload = step
+        start = time.perf_counter()
+        try:
+            status = target.post(path, payload)
+            # 409 = random status not reachable from the item's lifecycle state; still a served request
+            ok = 200 <= status < 300 or status == 409
+        except Exception:
+            ok = False
+        latency = time.perf_counter() - start
+        with lock:
+            samples[path.strip("/")].append((latency, ok))
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, plan))
+    return summarize(samples, time.perf_counter() - started)
+
+
+def print_report(report):
+    print(f"{'endpoint':<18} {'reqs':>7} {'rps':>9} {'err%':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    print("-" * 72)
+    for endpoint, r in report.items():
+        if endpoint.startswith("_"):
+            continue
+        print(f"{endpoint:<18} {r['requests']:>7} {r['throughput_rps']:>9} {100 * r['error_rate']:>6.2f} "
+              f"{r['p50_ms']:>9} {r['p95_ms']:>9} {r['p99_ms']:>9}")
+    t = report["_total"]
+    print("-" * 72)
+    print(f"{'total':<18} {t['requests']:>7} {t['throughput_rps']:>9}   in {t['elapsed_s']}s")
+
+
+# ---------------- MAIN ENTRY ----------------
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark scan/update endpoints")
+    parser.add_argument("--backend", choices=["sqlite", "mysql"], default="sqlite")
+    parser.add_argument("--url", help="benchmark a running service over HTTP instead of in-process")
+    parser.add_argument("--items", type=int, default=10000)
+    parser.add_argument("--history", type=int, default=5, help="mean statuses rows per item")
+    parser.add_argument("--no-seed", action="store_true", help="use existing BENCH-* items")
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--warmup", type=int, default=200)
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="weighted endpoint mix")
+    parser.add_argument("--disable-caches", action="store_true",
+                        help="in-process only: bypass role/scan caches to measure DB paths")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--json", help="write the report to this file")
+    args = parser.parse_args()
+
+    import db
+    import scanning_service
+    from db_pool import ConnectionPool
+
+    if args.backend == "sqlite":
+        import sqlite_backend
+        path = os.path.join(tempfile.mkdtemp(prefix="sih_bench_"), "bench.db")
+        connect = lambda: sqlite_backend.connect(path)
+        conn = connect()
+        sqlite_backend.create_schema(conn)
+        seed_employees = True
+    else:
+        import mysql.connector
+        connect = lambda: mysql.connector.connect(**scanning_service.DB_CONFIG)
+        conn = connect()
+        seed_employees = False  # created by init_employees_db.py
+
+    if args.no_seed:
+        cur = conn.cursor()
+        cur.execute("SELECT uid FROM items WHERE uid LIKE 'BENCH-%%' LIMIT %s", (args.items,))
+        uids = [row[0] for row in cur.fetchall()]
+        cur.close()
+    else:
+        t0 = time.perf_counter()
+        uids = seed_database(conn, args.items, args.history, seed=args.seed, employees=seed_employees)
+        print(f"Seeded {len(uids)} items in {time.perf_counter() - t0:.1f}s")
+    conn.close()
+
+    if not uids:
+        parser.error("no BENCH-* items found; run once without --no-seed")
+
+    if args.url:
+        target = HTTPTarget(args.url)
+    else:
+        scanning_service.db_router = db.Router(ConnectionPool(connect, **scanning_service.POOL_CONFIG))
+        if args.disable_caches:
+            from cache import LocalBackend, ResponseCache, TTLCache
+            scanning_service.role_cache = TTLCache(ttl=0)
+            scanning_service.scan_cache = ResponseCache(LocalBackend(ttl=0))
+        target = InProcessTarget(scanning_service.app)
+
+    report = run_benchmark(target, uids, scanning_service.authorizer.policy.role_allowed, requests=args.requests,
+                           concurrency=args.concurrency, mix=args.mix, warmup=args.warmup)
+    report["_config"] = {k: v for k, v in vars(args).items() if k != "json"}
+    print_report(report)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Report written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,285 @@
+"""
+cache.py
+
+Caches used on scanning_service hot paths.
+
+TTLCache: bounded LRU with per-entry TTL, explicit invalidation and
+hit/miss counters. Storing None is allowed (used for negative caching);
+get() returns MISSING when there is no live entry.
+
+ResponseCache: serialized-response cache with a pluggable backend
+- LocalBackend: in-process TTLCache (default)
+- RedisBackend: shared across workers; any redis-py compatible client
+  works, e.g. fakeredis.FakeRedis() as a local stand-in
+
+Read-through without stale fills: take generations() for the keys before
+reading the database and pass them to set(). Every invalidate()/clear() bumps
+the generation, so a set() whose read raced a write (read old row → writer
+commits and invalidates → set) is dropped instead of caching the old row.
+"""
+
+import itertools
+import threading
+import time
+from collections import OrderedDict
+
+try:
+    import redis
+except ImportError:  # optional, only needed for RedisBackend.from_url
+    redis = None
+
+MISSING = object()
+
+# How long an invalidation is remembered for the generation check; a read-through
+# that takes longer than this between generations() and set() may cache a stale value
+GENERATION_TTL = 3600.0
+
+
+class TTLCache:
+    def __init__(self, maxsize=1024, ttl=300.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()  # key -> (value, expires_at)
+        self._lock = threading.Lock()
+
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._expirations = 0
+        self._invalidations = 0
+
+    def get(self, key):
+        """Return the cached value, or MISSING if absent/expired."""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self._misses += 1
+                return MISSING
+            value, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                self._expirations += 1
+                self._misses += 1
+                return MISSING
+            self._data.move_to_end(key)
+            self._hits += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        """Store value for `ttl` seconds (defaults to the cache TTL)."""
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self._evictions += 1
+
+    def invalidate(self, key=MISSING):
+        """Drop one key, or everything when called without a key. Returns entries removed."""
+        with self._lock:
+            if key is MISSING:
+                removed = len(self._data)
+                self._data.clear()
+            else:
+                removed = 1 if self._data.pop(key, None) is not None else 0
+            self._invalidations += removed
+            return removed
+
+    def stats(self):
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "ttl_seconds": self.ttl,
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_ratio": round(self._hits / lookups, 4) if lookups else 0.0,
+                "evictions": self._evictions,
+                "expirations": self._expirations,
+                "invalidations": self._invalidations,
+            }
+
+
+# ---------------- RESPONSE CACHE BACKENDS ----------------
+class LocalBackend:
+    """In-process LRU/TTL storage"""
+    name = "local"
+
+    def __init__(self, maxsize=10000, ttl=300.0):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._generations = TTLCache(maxsize=maxsize, ttl=GENERATION_TTL)  # key -> counter at last invalidation
+        self._counter = itertools.count(1)
+        self._epoch = 0  # bumped by clear()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        value = self._cache.get(key)
+        return None if value is MISSING else value
+
+    def generations(self, keys):
+        out = []
+        for key in keys:
+            gen = self._generations.get(key)
+            out.append((self._epoch, 0 if gen is MISSING else gen))
+        return out
+
+    def set(self, key, value, generation=None):
+        with self._lock:
+            if generation is not None and self.generations([key])[0] != generation:
+                return False
+            self._cache.set(key, value)
+            return True
+
+    def delete(self, keys):
+        with self._lock:
+            for key in keys:
+                self._generations.set(key, next(self._counter))
+                self._cache.invalidate(key)
+
+    def clear(self):
+        with self._lock:
+            self._epoch += 1
+            self._cache.invalidate()
+
+    def size(self):
+        return self._cache.stats()["size"]
+
+
+class RedisBackend:
+    """
+    Shared storage; entries expire server-side after `ttl` seconds.
+    Generations live next to the entries ("<prefix>-gen:<key>", "<prefix>-epoch"), outside
+    the prefix that clear() deletes; set() with a generation is a WATCH/MULTI check-and-set.
+    """
+    name = "redis"
+
+    def __init__(self, client, ttl=300.0, prefix="scan:"):
+        self._client = client
+        self.ttl = ttl
+        self.prefix = prefix
+        self._gen_prefix = prefix.rstrip(":") + "-gen:"
+        self._epoch_key = prefix.rstrip(":") + "-epoch"
+
+    @classmethod
+    def from_url(cls, url, **kwargs):
+        if redis is None:
+            raise RuntimeError("RedisBackend.from_url needs the 'redis' package (pip install redis)")
+        return cls(redis.Redis.from_url(url), **kwargs)
+
+    def get(self, key):
+        return self._client.get(self.prefix + key)
+
+    @staticmethod
+    def _generation(epoch, gen):
+        return (int(epoch or 0), int(gen or 0))
+
+    def generations(self, keys):
+        if not keys:
+            return []
+        epoch, *gens = self._client.mget([self._epoch_key] + [self._gen_prefix + k for k in keys])
+        return [self._generation(epoch, gen) for gen in gens]
+
+    def set(self, key, value, generation=None):
+        if generation is None:
+            self._client.set(self.prefix + key, value, ex=max(1, int(self.ttl)))
+            return True
+        gen_key = self._gen_prefix + key
+        with self._client.pipeline() as pipe:
+            try:
+                pipe.watch(self._epoch_key, gen_key)
+                if self._generation(pipe.get(self._epoch_key), pipe.get(gen_key)) != generation:
+                    return False
+                pipe.multi()
+                pipe.set(self.prefix + key, value, ex=max(1, int(self.ttl)))
+                pipe.execute()
+                return True
+            except redis.WatchError:
+                return False  # invalidated between the check and the write
+
+    def delete(self, keys):
+        if keys:
+            with self._client.pipeline() as pipe:
+                for key in keys:
+                    pipe.incr(self._gen_prefix + key)
+                    pipe.expire(self._gen_prefix + key, int(GENERATION_TTL))
+                pipe.delete(*[self.prefix + k for k in keys])
+                pipe.execute()
+
+    def clear(self):
+        self._client.incr(self._epoch_key)
+        keys = list(self._client.scan_iter(match=self.prefix + "*"))
+        if keys:
+            self._client.delete(*keys)
+
+    def size(self):
+        return None  # not tracked for shared backends
+
+
+class ResponseCache:
+    """
+    Cache of serialized responses (str/bytes) keyed by string.
+    Backend errors are counted and treated as misses so a cache outage
+    never fails a request.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self._lock = threading.Lock()
+        self._counts = {"hits": 0, "misses": 0, "sets": 0, "stale_sets": 0, "invalidations": 0, "errors": 0}
+
+    def _count(self, name, n=1):
+        with self._lock:
+            self._counts[name] += n
+
+    def get(self, key):
+        try:
+            value = self.backend.get(key)
+        except Exception:
+            self._count("errors")
+            value = None
+        self._count("hits" if value is not None else "misses")
+        return value
+
+    def generations(self, keys):
+        """{key: generation} to pass to set() after reading the values from the database"""
+        try:
+            return dict(zip(keys, self.backend.generations(keys)))
+        except Exception:
+            self._count("errors")
+            return {key: MISSING for key in keys}  # matches no generation: those sets are skipped
+
+    def set(self, key, value, generation=None):
+        """Store value; with a generation, only if the key was not invalidated since it was taken"""
+        try:
+            stored = self.backend.set(key, value, generation)
+            self._count("sets" if stored else "stale_sets")
+        except Exception:
+            self._count("errors")
+
+    def invalidate(self, *keys):
+        try:
+            self.backend.delete(keys)
+            self._count("invalidations", len(keys))
+        except Exception:
+            self._count("errors")
+
+    def clear(self):
+        try:
+            self.backend.clear()
+            self._count("invalidations")
+        except Exception:
+            self._count("errors")
+
+    def stats(self):
+        with self._lock:
+            counts = dict(self._counts)
+        lookups = counts["hits"] + counts["misses"]
+        counts["hit_ratio"] = round(counts["hits"] / lookups, 4) if lookups else 0.0
+        counts["backend"] = self.backend.name
+        try:
+            counts["size"] = self.backend.size()
+        except Exception:
+            counts["size"] = None
+        return counts
@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+"""
+codegen.py
+
+Laser-engravable QR / Data Matrix codes for item UIDs. Used by scanning_service's
+/codes endpoints and runnable as a CLI.
+
+- Codes are rendered from the symbol's module matrix: PNG (1-bit, DPI set so the
+  printed module size is module_mm) or SVG (one path, runs of dark modules merged,
+  sized in mm for the engraving software)
+- QR uses error correction level H (30% of the symbol may be damaged); Data Matrix
+  needs the optional 'pylibdmtx' package
+- Content-addressed on-disk cache: the file name is a hash of (uid, symbology,
+  format, render settings), so a code is rendered once and never goes stale
+- Bulk renders (a whole lot) run the cache misses in a process pool; a lot can be
+  streamed as a ZIP while it renders
+
+CLI:
+  python codegen.py --lot LOT-42 --format svg -o LOT-42.zip
+  python codegen.py --uid UID-0001 -o UID-0001.png
+"""
+
+import argparse
+import hashlib
+import io
+import os
+import re
+import sys
+import threading
+import zipfile
+from collections import namedtuple
+from concurrent.futures.process import BrokenProcessPool
+
+import qrcode
+from PIL import Image
+
+from process_pool import ProcessPool
+
+try:
+    from pylibdmtx import pylibdmtx
+except ImportError:  # only needed for symbology="datamatrix"
+    pylibdmtx = None
+
+RENDER_VERSION = 1  # bump when rendering changes so old cache entries are not served
+
+FORMATS = {"png": "image/png", "svg": "image/svg+xml"}
+SYMBOLOGIES = ("qr", "datamatrix")
+DEFAULT_BORDER = {"qr": 4, "datamatrix": 2}  # quiet zone, in modules
+
+CACHE_DIR = os.getenv("CODE_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "code_cache"))
+WORKERS = int(os.getenv("CODEGEN_WORKERS", 0)) or os.cpu_count() or 1
+ZIP_CHUNK = 256        # codes rendered (and streamed) per step of iter_zip()
+INLINE_RENDER_MAX = 4  # fewer misses than this are rendered in-process
+
+# scale: PNG pixels per module; module_mm: physical module size (SVG size, PNG DPI)
+CodeSpec = namedtuple("CodeSpec", "symbology fmt scale border module_mm")
+
+
+def make_spec(symbology="qr", fmt="png", scale=10, border=None, module_mm=0.5):
+    """Validated CodeSpec; raises ValueError for bad settings"""
+    if symbology not in SYMBOLOGIES:
+        raise ValueError(f"symbology must be one of {', '.join(SYMBOLOGIES)}")
+    if symbology == "datamatrix" and pylibdmtx is None:
+        raise ValueError("datamatrix needs the 'pylibdmtx' package (pip install pylibdmtx)")
+    if fmt not in FORMATS:
+        raise ValueError(f"format must be one of {', '.join(FORMATS)}")
+    scale = int(scale)
+    border = DEFAULT_BORDER[symbology] if border is None else int(border)
+    module_mm = float(module_mm)
+    if not 1 <= scale <= 50:
+        raise ValueError("scale must be 1..50")
+    if not 0 <= border <= 20:
+        raise ValueError("border must be 0..20")
+    if not 0.05 <= module_mm <= 10:
+        raise ValueError("module_mm must be 0.05..10")
+    return CodeSpec(symbology, fmt, scale, border, module_mm)
+
+
+# ---------------- MODULE MATRICES ----------------
+def qr_matrix(data):
+    qr = qrcode.QRCode(error_correction=qrcode.constants.ERROR_CORRECT_H, border=0)
+    qr.add_data(data)
+    qr.make(fit=True)
+    return qr.get_matrix()
+
+
+def datamatrix_matrix(data):
+    """pylibdmtx only renders bitmaps; sample the module grid back out of one"""
+    encoded = pylibdmtx.encode(data.encode())
+    img = Image.frombytes("RGB", (encoded.width, encoded.height), encoded.pixels).convert("L")
+    px = img.load()
+    dark = [[px[x, y] < 128 for x in range(img.width)] for y in range(img.height)]
+    rows = [y for y in range(img.height) if any(dark[y])]
+    cols = [x for x in range(img.width) if any(row[x] for row in dark)]
+    top, bottom, left, right = rows[0], rows[-1], cols[0], cols[-1]
+    # The top edge is the alternating timing pattern starting dark: its first run is one module
+    module = left
+    while module <= right and dark[top][module]:
+        module += 1
+    module -= left
+    half = module // 2
+    return [[dark[y + half][x + half] for x in range(left, right + 1, module)]
+            for y in range(top, bottom + 1, module)]
+
+
+def module_matrix(data, symbology):
+    return qr_matrix(data) if symbology == "qr" else datamatrix_matrix(data)
+
+
+# ---------------- RENDERERS ----------------
+def render_png(matrix, spec):
+    width = len(matrix[0]) + 2 * spec.border
+    blank = [1] * width
+    pixels = blank * spec.border
+    for row in matrix:
+        pixels += [1] * spec.border + [0 if dark else 1 for dark in row] + [1] * spec.border
+    pixels += blank * spec.border
+    img = Image.new("1", (width, len(pixels) // width), 1)
+    img.putdata(pixels)
+    img = img.resize((img.width * spec.scale, img.height * spec.scale), Image.NEAREST)
+    dpi = round(25.4 * spec.scale / spec.module_mm)
+    buf = io.BytesIO()
+    img.save(buf, "PNG", optimize=True, dpi=(dpi, dpi))
+    return buf.getvalue()
+
+
+def render_svg(matrix, spec):
+    height = len(matrix) + 2 * spec.border
+    width = len(matrix[0]) + 2 * spec.border
+    path = []
+    for y, row in enumerate(matrix):
+        x = 0
+        while x < len(row):
+            if not row[x]:
+                x += 1
+                continue
+            start = x
+            while x < len(row) and row[x]:
+                x += 1
+            path.append(f"M{start + spec.border} {y + spec.border}h{x - start}v1h-{x - start}z")
+    return (f'<?xml version="1.0" encoding="UTF-8"?>\n'
+            f'<svg xmlns="http://www.w3.org/2000/svg" width="{width * spec.module_mm:g}mm" '
+            f'height="{height * spec.module_mm:g}mm" viewBox="0 0 {width} {height}" shape-rendering="crispEdges">'
+            f'<path d="{"".join(path)}" fill="#000"/></svg>\n').encode()
+
+
+def render(uid, spec):
+    """Code image bytes for one UID"""
+    matrix = module_matrix(uid, spec.symbology)
+    return render_png(matrix, spec) if spec.fmt == "png" else render_svg(matrix, spec)
+
+
+def render_to_file(job):
+    """Process-pool worker: render and write atomically, so readers never see partial files"""
+    uid, spec, path = job
+    data = render(uid, spec)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+    return path
+
+
+# ---------------- CACHE ----------------
+def cache_key(uid, spec):
+    raw = f"{RENDER_VERSION}|{spec.symbology}|{spec.fmt}|{spec.scale}|{spec.border}|{spec.module_mm:g}|{uid}"
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+def archive_name(uid, spec):
+    return re.sub(r"[^A-Za-z0-9._-]", "_", uid) + "." + spec.fmt
+
+
+class CodeStore:
+    """Content-addressed render cache: <cache_dir>/<key[:2]>/<key>.<fmt>"""
+
+    def __init__(self, cache_dir=CACHE_DIR, workers=WORKERS):
+        self.cache_dir = cache_dir
+        self.workers = workers
+        self._pool = ProcessPool(workers)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.rendered = 0
+
+    def path_for(self, uid, spec):
+        key = cache_key(uid, spec)
+        return os.path.join(self.cache_dir, key[:2], f"{key}.{spec.fmt}")
+
+    def get(self, uid, spec):
+        """Path of the rendered code (rendered in-process on a miss)"""
+        return self.ensure([uid], spec)[0]
+
+    def ensure(self, uids, spec):
+        """Paths for every UID, rendering cache misses in the process pool"""
+        paths = [self.path_for(uid, spec) for uid in uids]
+        jobs = [(uid, spec, path) for uid, path in zip(uids, paths) if not os.path.exists(path)]
+        if len(jobs) < INLINE_RENDER_MAX or self.workers <= 1:
+            for job in jobs:
+                render_to_file(job)
+        else:
+            try:
+                self._render_in_pool(jobs)
+            except BrokenProcessPool:
+                # A worker died mid-render: start a fresh pool and retry what is still missing
+                # once; a second crash fails this request only (the next one respawns the pool)
+                self._pool.close()
+                try:
+                    self._render_in_pool([job for job in jobs if not os.path.exists(job[2])])
+                except BrokenProcessPool:
+                    self._pool.close()
+                    raise
+        with self._lock:
+            self.hits += len(uids) - len(jobs)
+            self.rendered += len(jobs)
+        return paths
+
+    def _render_in_pool(self, jobs):
+        self._pool.map(render_to_file, jobs, chunksize=max(1, len(jobs) // (4 * self.workers)))
+
+    def iter_zip(self, uids, spec, chunk_size=ZIP_CHUNK):
+        """ZIP archive bytes of every UID's code, rendered and emitted chunk by chunk"""
+        sink = _ZipSink()
+        compression = zipfile.ZIP_STORED if spec.fmt == "png" else zipfile.ZIP_DEFLATED
+        with zipfile.ZipFile(sink, "w", compression) as zf:
+            for start in range(0, len(uids), chunk_size):
+                chunk = uids[start:start + chunk_size]
+                for uid, path in zip(chunk, self.ensure(chunk, spec)):
+                    zf.write(path, archive_name(uid, spec))
+                yield sink.drain()
+        yield sink.drain()
+
+    def stats(self):
+        total = self.hits + self.rendered
+        return {"hits": self.hits, "rendered": self.rendered,
+                "hit_ratio": round(self.hits / total, 4) if total else 0.0}
+
+    def close(self):
+        self._pool.close()
+
+
+class _ZipSink:
+    """Write-only, non-seekable file object; zipfile then emits data descriptors"""
+
+    def __init__(self):
+        self._buf = bytearray()
+
+    def write(self, data):
+        self._buf += data
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        out = bytes(self._buf)
+        self._buf.clear()
+        return out
+
+
+def lot_uids(conn, lot_no, vendor_id=None):
+    where, params = "lot_no=%s", [lot_no]
+    if vendor_id:
+        where += " AND vendor_id=%s"
+        params.append(vendor_id)
+    cur = conn.cursor()
+    try:
+        cur.execute(f"SELECT uid FROM items WHERE {where} ORDER BY uid", params)
+        return [row[0] for row in cur.fetchall()]
+    finally:
+        cur.close()
+
+
+# ---------------- CLI ----------------
+def main():
+    parser = argparse.ArgumentParser(description="Render engravable codes for item UIDs")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--uid")
+    target.add_argument("--lot", dest="lot_no", help="all items of a lot, written as a ZIP")
+    parser.add_argument("--vendor", dest="vendor_id")
+    parser.add_argument("--symbology", choices=SYMBOLOGIES, default="qr")
+    parser.add_argument("--format", choices=list(FORMATS), default="png")
+    parser.add_argument("--scale", type=int, default=10)
+    parser.add_argument("--border", type=int)
+    parser.add_argument("--module-mm", type=float, default=0.5)
+    parser.add_argument("--cache-dir", default=CACHE_DIR)
+    parser.add_argument("-o", "--output", help="output file (default: stdout)")
+    args = parser.parse_args()
+
+    try:
+        spec = make_spec(args.symbology, args.format, args.scale, args.border, args.module_mm)
+    except ValueError as e:
+        parser.error(str(e))
+    store = CodeStore(args.cache_dir)
+
+    if args.uid:
+        with open(store.get(args.uid, spec), "rb") as f:
+            parts = [f.read()]
+    else:
+        import db
+
+        conn = db.connect()
+        try:
+            uids = lot_uids(conn, args.lot_no, args.vendor_id)
+        finally:
+            conn.close()
+        if not uids:
+            parser.error(f"no items in lot {args.lot_no}")
+        parts = store.iter_zip(uids, spec)
+
+    out = open(args.output, "wb") if args.output else sys.stdout.buffer
+    try:
+        for part in parts:
+            out.write(part)
+    finally:
+        if args.output:
+            out.close()
+        store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+"""
+db.py
+
+Shared database access for scanning_service, init_employees_db and the CLIs.
+
+Configuration comes from the environment:
+- DB_HOST, DB_PORT, DB_USER, DB_PASS, DB_NAME: the primary (defaults: local MySQL)
+- DB_REPLICAS: comma-separated read replicas as host[:port] (same user and database)
+- DB_BACKEND=sqlite: use the SQLite stand-in instead (sqlite_backend.py); DB_NAME is
+  then a file path or "file:...?mode=memory&cache=shared" URI and DB_REPLICAS lists
+  more paths, so replica routing can be exercised without any server
+
+Router sends writes to the primary and reads to the replicas (round robin):
+- read-your-writes: after mark_written(uid), reads of that uid go to the primary for
+  DB_STICKY_SECONDS (replica lag budget); mark_written() with no keys makes every
+  read sticky for that long (bulk/lot writes). Stickiness is per process
+- failover: a replica whose connection fails is skipped for DB_REPLICA_DOWN_SECONDS,
+  then tried again; with no replica available reads fall back to the primary
+- a replica whose pool is merely exhausted is skipped for that read only
+
+The routing decisions (read_candidates, replica_failed, count) are separate from the
+checkout itself, so async_scanning_service.AsyncRouter applies the same rules to its
+async pools.
+"""
+
+import itertools
+import os
+import threading
+import time
+from collections import Counter
+
+import mysql.connector
+
+from cache import MISSING, TTLCache
+from db_pool import ConnectionPool, PoolTimeout
+
+BACKEND = os.getenv("DB_BACKEND", "mysql")
+STICKY_SECONDS = float(os.getenv("DB_STICKY_SECONDS", 5))
+STICKY_MAX_KEYS = 100000
+DOWN_SECONDS = float(os.getenv("DB_REPLICA_DOWN_SECONDS", 30))
+
+
+def config_from_env():
+    """mysql.connector.connect() kwargs for the primary"""
+    return {
+        "host": os.getenv("DB_HOST", "127.0.0.1"),
+        "port": int(os.getenv("DB_PORT", 3306)),
+        "user": os.getenv("DB_USER", "root"),
+        "password": os.getenv("DB_PASS", "0001"),
+        "database": os.getenv("DB_NAME", "sih_qr_db"),
+        "charset": "utf8mb4"
+    }
+
+
+def replica_configs(primary):
+    """{name: connect kwargs} for each DB_REPLICAS entry, credentials taken from the primary"""
+    replicas = {}
+    for entry in filter(None, (e.strip() for e in os.getenv("DB_REPLICAS", "").split(","))):
+        if BACKEND == "sqlite":
+            replicas[entry] = {"database": entry}
+            continue
+        host, _, port = entry.partition(":")
+        replicas[entry] = {**primary, "host": host, "port": int(port or 3306)}
+    return replicas
+
+
+DB_CONFIG = config_from_env()
+
+
+def connect(config=None, **overrides):
+    """New connection to one node (DB_CONFIG by default) with the configured backend"""
+    config = {**(config or DB_CONFIG), **overrides}
+    if BACKEND == "sqlite":
+        import sqlite_backend
+        return sqlite_backend.connect(config["database"])
+    return mysql.connector.connect(**config)
+
+
+class Router:
+    """Primary + replica ConnectionPools; see the module docstring for the routing rules"""
+
+    def __init__(self, primary, replicas=(), sticky_seconds=STICKY_SECONDS, down_seconds=DOWN_SECONDS):
+        """primary: ConnectionPool; replicas: [(name, ConnectionPool), ...]"""
+        self.primary = primary
+        self.replicas = list(replicas)
+        self.sticky_seconds = sticky_seconds
+        self.down_seconds = down_seconds
+        self._sticky = TTLCache(maxsize=STICKY_MAX_KEYS, ttl=sticky_seconds)
+        self._all_sticky_until = 0.0
+        self._down_until = [0.0] * len(self.replicas)
+        self._next = itertools.count()
+        self._lock = threading.Lock()
+        self.counts = Counter()
+
+    def count(self, name):
+        with self._lock:
+            self.counts[name] += 1
+
+    # ---------------- ROUTING ----------------
+    def write(self):
+        """Primary connection (writes, and reads that must see the latest commit)"""
+        return self.primary.get()
+
+    def mark_written(self, *keys):
+        """Route reads of these keys (or of everything, with no keys) to the primary for a while"""
+        if not keys:
+            self._all_sticky_until = time.monotonic() + self.sticky_seconds
+        for key in keys:
+            self._sticky.set(key, True)
+
+    def is_sticky(self, keys):
+        if time.monotonic() < self._all_sticky_until:
+            return True
+        return any(self._sticky.get(key) is not MISSING for key in keys)
+
+    def read(self, *keys):
+        """Connection for a read of keys (e.g. UIDs): a healthy replica unless sticky"""
+        candidates = self.read_candidates(keys)
+        for index, pool in candidates or ():
+            try:
+                conn = pool.get()
+            except PoolTimeout:
+                continue  # busy, not down
+            except Exception:
+                self.replica_failed(index)
+                continue
+            self.count("replica_reads")
+            return conn
+        if candidates is not None:
+            self.count("primary_fallbacks")
+        return self.primary.get()
+
+    def read_candidates(self, keys):
+        """
+        [(index, pool), ...] of the replicas to try in turn for a read of keys, or None
+        when the read belongs on the primary (no replicas, or sticky). Falling off the
+        end of the list is a primary fallback.
+        """
+        if not self.replicas:
+            return None
+        if self.is_sticky(keys):
+            self.count("sticky_reads")
+            return None
+        start = next(self._next)
+        now = time.monotonic()
+        order = [(start + i) % len(self.replicas) for i in range(len(self.replicas))]
+        return [(index, self.replicas[index][1]) for index in order if self._down_until[index] <= now]
+
+    def replica_failed(self, index):
+        """Skip replica `index` for down_seconds after a failed connection"""
+        self._down_until[index] = time.monotonic() + self.down_seconds
+        self.count("replica_failures")
+
+    # ---------------- STATS ----------------
+    def stats(self):
+        now = time.monotonic()
+        with self._lock:
+            counts = dict(self.counts)
+        return {
+            "primary": self.primary.stats(),
+            "replicas": [{"name": name, "down": self._down_until[i] > now, **pool.stats()}
+                         for i, (name, pool) in enumerate(self.replicas)],
+            "routing": {k: counts.get(k, 0) for k in
+                        ("replica_reads", "sticky_reads", "primary_fallbacks", "replica_failures")}
+        }
+
+    def close_all(self):
+        self.primary.close_all()
+        for _, pool in self.replicas:
+            pool.close_all()
+
+
+def from_env(pool_config):
+    """Router over DB_CONFIG and DB_REPLICAS, one pool (pool_config kwargs) per node"""
+    router = Router(ConnectionPool(lambda: connect(DB_CONFIG), **pool_config),
+                    [(name, ConnectionPool(lambda c=config: connect(c), **pool_config))
+                     for name, config in replica_configs(DB_CONFIG).items()])
+    if BACKEND == "sqlite":
+        # Keep shared in-memory databases alive and make sure every node has the tables
+        import sqlite_backend
+        router.keepers = [connect(c) for c in [DB_CONFIG, *replica_configs(DB_CONFIG).values()]]
+        for keeper in router.keepers:
+            sqlite_backend.create_schema(keeper)
+    return router
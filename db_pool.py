@@ -0,0 +1,199 @@
+"""
+db_pool.py
+
+Bounded, thread-safe connection pool used by scanning_service.
+
+- Connections are created lazily up to `size`
+- Every checkout is health-checked (ping) before being handed out
+- Connections older than `max_lifetime` or idle longer than `max_idle` are recycled
+- Checkout blocks up to `timeout` seconds, then raises PoolTimeout
+- stats() reports in-use / idle counts and checkout wait times
+"""
+
+import threading
+import time
+from collections import deque
+
+
+class PoolTimeout(Exception):
+    """Raised when no connection becomes available within the checkout timeout."""
+
+
+def default_health_check(conn):
+    """mysql.connector's is_connected() pings the server."""
+    return conn.is_connected()
+
+
+class PooledConnection:
+    """Proxy returned by ConnectionPool.get(); close() gives the connection back to the pool."""
+
+    def __init__(self, pool, raw, created_at):
+        self._pool = pool
+        self._raw = raw
+        self._created_at = created_at
+        self._released = False
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+    def close(self):
+        if not self._released:
+            self._released = True
+            self._pool._release(self._raw, self._created_at)
+
+    def discard(self):
+        """Close the underlying connection instead of returning it (e.g. after an abandoned stream)"""
+        if not self._released:
+            self._released = True
+            self._pool._close_quietly(self._raw)
+            self._pool._discard_slot()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class ConnectionPool:
+    def __init__(self, connect, size=10, timeout=5.0, max_lifetime=1800.0,
+                 max_idle=300.0, health_check=default_health_check):
+        """
+        connect: zero-arg callable returning a new DB-API connection
+        size: max number of open connections (in use + idle)
+        timeout: seconds to wait for a free connection before raising PoolTimeout
+        max_lifetime / max_idle: seconds before a connection is recycled
+        """
+        self._connect = connect
+        self.size = size
+        self.timeout = timeout
+        self.max_lifetime = max_lifetime
+        self.max_idle = max_idle
+        self._health_check = health_check
+
+        self._cond = threading.Condition()
+        self._idle = deque()  # (raw, created_at, released_at)
+        self._open = 0
+
+        # counters
+        self._checkouts = 0
+        self._created = 0
+        self._recycled = 0
+        self._failed_checks = 0
+        self._timeouts = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    # ---------------- CHECKOUT ----------------
+    def get(self):
+        """Check out a healthy connection, waiting up to `timeout` seconds."""
+        start = time.monotonic()
+        deadline = start + self.timeout
+
+        while True:
+            raw = created_at = None
+            with self._cond:
+                while True:
+                    if self._idle:
+                        raw, created_at, released_at = self._idle.pop()  # LIFO keeps hot conns warm
+                        now = time.monotonic()
+                        if (now - created_at > self.max_lifetime or
+                                now - released_at > self.max_idle):
+                            self._open -= 1
+                            self._recycled += 1
+                            self._close_quietly(raw)
+                            raw = None
+                            continue
+                        break
+                    if self._open < self.size:
+                        self._open += 1
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._timeouts += 1
+                        raise PoolTimeout(
+                            f"no DB connection available after {self.timeout}s (pool size {self.size})")
+                    self._cond.wait(remaining)
+
+            # Network work happens outside the lock
+            if raw is None:
+                try:
+                    raw = self._connect()
+                except Exception:
+                    self._discard_slot()
+                    raise
+                created_at = time.monotonic()
+                with self._cond:
+                    self._created += 1
+            elif not self._is_healthy(raw):
+                with self._cond:
+                    self._failed_checks += 1
+                self._close_quietly(raw)
+                self._discard_slot()
+                continue
+
+            waited = time.monotonic() - start
+            with self._cond:
+                self._checkouts += 1
+                self._wait_total += waited
+                self._wait_max = max(self._wait_max, waited)
+            return PooledConnection(self, raw, created_at)
+
+    def _is_healthy(self, raw):
+        try:
+            return bool(self._health_check(raw))
+        except Exception:
+            return False
+
+    # ---------------- RELEASE ----------------
+    def _release(self, raw, created_at):
+        # Never hand the next request a half-finished transaction
+        try:
+            if getattr(raw, "in_transaction", False):
+                raw.rollback()
+        except Exception:
+            self._close_quietly(raw)
+            self._discard_slot()
+            return
+
+        with self._cond:
+            self._idle.append((raw, created_at, time.monotonic()))
+            self._cond.notify()
+
+    def _discard_slot(self):
+        with self._cond:
+            self._open -= 1
+            self._cond.notify()
+
+    @staticmethod
+    def _close_quietly(raw):
+        try:
+            raw.close()
+        except Exception:
+            pass
+
+    def close_all(self):
+        """Close all idle connections; checked-out ones return to the pool as usual."""
+        with self._cond:
+            idle, self._idle = list(self._idle), deque()
+            self._open -= len(idle)
+        for raw, _, _ in idle:
+            self._close_quietly(raw)
+
+    # ---------------- STATS ----------------
+    def stats(self):
+        with self._cond:
+            idle = len(self._idle)
+            return {
+                "size": self.size,
+                "open": self._open,
+                "in_use": self._open - idle,
+                "idle": idle,
+                "checkouts": self._checkouts,
+                "created": self._created,
+                "recycled": self._recycled,
+                "failed_health_checks": self._failed_checks,
+                "timeouts": self._timeouts,
+                "avg_wait_ms": round(1000 * self._wait_total / self._checkouts, 3) if self._checkouts else 0.0,
+                "max_wait_ms": round(1000 * self._wait_max, 3),
+            }
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+export_history.py
+
+Streaming export of item lifecycle history ('statuses' joined with 'items')
+for warranty audits. Used by scanning_service's /export/history endpoint and
+runnable as a CLI.
+
+- Rows come from an unbuffered (server-side) cursor in chunks of CHUNK_SIZE,
+  so memory stays flat no matter how many rows are exported
+- Output is NDJSON or CSV, optionally gzip-compressed on the fly
+- Rows are ordered by (uid, updated_at, id), which the statuses(uid, updated_at)
+  index already provides, so MySQL never sorts the result
+
+CLI:
+  python export_history.py --format csv --gzip -o history.csv.gz --lot LOT-42
+"""
+
+import argparse
+import csv
+import io
+import json
+import sys
+import zlib
+
+from warranty import expiry_dates
+
+CHUNK_SIZE = 2000
+
+COLUMNS = ["status_id", "uid", "status", "location", "note", "updated_at", "recorded_at", "employee_id",
+           "component_type", "vendor_id", "lot_no", "serial_no", "mfg_date", "warranty_years",
+           "expiry_date"]
+
+FILTERS = ("uid", "vendor_id", "lot_no", "status", "since", "until")
+
+
+def build_query(filters):
+    where, params = [], []
+    if filters.get("uid"):
+        where.append("s.uid = %s")
+        params.append(filters["uid"])
+    if filters.get("vendor_id"):
+        where.append("i.vendor_id = %s")
+        params.append(filters["vendor_id"])
+    if filters.get("lot_no"):
+        where.append("i.lot_no = %s")
+        params.append(filters["lot_no"])
+    if filters.get("status"):
+        where.append("s.status = %s")
+        params.append(filters["status"])
+    if filters.get("since"):
+        where.append("s.updated_at >= %s")
+        params.append(filters["since"])
+    if filters.get("until"):
+        where.append("s.updated_at < %s")
+        params.append(filters["until"])
+
+    sql = f"""
+        SELECT s.id AS status_id, s.uid, s.status, s.location, s.note, s.updated_at, s.recorded_at, s.employee_id,
+               i.component_type, i.vendor_id, i.lot_no, i.serial_no, i.mfg_date, i.warranty_years
+        FROM statuses s
+        JOIN items i ON i.uid = s.uid
+        {"WHERE " + " AND ".join(where) if where else ""}
+        ORDER BY s.uid, s.updated_at, s.id
+    """
+    return sql, params
+
+
+def iter_rows(conn, filters, chunk_size=CHUNK_SIZE):
+    """Yield lists of row dicts (with expiry_date, computed per chunk), chunk_size rows at a time"""
+    sql, params = build_query(filters)
+    cur = conn.cursor(dictionary=True, buffered=False)
+    cur.execute(sql, params)
+    while True:
+        rows = cur.fetchmany(chunk_size)
+        if not rows:
+            break
+        expiries = expiry_dates([r.get("mfg_date") for r in rows], [r.get("warranty_years") for r in rows])
+        for row, expiry in zip(rows, expiries):
+            row["expiry_date"] = expiry
+        yield rows
+    cur.close()
+
+
+def json_value(value):
+    """Column value as JSON: numbers as is, everything else (dates, decimals) as text"""
+    return None if value is None else value if isinstance(value, (int, float)) else str(value)
+
+
+def format_ndjson(chunks):
+    for rows in chunks:
+        yield "".join(json.dumps({c: json_value(r.get(c)) for c in COLUMNS}) + "\n" for r in rows).encode()
+
+
+def format_csv(chunks):
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(COLUMNS)
+    yield buf.getvalue().encode()  # header goes out before the query returns anything
+    for rows in chunks:
+        buf.seek(0)
+        buf.truncate()
+        writer.writerows([["" if r.get(c) is None else r.get(c) for c in COLUMNS] for r in rows])
+        yield buf.getvalue().encode()
+
+
+def gzip_stream(parts):
+    """Compress an iterable of bytes into a gzip stream chunk by chunk"""
+    z = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31 → gzip container
+    for part in parts:
+        out = z.compress(part)
+        if out:
+            yield out
+    yield z.flush()
+
+
+def export(conn, fmt="ndjson", gzip=False, filters=None, chunk_size=CHUNK_SIZE):
+    """Iterator of output bytes; pull from it to drive the export"""
+    if fmt not in ("ndjson", "csv"):
+        raise ValueError("format must be 'ndjson' or 'csv'")
+    chunks = iter_rows(conn, filters or {}, chunk_size)
+    parts = format_csv(chunks) if fmt == "csv" else format_ndjson(chunks)
+    return gzip_stream(parts) if gzip else parts
+
+
+def content_type(fmt, gzip):
+    if gzip:
+        return "application/gzip"
+    return "text/csv" if fmt == "csv" else "application/x-ndjson"
+
+
+def filename(fmt, gzip):
+    return f"status_history.{fmt}" + (".gz" if gzip else "")
+
+
+# ---------------- CLI ----------------
+def main():
+    parser = argparse.ArgumentParser(description="Export item lifecycle history")
+    parser.add_argument("--format", choices=["ndjson", "csv"], default="ndjson")
+    parser.add_argument("--gzip", action="store_true")
+    parser.add_argument("-o", "--output", help="output file (default: stdout)")
+    parser.add_argument("--uid")
+    parser.add_argument("--vendor", dest="vendor_id")
+    parser.add_argument("--lot", dest="lot_no")
+    parser.add_argument("--status")
+    parser.add_argument("--since", help="updated_at >= (YYYY-MM-DD[ HH:MM:SS])")
+    parser.add_argument("--until", help="updated_at < (YYYY-MM-DD[ HH:MM:SS])")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    args = parser.parse_args()
+
+    import db
+
+    filters = {k: getattr(args, k) for k in FILTERS}
+    conn = db.connect()
+    out = open(args.output, "wb") if args.output else sys.stdout.buffer
+    try:
+        for part in export(conn, args.format, args.gzip, filters, args.chunk_size):
+            out.write(part)
+    finally:
+        if args.output:
+            out.close()
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,215 @@
+"""
+image_decode.py
+
+Decodes laser-etched QR / Data Matrix marks from photos, for scanning_service's
+/scan/image endpoint (handsets too weak to decode on-device, depot cameras
+pushing images in bulk).
+
+Pipeline per image; it stops at the first stage that yields a code:
+1) load: decode the upload (JPEG DCT-downscaled while decoding), grayscale,
+   cap the longest side at MAX_SIDE
+2) raw: the grayscale image as-is
+3) threshold: autocontrast + Otsu binarisation (uneven light, low-contrast etching)
+4) deskew: rotate by the angle whose row projection is sharpest
+5) invert: etched marks are often light on dark metal
+
+Decoders are optional; every installed one is tried per stage:
+pyzbar (QR), OpenCV QRCodeDetector, pylibdmtx (Data Matrix).
+
+DecodePool runs decode_image() in a process pool so images decode on every core.
+"""
+
+import io
+import os
+import time
+from concurrent.futures.process import BrokenProcessPool
+
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from process_pool import ProcessPool
+
+try:
+    from pyzbar import pyzbar
+except ImportError:
+    pyzbar = None
+try:
+    import cv2
+    import numpy as np
+except ImportError:
+    cv2 = None
+try:
+    from pylibdmtx import pylibdmtx
+except ImportError:
+    pylibdmtx = None
+
+MAX_SIDE = int(os.getenv("DECODE_MAX_SIDE", 1600))
+DESKEW_SIDE = 256          # deskew angle is searched on a copy this size
+DESKEW_ANGLES = range(-15, 16)
+DMTX_TIMEOUT_MS = 300
+WORKERS = int(os.getenv("DECODE_WORKERS", 0)) or os.cpu_count() or 1
+
+
+# ---------------- DECODERS ----------------
+def _pyzbar(img):
+    return [r.data.decode("utf-8", "replace") for r in pyzbar.decode(img)]
+
+
+def _opencv(img):
+    ok, texts, _, _ = cv2.QRCodeDetector().detectAndDecodeMulti(np.asarray(img))
+    return [t for t in texts if t] if ok else []
+
+
+def _pylibdmtx(img):
+    return [r.data.decode("utf-8", "replace") for r in pylibdmtx.decode(img, timeout=DMTX_TIMEOUT_MS)]
+
+
+DECODERS = [(name, fn) for name, fn, lib in [("pyzbar", _pyzbar, pyzbar), ("opencv", _opencv, cv2),
+                                             ("pylibdmtx", _pylibdmtx, pylibdmtx)] if lib is not None]
+
+
+def available_decoders():
+    return [name for name, _ in DECODERS]
+
+
+def run_decoders(img):
+    found = []
+    for _, fn in DECODERS:
+        for text in fn(img):
+            if text not in found:
+                found.append(text)
+    return found
+
+
+# ---------------- PREPROCESSING ----------------
+def load_gray(data):
+    img = Image.open(io.BytesIO(data))
+    img.draft("L", (MAX_SIDE, MAX_SIDE))  # JPEG: decode at reduced scale, much cheaper
+    img = ImageOps.exif_transpose(img).convert("L")
+    img.thumbnail((MAX_SIDE, MAX_SIDE))
+    return img
+
+
+def otsu_level(img):
+    hist = img.histogram()
+    total = sum(hist)
+    sum_all = sum(i * h for i, h in enumerate(hist))
+    sum_bg = weight_bg = 0
+    best, level = -1.0, 127
+    for i, h in enumerate(hist):
+        weight_bg += h
+        if weight_bg == 0:
+            continue
+        weight_fg = total - weight_bg
+        if weight_fg == 0:
+            break
+        sum_bg += i * h
+        mean_bg = sum_bg / weight_bg
+        mean_fg = (sum_all - sum_bg) / weight_fg
+        between = weight_bg * weight_fg * (mean_bg - mean_fg) ** 2
+        if between > best:
+            best, level = between, i
+    return level
+
+
+def threshold(img):
+    img = ImageOps.autocontrast(img, cutoff=1)
+    level = otsu_level(img)
+    return img.point(lambda v: 255 if v > level else 0)
+
+
+def skew_angle(binary):
+    """Angle (degrees) that best aligns module rows: max variance of the row means"""
+    small = binary.copy()
+    small.thumbnail((DESKEW_SIDE, DESKEW_SIDE))
+    best, best_angle = -1.0, 0
+    for angle in DESKEW_ANGLES:
+        rotated = small.rotate(angle, resample=Image.NEAREST, expand=True, fillcolor=255)
+        rows = list(rotated.resize((1, rotated.height), Image.BOX).getdata())
+        mean = sum(rows) / len(rows)
+        variance = sum((r - mean) ** 2 for r in rows) / len(rows)
+        if variance > best:
+            best, best_angle = variance, angle
+    return best_angle
+
+
+def decode_image(data):
+    """
+    Process-pool worker. Returns { "uids": [...], "stage": "threshold" | None,
+    "timings_ms": { stage: ms }, "error": str (only on failure) }. Never raises: a
+    failure, whatever the decoder threw, stays with this image and the batch goes on.
+    """
+    timings = {}
+
+    def failed(error):
+        return {"uids": [], "stage": None, "timings_ms": timings, "error": error}
+
+    def timed(stage, fn, *args):
+        t0 = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            timings[stage] = round((time.perf_counter() - t0) * 1000, 3)
+
+    try:
+        gray = timed("load", load_gray, data)
+    except Image.DecompressionBombError:
+        return failed("image too large")
+    except (UnidentifiedImageError, OSError, ValueError):
+        return failed("not a readable image")
+    except Exception as e:
+        return failed(f"not a readable image ({type(e).__name__})")
+
+    candidates = [("raw", lambda: gray)]
+    binary = {}
+
+    def thresholded():
+        binary["img"] = threshold(gray)
+        return binary["img"]
+
+    def deskewed():
+        angle = skew_angle(binary["img"])
+        binary["angle"] = angle
+        return binary["img"].rotate(angle, resample=Image.BICUBIC, expand=True, fillcolor=255) if angle else None
+
+    candidates += [("threshold", thresholded), ("deskew", deskewed),
+                   ("invert", lambda: ImageOps.invert(binary["img"]))]
+
+    for stage, prepare in candidates:
+        def attempt():
+            img = prepare()
+            return run_decoders(img) if img is not None else []
+        try:
+            uids = timed(stage, attempt)
+        except Exception as e:
+            return failed(f"decode failed at {stage} ({type(e).__name__})")
+        if uids:
+            result = {"uids": uids, "stage": stage, "timings_ms": timings}
+            if "angle" in binary:
+                result["skew_deg"] = binary["angle"]
+            return result
+    return failed("no code found")
+
+
+class DecodePool:
+    def __init__(self, workers=WORKERS):
+        self.workers = workers
+        self._pool = ProcessPool(workers)
+
+    def decode_many(self, images):
+        """images: list of bytes → list of decode_image() results, same order"""
+        if self.workers <= 1:
+            return [decode_image(data) for data in images]
+        futures = [self._pool.submit(decode_image, data) for data in images]
+        results = []
+        for future in futures:
+            try:
+                results.append(future.result())
+            except BrokenProcessPool:
+                # A worker died mid-decode (killed for memory, decoder segfault): fail the
+                # images it took down and start a fresh pool for the next request
+                self._pool.close()
+                results.append({"uids": [], "stage": None, "timings_ms": {}, "error": "decoder crashed"})
+        return results
+
+    def close(self):
+        self._pool.close()
@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+"""
+ingest.py
+
+Bulk registration of manufactured items from a vendor manifest. Used by
+scanning_service's /ingest endpoint and runnable as a CLI.
+
+- Manifest: CSV (with header) or NDJSON; one item per row with vendor_id, lot_no,
+  serial_no, mfg_date (YYYY-MM-DD), warranty_years and optionally component_type, uid
+- Rows are validated while the file streams in; bad rows are reported with their
+  line number and the rest still load
+- Items without a uid get a deterministic one (hash of vendor/lot/serial), so
+  re-running a manifest reports the same items as already registered instead of
+  creating duplicates
+- Each chunk of CHUNK_SIZE rows is one multi-row INSERT into items plus one into
+  statuses (the initial 'Manufactured' row) in a single transaction, which also
+  adds the new items to the analytics rollups
+  (or LOAD DATA LOCAL INFILE with --load-data, MySQL only)
+
+CLI:
+  python ingest.py manifest.csv --employee-id 5
+  python ingest.py lot42.ndjson --load-data
+"""
+
+import argparse
+import csv
+import hashlib
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+from collections import Counter
+from datetime import date, datetime
+
+from mysql.connector import IntegrityError
+
+import analytics
+
+CHUNK_SIZE = 1000
+MAX_REPORTED_REJECTS = 1000
+MAX_WARRANTY_YEARS = 50
+INITIAL_STATUS = "Manufactured"
+
+REQUIRED = ("vendor_id", "lot_no", "serial_no", "mfg_date", "warranty_years")
+ITEM_COLUMNS = ("uid", "component_type", "vendor_id", "lot_no", "serial_no", "mfg_date", "warranty_years",
+                "current_status", "last_updated")
+STATUS_COLUMNS = ("uid", "status", "location", "note", "updated_at", "employee_id")
+TEXT_LIMITS = {"uid": 64, "component_type": 50, "vendor_id": 50, "lot_no": 50, "serial_no": 50}
+
+
+def make_uid(vendor_id, lot_no, serial_no):
+    digest = hashlib.sha256(f"{vendor_id}|{lot_no}|{serial_no}".encode()).hexdigest()
+    return f"UID-{digest[:16].upper()}"
+
+
+def read_manifest(stream, fmt):
+    """Yield (line_no, row dict or error string) from a text stream"""
+    if fmt == "csv":
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row
+        return
+    for line_no, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            yield line_no, f"invalid JSON: {e}"
+            continue
+        yield line_no, row if isinstance(row, dict) else "expected a JSON object"
+
+
+def validate_row(row, today):
+    """Returns (item tuple without status columns, None) or (None, error)"""
+    if not isinstance(row, dict):
+        return None, row
+    values = {k: (str(v).strip() if v is not None else "") for k, v in row.items() if k}
+    missing = [f for f in REQUIRED if not values.get(f)]
+    if missing:
+        return None, f"missing {', '.join(missing)}"
+    for field, limit in TEXT_LIMITS.items():
+        if len(values.get(field, "")) > limit:
+            return None, f"{field} longer than {limit} characters"
+    try:
+        mfg_date = date.fromisoformat(values["mfg_date"])
+    except ValueError:
+        return None, "mfg_date must be YYYY-MM-DD"
+    if mfg_date > today:
+        return None, "mfg_date is in the future"
+    try:
+        warranty_years = int(values["warranty_years"])
+    except ValueError:
+        return None, "warranty_years must be an integer"
+    if not 1 <= warranty_years <= MAX_WARRANTY_YEARS:
+        return None, f"warranty_years must be 1..{MAX_WARRANTY_YEARS}"
+
+    uid = values.get("uid") or make_uid(values["vendor_id"], values["lot_no"], values["serial_no"])
+    return (uid, values.get("component_type") or None, values["vendor_id"], values["lot_no"],
+            values["serial_no"], mfg_date, warranty_years), None
+
+
+# ---------------- LOADERS ----------------
+def insert_rows(cur, table, columns, rows):
+    """One multi-row INSERT for the whole chunk"""
+    row_sql = "(" + ",".join(["%s"] * len(columns)) + ")"
+    cur.execute(f"INSERT INTO {table} ({', '.join(columns)}) VALUES {','.join([row_sql] * len(rows))}",
+                [v for row in rows for v in row])
+
+
+def _tsv_value(value):
+    if value is None:
+        return "\\N"
+    return str(value).replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n")
+
+
+def load_data_rows(cur, table, columns, rows):
+    """
+    LOAD DATA LOCAL INFILE from a temporary TSV (connection needs allow_local_infile=True).
+    LOCAL turns duplicate keys into warnings and skips those rows, so a short row count
+    raises IntegrityError like the multi-row INSERT would: the caller rolls back instead
+    of writing status rows and rollup deltas for items another ingest registered.
+    """
+    with tempfile.NamedTemporaryFile("w", suffix=".tsv", delete=False, encoding="utf-8", newline="") as f:
+        for row in rows:
+            f.write("\t".join(_tsv_value(v) for v in row) + "\n")
+    try:
+        cur.execute(f"LOAD DATA LOCAL INFILE %s INTO TABLE {table} CHARACTER SET utf8mb4 "
+                    f"FIELDS TERMINATED BY '\\t' LINES TERMINATED BY '\\n' ({', '.join(columns)})", (f.name,))
+    finally:
+        os.unlink(f.name)
+    if cur.rowcount != len(rows):
+        raise IntegrityError(msg=f"LOAD DATA skipped {len(rows) - cur.rowcount} of {len(rows)} rows in {table}")
+
+
+def existing_uids(cur, uids):
+    placeholders = ",".join(["%s"] * len(uids))
+    cur.execute(f"SELECT uid FROM items WHERE uid IN ({placeholders})", uids)
+    return {row[0] for row in cur.fetchall()}
+
+
+class Report:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.read = 0
+        self.inserted = 0
+        self.rejected = 0
+        self.rejects = []  # first MAX_REPORTED_REJECTS of {"line": n, "uid": ..., "error": ...}
+        self.lots = {}
+        self.chunks = 0
+
+    def reject(self, line_no, error, uid=None):
+        self.rejected += 1
+        if len(self.rejects) < MAX_REPORTED_REJECTS:
+            self.rejects.append({"line": line_no, "uid": uid, "error": error})
+
+    def as_dict(self):
+        elapsed = time.perf_counter() - self.started
+        return {
+            "read": self.read,
+            "inserted": self.inserted,
+            "rejected": self.rejected,
+            "rejects": self.rejects,
+            "rejects_truncated": self.rejected > len(self.rejects),
+            "lots": self.lots,
+            "chunks": self.chunks,
+            "elapsed_s": round(elapsed, 3),
+            "rows_per_s": round(self.read / elapsed, 1) if elapsed else None
+        }
+
+
+def ingest(conn, stream, fmt="csv", employee_id=None, chunk_size=CHUNK_SIZE, load_data=False, source=None):
+    """
+    stream: text file object with the manifest. Commits per chunk, so a failure part
+    way through leaves the earlier chunks loaded (re-running skips them as duplicates).
+    Returns the Report.
+    """
+    if fmt not in ("csv", "ndjson"):
+        raise ValueError("format must be 'csv' or 'ndjson'")
+    loader = load_data_rows if load_data else insert_rows
+    note = f"Registered from manifest {source}" if source else "Registered from manifest"
+    today = date.today()
+    now = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
+    report = Report()
+    seen = set()
+    chunk = []  # (line_no, item tuple)
+    cur = conn.cursor()
+
+    def flush():
+        report.chunks += 1
+        for attempt in (1, 2):
+            taken = existing_uids(cur, [item[0] for _, item in chunk])
+            fresh = [item for _, item in chunk if item[0] not in taken]
+            try:
+                if fresh:
+                    loader(cur, "items", ITEM_COLUMNS, [item + (INITIAL_STATUS, now) for item in fresh])
+                    loader(cur, "statuses", STATUS_COLUMNS,
+                           [(item[0], INITIAL_STATUS, "Ingest", note, now, employee_id) for item in fresh])
+                    analytics.apply_deltas(cur, Counter(
+                        analytics.rollup_key((item[2], item[3], item[1]), INITIAL_STATUS) for item in fresh))
+                conn.commit()
+                break
+            except IntegrityError:
+                conn.rollback()
+                # A concurrent ingest registered some of these UIDs (a duplicate key, or rows
+                # LOAD DATA skipped): re-check once
+                if attempt == 2:
+                    raise
+        for line_no, item in chunk:
+            if item[0] in taken:
+                report.reject(line_no, "uid already registered", item[0])
+        for item in fresh:
+            report.lots[item[3]] = report.lots.get(item[3], 0) + 1
+        report.inserted += len(fresh)
+        chunk.clear()
+
+    try:
+        for line_no, row in read_manifest(stream, fmt):
+            report.read += 1
+            item, error = validate_row(row, today)
+            if error:
+                report.reject(line_no, error)
+                continue
+            if item[0] in seen:
+                report.reject(line_no, "duplicate item in manifest", item[0])
+                continue
+            seen.add(item[0])
+            chunk.append((line_no, item))
+            if len(chunk) >= chunk_size:
+                flush()
+        if chunk:
+            flush()
+    finally:
+        cur.close()
+    return report
+
+
+def detect_format(name, content_type=None):
+    if content_type and ("ndjson" in content_type or "jsonl" in content_type):
+        return "ndjson"
+    if name and name.endswith((".ndjson", ".jsonl", ".json")):
+        return "ndjson"
+    return "csv"
+
+
+# ---------------- CLI ----------------
+def main():
+    parser = argparse.ArgumentParser(description="Register manufactured items from a CSV/NDJSON manifest")
+    parser.add_argument("manifest", help="manifest file ('-' for stdin)")
+    parser.add_argument("--format", choices=["csv", "ndjson"], help="default: from the file extension")
+    parser.add_argument("--employee-id", type=int, help="recorded on the initial status rows")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    parser.add_argument("--load-data", action="store_true", help="use LOAD DATA LOCAL INFILE instead of INSERTs")
+    args = parser.parse_args()
+
+    import db
+
+    fmt = args.format or detect_format(args.manifest)
+    stream = (io.TextIOWrapper(sys.stdin.buffer, encoding="utf-8-sig", newline="") if args.manifest == "-"
+              else open(args.manifest, encoding="utf-8-sig", newline=""))
+    conn = db.connect(allow_local_infile=args.load_data)
+    try:
+        report = ingest(conn, stream, fmt, args.employee_id, args.chunk_size, args.load_data,
+                        source=os.path.basename(args.manifest))
+    finally:
+        stream.close()
+        conn.close()
+
+    result = report.as_dict()
+    print(f"read {result['read']}, inserted {result['inserted']}, rejected {result['rejected']} "
+          f"in {result['elapsed_s']}s ({result['rows_per_s']} rows/s)", file=sys.stderr)
+    for r in result["rejects"]:
+        print(f"  line {r['line']}: {r['error']}" + (f" ({r['uid']})" if r["uid"] else ""), file=sys.stderr)
+    json.dump(result, sys.stdout, indent=2)
+    print()
+
+
+if __name__ == "__main__":
+    main()
@@ -4,23 +4,17 @@ Run this script to create the employees table with sample data for the status up
 """
 
 import mysql.connector
-import os
 
-# Database configuration - matches the combined backend service
-DB_CONFIG = {
-    "host": os.getenv("DB_HOST", "gondola.proxy.rlwy.net"),
-    "port": int(os.getenv("DB_PORT", 24442)),
-    "user": os.getenv("DB_USER", "root"),
-    "password": os.getenv("DB_PASS", "SZiTeOCZgSbLTZLdDxlIsMKYGRlfxFsd"),
-    "database": os.getenv("DB_NAME", "sih_qr_db"),
-    "charset": "utf8mb4",
-    "autocommit": True
-}
+import db
+import migrations
+
+# Database configuration - shared with the backend service (db.py), with autocommit for the DDL below
+DB_CONFIG = {**db.DB_CONFIG, "autocommit": True}
 
 def create_employees_table():
     """Create employees table and insert sample data."""
     try:
-        conn = mysql.connector.connect(**DB_CONFIG)
+        conn = db.connect(DB_CONFIG)
         cursor = conn.cursor()
         
         # Create employees table
@@ -94,40 +88,9 @@ def create_employees_table():
                     except Exception as e3:
                         print(f"❌ Failed to insert employee {emp_id}: {e3}")
         
-        # Update statuses table to include employee_id column if it doesn't exist
-        try:
-            cursor.execute("ALTER TABLE statuses ADD COLUMN employee_id INT NULL")
-            print("✅ Added employee_id column to statuses table")
-        except mysql.connector.Error as e:
-            if "Duplicate column name" in str(e):
-                print("ℹ️  employee_id column already exists in statuses table")
-            else:
-                print(f"⚠️  Warning: Could not add employee_id column: {e}")
-        
-        # Add foreign key constraint (optional, may fail if data doesn't match)
-        try:
-            cursor.execute("""
-            ALTER TABLE statuses 
-            ADD CONSTRAINT fk_statuses_employee 
-            FOREIGN KEY (employee_id) REFERENCES employees(id) 
-            ON DELETE SET NULL
-            """)
-            print("✅ Added foreign key constraint for employee_id")
-        except mysql.connector.Error as e:
-            if "Duplicate" in str(e) or "already exists" in str(e):
-                print("ℹ️  Foreign key constraint already exists")
-            else:
-                print(f"⚠️  Warning: Could not add foreign key constraint: {e}")
-        
-        # Update items table to include current_status column if it doesn't exist
-        try:
-            cursor.execute("ALTER TABLE items ADD COLUMN current_status VARCHAR(50) DEFAULT 'Manufactured'")
-            print("✅ Added current_status column to items table")
-        except mysql.connector.Error as e:
-            if "Duplicate column name" in str(e):
-                print("ℹ️  current_status column already exists in items table")
-            else:
-                print(f"⚠️  Warning: Could not add current_status column: {e}")
+        # Schema changes (columns, indexes, backfills) are versioned migrations
+        applied = migrations.migrate(conn)
+        print(f"✅ Applied {len(applied)} schema migration(s)" if applied else "ℹ️  Schema is up to date")
         
         conn.commit()
         
@@ -0,0 +1,264 @@
+"""
+metrics.py
+
+Low-overhead hot-path instrumentation for the scanning services.
+
+- begin_request()/end_request(): per-request timer kept in a ContextVar
+  (works for Flask threads and asyncio tasks alike)
+- phase("item_query"): times one phase of the current request
+- count_query(): DB queries per request (InstrumentedConnection counts automatically)
+- Histograms per endpoint (latency, DB queries) and per endpoint+phase
+- Requests slower than SLOW_REQUEST_MS are logged with their phase breakdown
+- render_prometheus(): Prometheus text exposition format
+
+Outside a request (scripts, tests calling helpers directly) every call is a no-op.
+"""
+
+import logging
+import os
+import threading
+import time
+from contextvars import ContextVar
+
+ENABLED = os.getenv("METRICS_ENABLED", "1") != "0"
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", 500))
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+slow_log = logging.getLogger("scanning_service.slow")
+
+_current = ContextVar("request_timer", default=None)
+
+
+# ---------------- HISTOGRAM ----------------
+class Histogram:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        # Non-cumulative per-bucket counts; cumulated on render
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.sum += value
+        self.count += 1
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = {}        # (endpoint, status) -> count
+        self.latency = {}         # endpoint -> Histogram
+        self.phases = {}          # (endpoint, phase) -> Histogram
+        self.queries = {}         # endpoint -> Histogram
+        self.slow = {}            # endpoint -> count
+
+    def record(self, endpoint, status, elapsed, phases, queries, slow):
+        with self._lock:
+            key = (endpoint, status)
+            self.requests[key] = self.requests.get(key, 0) + 1
+            h = self.latency.get(endpoint)
+            if h is None:
+                h = self.latency[endpoint] = Histogram(LATENCY_BUCKETS)
+            h.observe(elapsed)
+            for name, seconds in phases.items():
+                h = self.phases.get((endpoint, name))
+                if h is None:
+                    h = self.phases[(endpoint, name)] = Histogram(LATENCY_BUCKETS)
+                h.observe(seconds)
+            h = self.queries.get(endpoint)
+            if h is None:
+                h = self.queries[endpoint] = Histogram(QUERY_BUCKETS)
+            h.observe(queries)
+            if slow:
+                self.slow[endpoint] = self.slow.get(endpoint, 0) + 1
+
+    def reset(self):
+        with self._lock:
+            self.requests.clear()
+            self.latency.clear()
+            self.phases.clear()
+            self.queries.clear()
+            self.slow.clear()
+
+
+registry = Registry()
+
+
+# ---------------- PER-REQUEST TIMER ----------------
+class RequestTimer:
+    __slots__ = ("start", "phases", "queries")
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.phases = {}
+        self.queries = 0
+
+
+class _Phase:
+    __slots__ = ("timer", "name", "t0")
+
+    def __init__(self, timer, name):
+        self.timer = timer
+        self.name = name
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        phases = self.timer.phases
+        phases[self.name] = phases.get(self.name, 0.0) + time.perf_counter() - self.t0
+        return False
+
+
+class _NoPhase:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NO_PHASE = _NoPhase()
+
+
+def begin_request():
+    if ENABLED:
+        _current.set(RequestTimer())
+
+
+def phase(name):
+    """with phase("commit"): ... — accumulates into the current request's breakdown"""
+    timer = _current.get()
+    return _Phase(timer, name) if timer is not None else _NO_PHASE
+
+
+def count_query(n=1):
+    timer = _current.get()
+    if timer is not None:
+        timer.queries += n
+
+
+def end_request(endpoint, status):
+    timer = _current.get()
+    if timer is None:
+        return
+    _current.set(None)
+    elapsed = time.perf_counter() - timer.start
+    slow = elapsed * 1000 >= SLOW_REQUEST_MS
+    registry.record(endpoint, status, elapsed, timer.phases, timer.queries, slow)
+    if slow:
+        breakdown = ", ".join(f"{k}={v * 1000:.1f}ms" for k, v in timer.phases.items())
+        slow_log.warning("slow request %s status=%s total=%.1fms queries=%d [%s]",
+                         endpoint, status, elapsed * 1000, timer.queries, breakdown)
+
+
+# ---------------- QUERY COUNTING ----------------
+class InstrumentedCursor:
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def execute(self, *args, **kwargs):
+        count_query()
+        return self._cursor.execute(*args, **kwargs)
+
+    def executemany(self, *args, **kwargs):
+        count_query()
+        return self._cursor.executemany(*args, **kwargs)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+
+class InstrumentedConnection:
+    """Wraps a (pooled) connection so every cursor counts its queries"""
+
+    def __init__(self, conn):
+        self._conn = conn
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def cursor(self, *args, **kwargs):
+        return InstrumentedCursor(self._conn.cursor(*args, **kwargs))
+
+    def commit(self):
+        with phase("commit"):
+            return self._conn.commit()
+
+    def close(self):
+        return self._conn.close()
+
+
+# ---------------- PROMETHEUS EXPOSITION ----------------
+def _labels(**labels):
+    parts = []
+    for k, v in labels.items():
+        v = str(v).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+        parts.append(f'{k}="{v}"')
+    return "{" + ",".join(parts) + "}"
+
+
+def _histogram_lines(name, hist, **labels):
+    lines = []
+    cumulative = 0
+    for bound, n in zip(hist.buckets, hist.counts):
+        cumulative += n
+        lines.append(f"{name}_bucket{_labels(**labels, le=bound)} {cumulative}")
+    lines.append(f"{name}_bucket{_labels(**labels, le='+Inf')} {hist.count}")
+    lines.append(f"{name}_sum{_labels(**labels)} {hist.sum}")
+    lines.append(f"{name}_count{_labels(**labels)} {hist.count}")
+    return lines
+
+
+def render_prometheus(gauges=None):
+    """
+    gauges: optional {metric_name: value} (e.g. pool / cache stats) appended as gauges
+    """
+    out = []
+    with registry._lock:
+        out.append("# HELP scanning_requests_total Requests by endpoint and HTTP status")
+        out.append("# TYPE scanning_requests_total counter")
+        for (endpoint, status), n in sorted(registry.requests.items()):
+            out.append(f"scanning_requests_total{_labels(endpoint=endpoint, status=status)} {n}")
+
+        out.append("# HELP scanning_request_duration_seconds End-to-end request latency")
+        out.append("# TYPE scanning_request_duration_seconds histogram")
+        for endpoint, h in sorted(registry.latency.items()):
+            out.extend(_histogram_lines("scanning_request_duration_seconds", h, endpoint=endpoint))
+
+        out.append("# HELP scanning_phase_duration_seconds Time spent per request phase")
+        out.append("# TYPE scanning_phase_duration_seconds histogram")
+        for (endpoint, name), h in sorted(registry.phases.items()):
+            out.extend(_histogram_lines("scanning_phase_duration_seconds", h, endpoint=endpoint, phase=name))
+
+        out.append("# HELP scanning_db_queries_per_request DB queries issued per request")
+        out.append("# TYPE scanning_db_queries_per_request histogram")
+        for endpoint, h in sorted(registry.queries.items()):
+            out.extend(_histogram_lines("scanning_db_queries_per_request", h, endpoint=endpoint))
+
+        out.append("# HELP scanning_slow_requests_total Requests over SLOW_REQUEST_MS")
+        out.append("# TYPE scanning_slow_requests_total counter")
+        for endpoint, n in sorted(registry.slow.items()):
+            out.append(f"scanning_slow_requests_total{_labels(endpoint=endpoint)} {n}")
+
+    for name, value in (gauges or {}).items():
+        if value is None:
+            continue
+        out.append(f"# TYPE {name} gauge")
+        out.append(f"{name} {value}")
+
+    return "\n".join(out) + "\n"
@@ -0,0 +1,341 @@
+#!/usr/bin/env python3
+"""
+migrations.py
+
+Versioned schema migrations for the MySQL database, and a check that the hot
+queries are served by indexes.
+
+- MIGRATIONS is an ordered list of (version, name, function); the versions that
+  have run are recorded in the schema_migrations table, so each one runs once
+- Every step inspects information_schema before changing anything, so databases
+  set up by the old ad-hoc init script are adopted without errors
+- Indexes are built with online DDL (ALGORITHM=INPLACE, LOCK=NONE): reads and
+  writes continue while the index builds
+- A MySQL named lock serialises concurrent runs (e.g. several replicas deploying)
+- check_indexes() EXPLAINs the /scan, /update_status, history, lot, employee and
+  /changes queries and reports any full table scan (MySQL or the SQLite stand-in)
+
+CLI:
+  python migrations.py status
+  python migrations.py migrate
+  python migrations.py check      # exit code 1 if a hot query scans a table
+"""
+
+import argparse
+import json
+import sys
+import time
+
+import mysql.connector
+
+LOCK_NAME = "sih_schema_migrations"
+LOCK_TIMEOUT = 60  # seconds to wait for a concurrent run to finish
+
+SCHEMA_TABLE = """
+CREATE TABLE IF NOT EXISTS schema_migrations (
+    version INT PRIMARY KEY,
+    name VARCHAR(100) NOT NULL,
+    applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    duration_ms INT
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+"""
+
+
+# ---------------- INTROSPECTION ----------------
+def column_exists(cursor, table, column):
+    cursor.execute("""
+        SELECT 1 FROM information_schema.columns
+        WHERE table_schema = DATABASE() AND table_name = %s AND column_name = %s
+    """, (table, column))
+    return cursor.fetchone() is not None
+
+
+def index_columns(cursor, table):
+    """{index name: [column, ...] in index order}"""
+    cursor.execute("""
+        SELECT index_name, column_name FROM information_schema.statistics
+        WHERE table_schema = DATABASE() AND table_name = %s
+        ORDER BY index_name, seq_in_index
+    """, (table,))
+    indexes = {}
+    for name, column in cursor.fetchall():
+        indexes.setdefault(name, []).append(column)
+    return indexes
+
+
+def constraint_exists(cursor, table, name):
+    cursor.execute("""
+        SELECT 1 FROM information_schema.table_constraints
+        WHERE table_schema = DATABASE() AND table_name = %s AND constraint_name = %s
+    """, (table, name))
+    return cursor.fetchone() is not None
+
+
+# ---------------- DDL HELPERS ----------------
+def add_column(cursor, table, column, definition):
+    if column_exists(cursor, table, column):
+        print(f"ℹ️  {table}.{column} already exists")
+        return
+    cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+    print(f"✅ Added {table}.{column}")
+
+
+def add_index(cursor, table, name, columns, unique=False):
+    """
+    Online index build. An existing index with the same leading columns (whatever
+    its name, e.g. one MySQL created for a foreign key) counts as present.
+    """
+    wanted = [c.strip() for c in columns.split(",")]
+    for existing, cols in index_columns(cursor, table).items():
+        if existing == name or cols[:len(wanted)] == wanted:
+            print(f"ℹ️  {table}({columns}) already covered by index {existing}")
+            return
+    kind = "UNIQUE INDEX" if unique else "INDEX"
+    cursor.execute(f"ALTER TABLE {table} ADD {kind} {name} ({columns}), ALGORITHM=INPLACE, LOCK=NONE")
+    print(f"✅ Added {table}({columns}) index {name}")
+
+
+# ---------------- MIGRATIONS ----------------
+def m001_status_columns(cursor):
+    """statuses.employee_id (with its foreign key) and items.current_status"""
+    add_column(cursor, "statuses", "employee_id", "INT NULL")
+    if constraint_exists(cursor, "statuses", "fk_statuses_employee"):
+        print("ℹ️  Foreign key fk_statuses_employee already exists")
+    else:
+        try:
+            cursor.execute("""
+                ALTER TABLE statuses ADD CONSTRAINT fk_statuses_employee
+                FOREIGN KEY (employee_id) REFERENCES employees(id) ON DELETE SET NULL
+            """)
+            print("✅ Added foreign key fk_statuses_employee")
+        except mysql.connector.Error as e:
+            # Optional: legacy rows may reference unknown employees
+            print(f"⚠️  Warning: Could not add foreign key constraint: {e}")
+    add_column(cursor, "items", "current_status", "VARCHAR(50) DEFAULT 'Manufactured'")
+
+
+def m002_latest_status(cursor):
+    """
+    items.current_status / items.last_updated are the authoritative latest status,
+    so /scan is a single primary-key lookup; backfilled from the newest statuses row
+    """
+    add_column(cursor, "items", "last_updated", "DATETIME NULL")
+    add_index(cursor, "statuses", "idx_statuses_uid_updated", "uid, updated_at")
+    cursor.execute("""
+        UPDATE items i
+        JOIN (
+            SELECT s.uid, s.status, s.updated_at FROM statuses s
+            JOIN (SELECT uid, MAX(updated_at) AS updated_at FROM statuses GROUP BY uid) m
+              ON m.uid = s.uid AND m.updated_at = s.updated_at
+        ) latest ON latest.uid = i.uid
+        SET i.current_status = latest.status, i.last_updated = latest.updated_at
+        WHERE i.last_updated IS NULL OR i.last_updated < latest.updated_at
+    """)
+    print(f"✅ Backfilled latest status for {cursor.rowcount} items")
+
+
+def m003_idempotent_sync(cursor):
+    """/sync dedupes replayed offline events by a client idempotency key (NULLs allowed)"""
+    add_column(cursor, "statuses", "idempotency_key", "VARCHAR(64) NULL")
+    add_index(cursor, "statuses", "uq_statuses_idempotency_key", "idempotency_key", unique=True)
+
+
+def m004_changes_feed(cursor):
+    """statuses by (updated_at, id); /changes pages by id since migration 8"""
+    add_index(cursor, "statuses", "idx_statuses_updated_id", "updated_at, id")
+
+
+def m005_warranty_expiry(cursor):
+    """
+    items.expiry_date as a STORED generated column (calendar years, 29 Feb → 28 Feb)
+    for /expiring. Adding a STORED column rebuilds the table (not online); run it in a
+    maintenance window on big fleets.
+    """
+    add_column(cursor, "items", "expiry_date",
+               "DATE AS (DATE_ADD(mfg_date, INTERVAL warranty_years YEAR)) STORED")
+    add_index(cursor, "items", "idx_items_expiry", "expiry_date, uid")
+    add_index(cursor, "items", "idx_items_vendor_expiry", "vendor_id, expiry_date")
+    # Also serves plain lot_no lookups (/update_status/lot, /codes/lot) as its prefix
+    add_index(cursor, "items", "idx_items_lot_expiry", "lot_no, expiry_date")
+
+
+def m006_employee_history(cursor):
+    """Per-employee history (/changes?employee_id=...) without scanning statuses"""
+    add_index(cursor, "statuses", "idx_statuses_employee_updated", "employee_id, updated_at")
+
+
+def m007_item_rollups(cursor):
+    """Precomputed fleet counts for /analytics (see analytics.py), backfilled from items"""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS item_rollups (
+            vendor_id VARCHAR(50) NOT NULL,
+            lot_no VARCHAR(50) NOT NULL,
+            component_type VARCHAR(50) NOT NULL,
+            status VARCHAR(50) NOT NULL,
+            item_count BIGINT NOT NULL DEFAULT 0,
+            PRIMARY KEY (vendor_id, lot_no, component_type, status)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+    """)
+    cursor.execute("""
+        INSERT INTO item_rollups (vendor_id, lot_no, component_type, status, item_count)
+        SELECT COALESCE(vendor_id, ''), COALESCE(lot_no, ''), COALESCE(component_type, ''),
+               COALESCE(current_status, ''), COUNT(*)
+        FROM items GROUP BY 1, 2, 3, 4
+        ON DUPLICATE KEY UPDATE item_count = VALUES(item_count)
+    """)
+    print(f"✅ Backfilled item_rollups ({cursor.rowcount} rows affected)")
+
+
+def m008_device_time(cursor):
+    """
+    /sync keeps the device-side event time in statuses.recorded_at; updated_at is when the
+    server received the event (so /changes never hands out a row behind a cursor).
+    Rows synced before this migration carried the device time in updated_at.
+    """
+    add_column(cursor, "statuses", "recorded_at", "DATETIME NULL")
+    cursor.execute("""
+        UPDATE statuses SET recorded_at = updated_at
+        WHERE idempotency_key IS NOT NULL AND recorded_at IS NULL
+    """)
+    print(f"✅ Backfilled recorded_at for {cursor.rowcount} synced rows")
+
+
+MIGRATIONS = [
+    (1, "status_columns", m001_status_columns),
+    (2, "latest_status", m002_latest_status),
+    (3, "idempotent_sync", m003_idempotent_sync),
+    (4, "changes_feed", m004_changes_feed),
+    (5, "warranty_expiry", m005_warranty_expiry),
+    (6, "employee_history", m006_employee_history),
+    (7, "item_rollups", m007_item_rollups),
+    (8, "device_time", m008_device_time),
+]
+
+
+# ---------------- RUNNER ----------------
+def applied_versions(cursor):
+    cursor.execute(SCHEMA_TABLE)
+    cursor.execute("SELECT version FROM schema_migrations")
+    return {row[0] for row in cursor.fetchall()}
+
+
+def pending(conn):
+    cur = conn.cursor()
+    try:
+        done = applied_versions(cur)
+    finally:
+        cur.close()
+    return [m for m in MIGRATIONS if m[0] not in done]
+
+
+def migrate(conn, target=None):
+    """
+    Apply every pending migration up to target (default: all), in version order.
+    MySQL DDL commits implicitly, so a failed step is not rolled back; its version
+    is not recorded and the step runs again (idempotently) next time.
+    Returns the versions applied.
+    """
+    cur = conn.cursor()
+    applied = []
+    try:
+        cur.execute("SELECT GET_LOCK(%s, %s)", (LOCK_NAME, LOCK_TIMEOUT))
+        if cur.fetchone()[0] != 1:
+            raise RuntimeError(f"another migration run holds the '{LOCK_NAME}' lock")
+        try:
+            done = applied_versions(cur)
+            for version, name, fn in MIGRATIONS:
+                if version in done or (target is not None and version > target):
+                    continue
+                print(f"▶️  Migration {version:03d} {name}")
+                started = time.perf_counter()
+                fn(cur)
+                cur.execute("INSERT INTO schema_migrations (version, name, duration_ms) VALUES (%s, %s, %s)",
+                            (version, name, round((time.perf_counter() - started) * 1000)))
+                conn.commit()
+                applied.append(version)
+        finally:
+            cur.execute("SELECT RELEASE_LOCK(%s)", (LOCK_NAME,))
+            cur.fetchone()
+    finally:
+        cur.close()
+    return applied
+
+
+# ---------------- INDEX CHECK ----------------
+# (name, query, sample params): the statements every request path runs
+HOT_QUERIES = [
+    ("scan", "SELECT * FROM items WHERE uid=%s", ("UID-0001",)),
+    ("update_status.lock", "SELECT current_status FROM items WHERE uid=%s FOR UPDATE", ("UID-0001",)),
+    ("update_status.write", "UPDATE items SET current_status=%s, last_updated=%s WHERE uid=%s",
+     ("Received", "2024-01-01 00:00:00", "UID-0001")),
+    ("history", "SELECT status, updated_at FROM statuses WHERE uid=%s ORDER BY updated_at", ("UID-0001",)),
+    ("lot", "SELECT uid FROM items WHERE lot_no=%s", ("LOT-1",)),
+    ("expiring.vendor", "SELECT uid FROM items WHERE vendor_id=%s AND expiry_date >= %s AND expiry_date < %s",
+     ("V-1", "2029-01-01", "2029-04-01")),
+    ("employee_history", "SELECT id FROM statuses WHERE employee_id=%s ORDER BY updated_at", (1,)),
+    ("changes", "SELECT id, updated_at FROM statuses WHERE id > %s ORDER BY id LIMIT 501", (0,)),
+]
+
+
+def _explain(cur, dialect, query, params):
+    """Plan lines and the tables read by a full scan"""
+    if dialect == "sqlite":
+        cur.execute("EXPLAIN QUERY PLAN " + query, params)
+        plan = [row[3] for row in cur.fetchall()]
+        # "SEARCH t USING ..." is an index lookup; "SCAN t [USING INDEX ...]" reads all of t
+        return plan, [line.split()[1] for line in plan if line.startswith("SCAN ")]
+    cur.execute("EXPLAIN " + query, params)
+    columns = [d[0] for d in cur.description]
+    rows = [dict(zip(columns, row)) for row in cur.fetchall()]
+    plan = [f"{r['table']}: type={r['type']} key={r['key']} rows={r['rows']}" for r in rows]
+    # ALL = table scan, index = full index scan
+    return plan, [r["table"] for r in rows if r["type"] in ("ALL", "index")]
+
+
+def check_indexes(conn):
+    """
+    EXPLAIN every HOT_QUERIES statement. Returns [{query, ok, full_scans, plan}];
+    ok is False when the plan reads a whole table.
+    """
+    dialect = getattr(conn, "dialect", "mysql")
+    results = []
+    cur = conn.cursor()
+    try:
+        for name, query, params in HOT_QUERIES:
+            plan, scans = _explain(cur, dialect, query, params)
+            results.append({"query": name, "ok": not scans, "full_scans": scans, "plan": plan})
+    finally:
+        cur.close()
+    return results
+
+
+# ---------------- CLI ----------------
+def main():
+    parser = argparse.ArgumentParser(description="Schema migrations and hot-query index check")
+    parser.add_argument("command", choices=["status", "migrate", "check"])
+    parser.add_argument("--target", type=int, help="migrate up to this version only")
+    args = parser.parse_args()
+
+    import db
+
+    conn = db.connect(autocommit=True)
+    try:
+        if args.command == "status":
+            todo = {m[0] for m in pending(conn)}
+            for version, name, _ in MIGRATIONS:
+                print(f"{version:03d} {name:<20} {'pending' if version in todo else 'applied'}")
+        elif args.command == "migrate":
+            applied = migrate(conn, args.target)
+            print(f"✅ Applied {len(applied)} migration(s)" if applied else "ℹ️  Schema is up to date")
+        else:
+            results = check_indexes(conn)
+            json.dump(results, sys.stdout, indent=2)
+            print()
+            if not all(r["ok"] for r in results):
+                sys.exit(1)
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
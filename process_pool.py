@@ -0,0 +1,42 @@
+"""
+process_pool.py
+
+Lazily started process pool for the CPU-bound helpers (image_decode.DecodePool,
+codegen.CodeStore).
+
+- No processes start until the first job, so importing the service or running
+  with a single worker never spawns any
+- Children are spawned, not forked: forking a threaded web server can deadlock them
+- close() shuts the pool down; the next job starts a fresh one (also the way to
+  recover after a worker died and broke the pool)
+"""
+
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+
+class ProcessPool:
+    def __init__(self, workers):
+        self.workers = workers
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _pool(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+            return self._executor
+
+    def submit(self, fn, *args):
+        return self._pool().submit(fn, *args)
+
+    def map(self, fn, items, chunksize=1):
+        """list(fn(item) for item in items) across the workers; re-raises the first failure"""
+        return list(self._pool().map(fn, items, chunksize=chunksize))
+
+    def close(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown()
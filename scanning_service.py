@@ -5,49 +5,500 @@ Features:
 1) /scan → fetch QR info + expiry calculation
 2) /allowed_statuses → check employee role & return allowed statuses
 3) /update_status → update status with audit logging
+4) /pool_stats → DB connection pool stats
+5) /role_cache/stats, /role_cache/invalidate → employee role cache
+6) /scan/batch → resolve many UIDs with a constant number of queries
+7) /update_status/batch → bulk status updates (atomic or best-effort)
+8) /update_status/lot → move every item of a lot (optionally one vendor) at once
+9) /scan_cache/stats, /scan_cache/invalidate → serialized /scan response cache
+10) /metrics → Prometheus metrics (per-endpoint latency, per-phase timings, DB queries/request)
+11) /sync → offline-first replay of queued status events (idempotent, out-of-order safe)
+12) /changes, /changes/stream → cursor-paginated feed of status transitions (JSON long-poll or SSE)
+13) /export/history → streaming CSV/NDJSON (optionally gzip) export of item lifecycle history
+14) /expiring → items whose warranty expires in a window (indexed, keyset-paginated)
+15) /authz, /authz/reload → compiled role/lifecycle policy (authz_config.json), hot reload
+16) /codes/<uid>, /codes/lot/<lot_no> → engravable QR / Data Matrix codes (PNG/SVG, cached), lot ZIP
+17) /ingest → bulk item registration from a CSV/NDJSON vendor manifest
+18) /scan/image → decode QR / Data Matrix photos server-side (process pool), then /scan them
+19) /history/<uid> → full status history, hot 'statuses' rows merged with archived ones (archive.py)
+20) /analytics, /analytics/failures → item counts by vendor/lot/component/status and failure
+    rates from incrementally maintained rollups (analytics.py), /analytics/reconcile
 
-DB: MySQL (sih_qr_db)
+DB: MySQL (sih_qr_db) configured from the environment, one bounded connection pool
+(db_pool.py) per node; reads go to replicas when DB_REPLICAS is set (db.py)
+
+items.current_status / items.last_updated are the authoritative latest status
+(kept in the same transaction as the 'statuses' audit insert), so a scan is a
+single primary-key lookup. Run init_employees_db.py (or migrations.py migrate)
+once to add/backfill them; "migrations.py check" EXPLAINs the hot queries.
+Repeat scans are served from scan_cache without touching MySQL; every status
+write invalidates the affected UIDs after commit, and a read that raced such a
+write is not cached (generation check, see cache.py). UIDs this process wrote
+within DB_STICKY_SECONDS skip the cache and read the primary, whose row then
+replaces the entry: with a shared (Redis) cache another worker may have cached a
+lagging replica's copy after the invalidation.
+
+Every request is timed per phase (connect, role lookup, item query, commit,
+serialization, ...) by metrics.py; slow requests are logged with their breakdown.
 """
 
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, send_file, stream_with_context
 import mysql.connector
-from datetime import datetime, timedelta
+import base64
+import io
+import os
+import threading
+import time
+from collections import Counter
+from datetime import date, datetime, timedelta, timezone
+
+import analytics
+import archive
+import codegen
+import db
+import export_history
+import image_decode
+import ingest
+import metrics
+from authz import DEFAULT_CONFIG_PATH, Authorizer
+from cache import MISSING, LocalBackend, RedisBackend, ResponseCache, TTLCache
+from db_pool import PoolTimeout
+from warranty import compute_expiry, find_expiring
 
 # ---------------- DB CONFIG ----------------
-DB_CONFIG = {
-    'host': '127.0.0.1',
-    'user': 'root',
-    'password': '0001',
-    'database': 'sih_qr_db'
+# From DB_HOST / DB_PORT / DB_USER / DB_PASS / DB_NAME, read replicas from DB_REPLICAS (see db.py)
+DB_CONFIG = db.DB_CONFIG
+
+# Pool sizing can be tuned per deployment
+POOL_CONFIG = {
+    'size': int(os.getenv("DB_POOL_SIZE", 10)),
+    'timeout': float(os.getenv("DB_POOL_TIMEOUT", 5)),
+    'max_lifetime': float(os.getenv("DB_POOL_MAX_LIFETIME", 1800)),
+    'max_idle': float(os.getenv("DB_POOL_MAX_IDLE", 300))
 }
 
+# Writes go to the primary; reads to replicas, except UIDs written in the last DB_STICKY_SECONDS
+db_router = db.from_env(POOL_CONFIG)
+
 def get_db_conn():
-    """Helper: create DB connection"""
-    return mysql.connector.connect(**DB_CONFIG)
-
-# ---------------- ROLE → ALLOWED STATUSES ----------------
-ROLE_ALLOWED = {
-    "receiver": ["Received"],
-    "inspector": ["Inspected"],
-    "installer": ["Installed"],
-    "maintenance": ["Serviced", "Service Needed", "Replacement Needed", "Replaced", "Discarded"],
-    "admin": ["Manufactured","Received","Inspected","Installed","Serviced",
-              "Service Needed","Replacement Needed","Replaced","Discarded"]
-}
+    """Helper: check out a pooled primary connection (conn.close() returns it to the pool)"""
+    with metrics.phase("connect"):
+        conn = db_router.write()
+    return metrics.InstrumentedConnection(conn)
+
+def get_read_conn(*uids):
+    """Like get_db_conn(), for reads: a replica, or the primary if one of uids was just written"""
+    with metrics.phase("connect"):
+        conn = db_router.read(*uids)
+    return metrics.InstrumentedConnection(conn)
+
+# ---------------- AUTHORIZATION ----------------
+# Role → allowed statuses and the lifecycle transition graph live in authz_config.json,
+# compiled to bitmasks by authz.py (edit the file, then POST /authz/reload or wait
+# AUTHZ_RELOAD_INTERVAL seconds for workers to pick it up)
+authorizer = Authorizer(os.getenv("AUTHZ_CONFIG", DEFAULT_CONFIG_PATH),
+                        check_interval=float(os.getenv("AUTHZ_RELOAD_INTERVAL", 5)))
+
+# ---------------- EMPLOYEE ROLE CACHE ----------------
+# Roles almost never change, so role checks are served from memory.
+# Unknown IDs are cached too (for a shorter time) so bad IDs can't hammer the DB.
+ROLE_CACHE_NEGATIVE_TTL = float(os.getenv("ROLE_CACHE_NEGATIVE_TTL", 30))
+role_cache = TTLCache(
+    maxsize=int(os.getenv("ROLE_CACHE_SIZE", 4096)),
+    ttl=float(os.getenv("ROLE_CACHE_TTL", 300))
+)
 
 def get_employee_role(emp_id):
-    """Fetch employee role from DB"""
-    conn = get_db_conn()
+    """Fetch employee role (from role_cache, falling back to DB)"""
+    key = str(emp_id)
+    role = role_cache.get(key)
+    if role is not MISSING:
+        return role
+
+    conn = get_read_conn()
     cur = conn.cursor()
-    cur.execute("SELECT role FROM employees WHERE id=%s", (emp_id,))
-    row = cur.fetchone()
+    with metrics.phase("role_query"):
+        cur.execute("SELECT role FROM employees WHERE id=%s", (emp_id,))
+        row = cur.fetchone()
     cur.close()
     conn.close()
-    return row[0] if row else None
+
+    role = row[0] if row else None
+    role_cache.set(key, role, ttl=None if role else ROLE_CACHE_NEGATIVE_TTL)
+    return role
+
+def invalidate_employee_role(emp_id=None):
+    """Call after editing employees; no emp_id clears the whole cache"""
+    if emp_id is None:
+        return role_cache.invalidate()
+    return role_cache.invalidate(str(emp_id))
+
+# ---------------- SCAN RESPONSE CACHE ----------------
+# SCAN_CACHE_BACKEND=local (per-process LRU, default) or redis (shared by all workers)
+SCAN_CACHE_TTL = float(os.getenv("SCAN_CACHE_TTL", 300))
+
+def make_scan_cache_backend():
+    if os.getenv("SCAN_CACHE_BACKEND", "local") == "redis":
+        return RedisBackend.from_url(os.getenv("SCAN_CACHE_REDIS_URL", "redis://127.0.0.1:6379/0"),
+                                     ttl=SCAN_CACHE_TTL)
+    return LocalBackend(maxsize=int(os.getenv("SCAN_CACHE_SIZE", 10000)), ttl=SCAN_CACHE_TTL)
+
+scan_cache = ResponseCache(make_scan_cache_backend())
+
+# ---------------- SCAN HELPERS ----------------
+MAX_BATCH_SIZE = int(os.getenv("MAX_BATCH_SIZE", 1000))
+IN_CLAUSE_CHUNK = 500  # keeps IN (...) lists and packet sizes reasonable
+
+def chunked(seq, size):
+    """Yield successive `size`-long slices of seq"""
+    for i in range(0, len(seq), size):
+        yield seq[i:i + size]
+
+def build_scan_result(uid, item):
+    """Shape an items row into the /scan response"""
+    # expiry = mfg_date + warranty_years (generated column when migrated)
+    expiry_date = item.get("expiry_date") or compute_expiry(item.get("mfg_date"), item.get("warranty_years"))
+
+    return {
+        "uid": uid,
+        "component": item.get("component_type"),
+        "vendor": item.get("vendor_id"),
+        "lot_no": item.get("lot_no"),
+        "serial_no": item.get("serial_no"),
+        "mfg_date": str(item.get("mfg_date")),
+        "warranty_years": item.get("warranty_years"),
+        "expiry_date": str(expiry_date) if expiry_date else None,
+        "current_status": item.get("current_status"),
+        "last_updated": str(item["last_updated"]) if item.get("last_updated") else None
+    }
+
+# ---------------- STATUS ARCHIVE ----------------
+# Events older than the retention window live in STATUS_ARCHIVE_DIR (see archive.py)
+archive_reader = archive.ArchiveReader()
+
+# ---------------- IMAGE DECODING ----------------
+MAX_DECODE_IMAGES = int(os.getenv("MAX_DECODE_IMAGES", 64))
+decode_pool = image_decode.DecodePool()
+
+# ---------------- CODE GENERATION ----------------
+# Rendered codes are content-addressed files under CODE_CACHE_DIR (see codegen.py)
+code_store = codegen.CodeStore()
+
+def code_spec_from_args(args):
+    """?symbology=qr&format=png&scale=10&border=4&module_mm=0.5 → CodeSpec (ValueError if invalid)"""
+    return codegen.make_spec(args.get("symbology", "qr"), args.get("format", "png"),
+                             args.get("scale", 10), args.get("border"), args.get("module_mm", 0.5))
+
+def lookup_scan_results(uids):
+    """
+    {uid: /scan result} for the uids that exist. Cached ones come from scan_cache
+    (except sticky ones, see scan_qr), the rest take one set-based query per chunk
+    of IN_CLAUSE_CHUNK uids.
+    """
+    found = {}
+    for uid in uids:
+        if db_router.is_sticky([uid]):
+            continue
+        body = scan_cache.get(uid)
+        if body is not None:
+            found[uid] = app.json.loads(body)
+
+    misses = [uid for uid in uids if uid not in found]
+    if misses:
+        generations = scan_cache.generations(misses)
+        conn = get_read_conn(*misses)
+        cur = conn.cursor(dictionary=True)
+        try:
+            for chunk in chunked(misses, IN_CLAUSE_CHUNK):
+                placeholders = ",".join(["%s"] * len(chunk))
+
+                with metrics.phase("item_query"):
+                    cur.execute(f"SELECT * FROM items WHERE uid IN ({placeholders})", chunk)
+                    rows = cur.fetchall()
+                # Under a case-insensitive collation a row can come back spelled differently
+                # from the uid that matched it: file it under the requested spelling
+                exact = {item["uid"]: item for item in rows}
+                folded = {item["uid"].casefold(): item for item in rows}
+                for uid in chunk:
+                    item = exact.get(uid) or folded.get(uid.casefold())
+                    if item is None:
+                        continue
+                    result = build_scan_result(uid, item)
+                    found[uid] = result
+                    scan_cache.set(uid, app.json.dumps(result), generations[uid])
+        finally:
+            cur.close()
+            conn.close()
+    return found
+
+# ---------------- STATUS WRITE HELPERS ----------------
+def check_status_permission(employee_id, new_status, policy):
+    """Returns (role, None) if allowed, else (role, error response tuple)"""
+    with metrics.phase("role_lookup"):
+        role = get_employee_role(employee_id)
+    if not role:
+        return None, (jsonify({"error": "Invalid employee"}), 403)
+
+    if not policy.can_set(role, new_status):
+        return role, (jsonify({
+            "error": f"Role '{role}' not allowed to set status '{new_status}'",
+            "allowed_statuses": policy.role_allowed.get(role, [])
+        }), 403)
+    return role, None
+
+def status_fields_error(uid, new_status, employee_id, note=""):
+    """None if one client-supplied status write (batch row, sync event) is well-formed, else the reason"""
+    if not uid or not new_status or not employee_id:
+        return "uid, new_status, employee_id required"
+    if not isinstance(uid, str) or not isinstance(new_status, str):
+        return "uid and new_status must be strings"
+    if isinstance(employee_id, bool) or not isinstance(employee_id, (int, str)):
+        return "employee_id must be an integer or string"
+    if note is not None and not isinstance(note, str):
+        return "note must be a string"
+    return None
+
+def transition_conflict(policy, uid, current, new_status, role):
+    """None if the item may move current → new_status, else the 409 response body"""
+    error = policy.transition_error(current, new_status, role)
+    if error is None:
+        return None
+    return {"error": error, "uid": uid, "current_status": current,
+            "allowed_statuses": policy.allowed_for(role, current)}
+
+WRITE_CHUNK = int(os.getenv("BATCH_WRITE_CHUNK", 500))
+
+def write_status_rows(cur, rows, now, items):
+    """
+    rows: [(uid, new_status, employee_id, note), ...] already validated, in request order
+    items: {uid: (current_status, (vendor_id, lot_no, component_type))} before these rows
+    - Audit rows go in with executemany
+    - items.current_status/last_updated are updated with one UPDATE ... IN (...) per status;
+      if a uid appears more than once the last row wins
+    - item_rollups get the net change (see analytics.py)
+    Returns {uid: new current_status}; the caller folds it into items once committed.
+    """
+    cur.executemany("""
+        INSERT INTO statuses (uid, status, location, note, updated_at, employee_id)
+        VALUES (%s, %s, %s, %s, %s, %s)
+    """, [(uid, status, "MobileApp", note, now, emp_id) for uid, status, emp_id, note in rows])
+
+    final_status = {}
+    for uid, status, _, _ in rows:
+        final_status.pop(uid, None)
+        final_status[uid] = status
+
+    by_status = {}
+    for uid, status in final_status.items():
+        by_status.setdefault(status, []).append(uid)
+
+    for status, uids in by_status.items():
+        for chunk in chunked(uids, IN_CLAUSE_CHUNK):
+            placeholders = ",".join(["%s"] * len(chunk))
+            cur.execute(f"UPDATE items SET current_status=%s, last_updated=%s WHERE uid IN ({placeholders})",
+                        [status, now] + chunk)
+
+    analytics.apply_deltas(cur, analytics.status_moves(items, final_status))
+    return final_status
+
+# ---------------- OFFLINE SYNC HELPERS ----------------
+SYNC_MAX_EVENTS = int(os.getenv("SYNC_MAX_EVENTS", 5000))
+SYNC_MAX_CLOCK_SKEW = timedelta(minutes=int(os.getenv("SYNC_MAX_CLOCK_SKEW_MIN", 10)))
+
+def parse_device_time(value):
+    """ISO-8601 device timestamp → naive UTC datetime (assumes UTC when no offset is given)"""
+    ts = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    if ts.tzinfo is not None:
+        ts = ts.astimezone(timezone.utc).replace(tzinfo=None)
+    return ts.replace(microsecond=0)
+
+def find_existing_keys(cur, keys):
+    """Idempotency keys already in 'statuses' (unique-index lookups, no table scan)"""
+    existing = set()
+    for chunk in chunked(keys, IN_CLAUSE_CHUNK):
+        placeholders = ",".join(["%s"] * len(chunk))
+        cur.execute(f"SELECT idempotency_key FROM statuses WHERE idempotency_key IN ({placeholders})", chunk)
+        existing.update(row[0] for row in cur.fetchall())
+    return existing
+
+def check_sync_transitions(policy, events, items, roles):
+    """
+    events: [(key, (uid, status, employee_id, note, recorded_at)), ...] in device-time order
+    items: {uid: (current_status, last_updated)}
+    Returns (accepted events, {key: reason}, {uid: (current_status, last_updated)} after
+    the accepted events). An event that would move the item's status must be a legal
+    transition from the status before it.
+    """
+    state = dict(items)
+    accepted, conflicts = [], {}
+    for key, (uid, status, emp_id, note, ts) in events:
+        current, last_updated = state[uid]
+        if last_updated is None or last_updated <= ts:
+            error = policy.transition_error(current, status, roles[emp_id])
+            if error:
+                conflicts[key] = error
+                continue
+            state[uid] = (status, ts)
+        accepted.append((key, (uid, status, emp_id, note, ts)))
+    return accepted, conflicts, state
+
+# ---------------- CHANGES FEED HELPERS ----------------
+CHANGES_DEFAULT_LIMIT = 500
+CHANGES_MAX_LIMIT = 5000
+CHANGES_MAX_WAIT = 30          # seconds a long-poll may hold the request
+CHANGES_POLL_INTERVAL = 1.0    # re-query interval while waiting (covers writes from other workers)
+# Ids are taken at insert, not at commit, so /changes holds back rows until no transaction
+# holding a lower id can still commit. A status write must commit within STATUS_WRITE_MAX_SECONDS
+# of the updated_at it stamps (check_status_write_deadline() fails the late ones); a lower id
+# was inserted before the row's own commit, so it commits at most 2 x that after the row's
+# stamp, plus the clock skew between the app servers that stamp and read updated_at.
+STATUS_WRITE_MAX_SECONDS = float(os.getenv("STATUS_WRITE_MAX_SECONDS", 2))
+CHANGES_CLOCK_SKEW_SECONDS = float(os.getenv("CHANGES_CLOCK_SKEW_SECONDS", 1))
+CHANGES_SETTLE_SECONDS = 2 * STATUS_WRITE_MAX_SECONDS + CHANGES_CLOCK_SKEW_SECONDS
+
+# Writers in this process wake long-polls/streams immediately
+changes_cond = threading.Condition()
+
+def notify_changes():
+    with changes_cond:
+        changes_cond.notify_all()
+
+def encode_cursor(*parts):
+    """Opaque, URL-safe keyset cursor for a position (e.g. a row id, or (expiry_date, uid))"""
+    raw = "|".join(str(p) for p in parts)
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor, parts=1):
+    """encode_cursor() → its parts as strings (the last may contain '|'); ValueError if malformed"""
+    padded = cursor + "=" * (-len(cursor) % 4)
+    values = base64.urlsafe_b64decode(padded.encode()).decode().split("|", parts - 1)
+    if len(values) != parts:
+        raise ValueError("malformed cursor")
+    return values
+
+def changes_position(cursor):
+    """/changes cursor → statuses.id to resume after (older cursors were 'updated_at|id')"""
+    return int(decode_cursor(cursor)[0].rsplit("|", 1)[-1])
+
+class StatusWriteTimeout(Exception):
+    """A status write ran past STATUS_WRITE_MAX_SECONDS; the caller rolls it back."""
+
+def check_status_write_deadline(now):
+    """
+    Call right before committing rows stamped updated_at=now ('%Y-%m-%d %H:%M:%S').
+    Raises StatusWriteTimeout once the write is too late for /changes to have held back
+    the ids after it.
+    """
+    elapsed = (datetime.utcnow() - datetime.strptime(now, '%Y-%m-%d %H:%M:%S')).total_seconds()
+    if elapsed > STATUS_WRITE_MAX_SECONDS:
+        raise StatusWriteTimeout(
+            f"status write took {elapsed:.1f}s (limit {STATUS_WRITE_MAX_SECONDS:g}s), rolled back; retry")
+
+def fetch_changes(after, limit, status=None, employee_id=None, lot_no=None):
+    """
+    One keyset page of 'statuses' in id order, starting after id `after` (None for the
+    beginning). Ids only grow, so a row can't land behind a cursor already handed out
+    (device times from /sync are in recorded_at, not updated_at). Ids are assigned at
+    insert rather than commit, so the page stops at the first row younger than
+    CHANGES_SETTLE_SECONDS: by then every transaction holding a lower id has committed or
+    been failed by check_status_write_deadline(). Primary-key range scan; never OFFSET.
+    """
+    where, params = [], []
+    if after is not None:
+        where.append("s.id > %s")
+        params.append(after)
+    if status:
+        where.append("s.status = %s")
+        params.append(status)
+    if employee_id:
+        where.append("s.employee_id = %s")
+        params.append(employee_id)
+    join = ""
+    if lot_no:
+        join = "JOIN items i ON i.uid = s.uid"
+        where.append("i.lot_no = %s")
+        params.append(lot_no)
+
+    sql = f"""
+        SELECT s.id, s.uid, s.status, s.location, s.note, s.updated_at, s.recorded_at, s.employee_id
+        FROM statuses s {join}
+        {"WHERE " + " AND ".join(where) if where else ""}
+        ORDER BY s.id
+        LIMIT %s
+    """
+    settled = datetime.utcnow() - timedelta(seconds=CHANGES_SETTLE_SECONDS)
+    conn = get_db_conn()
+    cur = conn.cursor(dictionary=True)
+    try:
+        with metrics.phase("changes_query"):
+            cur.execute(sql, params + [limit + 1])
+            rows = cur.fetchall()
+    finally:
+        cur.close()
+        conn.close()
+
+    for i, r in enumerate(rows):
+        if r["updated_at"] > settled:
+            rows = rows[:i]  # the rest of the page waits for the next poll
+            break
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    changes = [{
+        "cursor": encode_cursor(r["id"]),
+        "id": r["id"],
+        "uid": r["uid"],
+        "status": r["status"],
+        "location": r["location"],
+        "note": r["note"],
+        "updated_at": str(r["updated_at"]),
+        "recorded_at": str(r["recorded_at"]) if r["recorded_at"] else None,
+        "employee_id": r["employee_id"]
+    } for r in rows]
+    return changes, has_more
+
+def wait_for_changes(fetch, wait_seconds):
+    """Re-run fetch() until it returns rows or wait_seconds pass"""
+    deadline = time.monotonic() + wait_seconds
+    changes, has_more = fetch()
+    while not changes:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        with changes_cond:
+            changes_cond.wait(min(CHANGES_POLL_INTERVAL, remaining))
+        changes, has_more = fetch()
+    return changes, has_more
+
+def parse_changes_args(args, cursor=None):
+    """Shared query-string handling for /changes and /changes/stream"""
+    cursor = args.get("since") or cursor
+    after = changes_position(cursor) if cursor else None
+    limit = min(int(args.get("limit", CHANGES_DEFAULT_LIMIT)), CHANGES_MAX_LIMIT)
+    if limit < 1:
+        raise ValueError("limit must be >= 1")
+    filters = {
+        "status": args.get("status"),
+        "employee_id": args.get("employee_id"),
+        "lot_no": args.get("lot_no") or args.get("lot")
+    }
+    return cursor, after, limit, filters
 
 # ---------------- FLASK APP ----------------
 app = Flask(__name__)
 
+@app.before_request
+def start_request_timer():
+    metrics.begin_request()
+
+@app.after_request
+def record_request_metrics(response):
+    metrics.end_request(request.endpoint or "unmatched", response.status_code)
+    return response
+
+@app.errorhandler(PoolTimeout)
+def handle_pool_timeout(e):
+    return jsonify({"error": "Database busy, try again", "detail": str(e)}), 503
+
 # -------- 1) SCAN ENDPOINT -----------------
 @app.route('/scan', methods=['POST'])
 def scan_qr():
@@ -61,40 +512,31 @@ def scan_qr():
     if not uid:
         return jsonify({"error": "uid required"}), 400
 
-    conn = get_db_conn()
+    # Read-your-writes comes before the cache: after our own write, a shared cache may
+    # hold another worker's read of a lagging replica. The primary's row overwrites it.
+    if not db_router.is_sticky([uid]):
+        with metrics.phase("cache"):
+            body = scan_cache.get(uid)
+        if body is not None:
+            return app.response_class(body, mimetype="application/json")
+
+    # Taken before the read: a write that lands in between makes the set below a no-op
+    generation = scan_cache.generations([uid])[uid]
+    conn = get_read_conn(uid)
     cur = conn.cursor(dictionary=True)
 
     try:
         # Fetch item details
-        cur.execute("SELECT * FROM items WHERE uid=%s", (uid,))
-        item = cur.fetchone()
+        with metrics.phase("item_query"):
+            cur.execute("SELECT * FROM items WHERE uid=%s", (uid,))
+            item = cur.fetchone()
         if not item:
             return jsonify({"error": "Item not found"}), 404
 
-        # Calculate expiry = mfg_date + warranty_years
-        expiry_date = None
-        if item.get("mfg_date") and item.get("warranty_years"):
-            expiry_date = item["mfg_date"] + timedelta(days=365*item["warranty_years"])
-
-        # Fetch latest status
-        cur.execute("""
-            SELECT status, updated_at FROM statuses
-            WHERE uid=%s ORDER BY updated_at DESC LIMIT 1
-        """, (uid,))
-        status_row = cur.fetchone()
-
-        return jsonify({
-            "uid": uid,
-            "component": item.get("component_type"),
-            "vendor": item.get("vendor_id"),
-            "lot_no": item.get("lot_no"),
-            "serial_no": item.get("serial_no"),
-            "mfg_date": str(item.get("mfg_date")),
-            "warranty_years": item.get("warranty_years"),
-            "expiry_date": str(expiry_date) if expiry_date else None,
-            "current_status": status_row["status"] if status_row else item.get("current_status"),
-            "last_updated": str(status_row["updated_at"]) if status_row else None
-        })
+        with metrics.phase("serialize"):
+            body = app.json.dumps(build_scan_result(uid, item))
+        scan_cache.set(uid, body, generation)
+        return app.response_class(body, mimetype="application/json")
 
     finally:
         cur.close()
@@ -104,20 +546,40 @@ def scan_qr():
 @app.route('/allowed_statuses', methods=['POST'])
 def allowed_statuses():
     """
-    Input: { "employee_id": 2 }
+    Input: { "employee_id": 2, "uid": "UID-0001" (optional) }
     Output: { "role": "inspector", "allowed": ["Inspected"] }
+    With a uid, only statuses the item's current status can move to are listed
+    (plus "current_status").
     """
     data = request.get_json(force=True)
     emp_id = data.get("employee_id")
+    uid = data.get("uid")
 
     if not emp_id:
         return jsonify({"error": "employee_id required"}), 400
 
-    role = get_employee_role(emp_id)
+    policy = authorizer.policy
+    with metrics.phase("role_lookup"):
+        role = get_employee_role(emp_id)
     if not role:
         return jsonify({"error": "Invalid employee_id"}), 404
 
-    return jsonify({"role": role, "allowed": ROLE_ALLOWED.get(role, [])})
+    if not uid:
+        return jsonify({"role": role, "allowed": policy.role_allowed.get(role, [])})
+
+    conn = get_read_conn(uid)
+    cur = conn.cursor()
+    try:
+        with metrics.phase("item_query"):
+            cur.execute("SELECT current_status FROM items WHERE uid=%s", (uid,))
+            row = cur.fetchone()
+    finally:
+        cur.close()
+        conn.close()
+    if not row:
+        return jsonify({"error": "Item not found"}), 404
+    return jsonify({"role": role, "uid": uid, "current_status": row[0],
+                    "allowed": policy.allowed_for(role, row[0])})
 
 # -------- 3) UPDATE STATUS ENDPOINT -----------------
 @app.route('/update_status', methods=['POST'])
@@ -125,7 +587,9 @@ def update_status():
     """
     Input JSON: { "uid": "UID-0001", "new_status": "Inspected", "employee_id": 2, "note": "ok" }
     - Inserts row in 'statuses'
-    - Updates 'items.current_status'
+    - Updates 'items.current_status' / 'items.last_updated' and the analytics rollups
+      in the same transaction
+    - 409 when the item's current status can't move to new_status (lifecycle graph)
     """
     data = request.get_json(force=True)
     uid = data.get("uid")
@@ -136,18 +600,11 @@ def update_status():
     if not uid or not new_status or not employee_id:
         return jsonify({"error": "uid, new_status, employee_id required"}), 400
 
-    # Step 1: get role
-    role = get_employee_role(employee_id)
-    if not role:
-        return jsonify({"error": "Invalid employee"}), 403
-
-    # Step 2: check allowed statuses
-    allowed = ROLE_ALLOWED.get(role, [])
-    if new_status not in allowed:
-        return jsonify({
-            "error": f"Role '{role}' not allowed to set status '{new_status}'",
-            "allowed_statuses": allowed
-        }), 403
+    # Step 1 + 2: get role, check allowed statuses
+    policy = authorizer.policy
+    role, denied = check_status_permission(employee_id, new_status, policy)
+    if denied:
+        return denied
 
     # Step 3: DB update
     conn = get_db_conn()
@@ -155,16 +612,40 @@ def update_status():
     try:
         now = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
 
+        # Lock the item row and check the lifecycle transition
+        with metrics.phase("item_query"):
+            cur.execute("SELECT current_status, vendor_id, lot_no, component_type FROM items WHERE uid=%s FOR UPDATE",
+                        (uid,))
+            row = cur.fetchone()
+        if not row:
+            conn.rollback()
+            return jsonify({"error": "Item not found"}), 404
+        conflict = transition_conflict(policy, uid, row[0], new_status, role)
+        if conflict:
+            conn.rollback()
+            return jsonify(conflict), 409
+
         # Insert into statuses (audit log)
-        cur.execute("""
-            INSERT INTO statuses (uid, status, location, note, updated_at, employee_id)
-            VALUES (%s, %s, %s, %s, %s, %s)
-        """, (uid, new_status, "MobileApp", note, now, employee_id))
+        with metrics.phase("insert"):
+            cur.execute("""
+                INSERT INTO statuses (uid, status, location, note, updated_at, employee_id)
+                VALUES (%s, %s, %s, %s, %s, %s)
+            """, (uid, new_status, "MobileApp", note, now, employee_id))
+
+        # Update materialized latest status
+        with metrics.phase("update"):
+            cur.execute("UPDATE items SET current_status=%s, last_updated=%s WHERE uid=%s",
+                        (new_status, now, uid))
 
-        # Update items.current_status
-        cur.execute("UPDATE items SET current_status=%s WHERE uid=%s", (new_status, uid))
+        # Fleet analytics counts, same transaction
+        with metrics.phase("rollup"):
+            analytics.apply_move(cur, row[1:], row[0], new_status)
 
+        check_status_write_deadline(now)
         conn.commit()
+        db_router.mark_written(uid)
+        scan_cache.invalidate(uid)
+        notify_changes()
         return jsonify({"ok": True, "uid": uid, "new_status": new_status, "role": role})
 
     except Exception as e:
@@ -174,7 +655,925 @@ def update_status():
         cur.close()
         conn.close()
 
+# -------- 4) POOL STATS ENDPOINT -----------------
+@app.route('/pool_stats', methods=['GET'])
+def pool_stats():
+    """
+    Output: { "size": 10, "in_use": 1, "idle": 3, "avg_wait_ms": 0.02, ... }
+    """
+    return jsonify(db_router.stats())
+
+# -------- 5) ROLE CACHE ENDPOINTS -----------------
+@app.route('/role_cache/stats', methods=['GET'])
+def role_cache_stats():
+    """
+    Output: { "size": 12, "hits": 340, "misses": 12, "hit_ratio": 0.9659, ... }
+    """
+    return jsonify(role_cache.stats())
+
+@app.route('/role_cache/invalidate', methods=['POST'])
+def role_cache_invalidate():
+    """
+    Input: { "employee_id": 2 }  → drop one employee
+           {}                    → drop all cached roles
+    """
+    data = request.get_json(silent=True) or {}
+    removed = invalidate_employee_role(data.get("employee_id"))
+    return jsonify({"ok": True, "invalidated": removed})
+
+# -------- 6) BATCH SCAN ENDPOINT -----------------
+@app.route('/scan/batch', methods=['POST'])
+def scan_batch():
+    """
+    Input: { "uids": ["UID-0001", "UID-0002", ...] }
+    Output: { "results": [ <same shape as /scan> | {"uid": ..., "error": "Item not found"} ],
+              "found": 1, "not_found": 1 }
+    - Cached UIDs come from scan_cache; the rest take one set-based query per
+      chunk of IN_CLAUSE_CHUNK uids. Results are in request order
+    """
+    data = request.get_json(force=True)
+    uids = data.get("uids")
+
+    if not isinstance(uids, list) or not uids:
+        return jsonify({"error": "uids (non-empty list) required"}), 400
+    if not all(isinstance(u, str) and u for u in uids):
+        return jsonify({"error": "uids must be non-empty strings"}), 400
+
+    uids = list(dict.fromkeys(uids))  # dedupe, keep order
+    if len(uids) > MAX_BATCH_SIZE:
+        return jsonify({"error": f"max {MAX_BATCH_SIZE} uids per batch"}), 413
+
+    found = lookup_scan_results(uids)
+    results = [found.get(uid) or {"uid": uid, "error": "Item not found"} for uid in uids]
+    n_found = sum(1 for uid in uids if uid in found)
+
+    return jsonify({"results": results, "found": n_found, "not_found": len(uids) - n_found})
+
+# -------- 7) BATCH UPDATE STATUS ENDPOINT -----------------
+@app.route('/update_status/batch', methods=['POST'])
+def update_status_batch():
+    """
+    Input JSON: {
+        "mode": "atomic" | "best_effort",   (default "atomic")
+        "updates": [ { "uid": "UID-0001", "new_status": "Received", "employee_id": 1, "note": "" }, ... ]
+    }
+    - Roles are checked once per employee; lifecycle transitions are checked per row against
+      the item's current status (rows for the same uid chain in request order)
+    - atomic: any rejected row → nothing is written; rows are committed in one transaction
+    - best_effort: valid rows are written and committed per chunk of WRITE_CHUNK rows
+    Output: { "mode": ..., "applied": n, "rejected": m,
+              "results": [ { "index": 0, "uid": ..., "result": "ok" | "skipped" | "invalid"
+                             | "forbidden" | "not_found" | "conflict" | "error", "error": ... }, ... ] }
+    """
+    data = request.get_json(force=True)
+    updates = data.get("updates")
+    mode = data.get("mode", "atomic")
+
+    if mode not in ("atomic", "best_effort"):
+        return jsonify({"error": "mode must be 'atomic' or 'best_effort'"}), 400
+    if not isinstance(updates, list) or not updates:
+        return jsonify({"error": "updates (non-empty list) required"}), 400
+    if len(updates) > MAX_BATCH_SIZE:
+        return jsonify({"error": f"max {MAX_BATCH_SIZE} updates per batch"}), 413
+
+    results = [{"index": i, "uid": u.get("uid") if isinstance(u, dict) else None}
+               for i, u in enumerate(updates)]
+
+    def reject(i, kind, message):
+        results[i]["result"] = kind
+        results[i]["error"] = message
+
+    # Step 1: field validation + role check (once per employee)
+    policy = authorizer.policy
+    roles = {}
+    candidates = []  # (index, uid, new_status, employee_id, note)
+    for i, u in enumerate(updates):
+        if not isinstance(u, dict):
+            reject(i, "invalid", "uid, new_status, employee_id required")
+            continue
+        error = status_fields_error(u.get("uid"), u.get("new_status"), u.get("employee_id"), u.get("note", ""))
+        if error:
+            reject(i, "invalid", error)
+            continue
+
+        employee_id = u["employee_id"]
+        if employee_id not in roles:
+            roles[employee_id] = get_employee_role(employee_id)
+        role = roles[employee_id]
+        if not role:
+            reject(i, "forbidden", "Invalid employee")
+            continue
+        if not policy.can_set(role, u["new_status"]):
+            reject(i, "forbidden", f"Role '{role}' not allowed to set status '{u['new_status']}'")
+            continue
+
+        candidates.append((i, u["uid"], u["new_status"], employee_id, u.get("note", "")))
+
+    conn = get_db_conn()
+    cur = conn.cursor()
+    try:
+        # Step 2: existence + current status, set-based (rows locked until commit)
+        wanted = list(dict.fromkeys(c[1] for c in candidates))
+        items = {}
+        for chunk in chunked(wanted, IN_CLAUSE_CHUNK):
+            placeholders = ",".join(["%s"] * len(chunk))
+            cur.execute(f"""
+                SELECT uid, current_status, vendor_id, lot_no, component_type FROM items
+                WHERE uid IN ({placeholders}) FOR UPDATE
+            """, chunk)
+            items.update((uid, (status, tuple(dims))) for uid, status, *dims in cur.fetchall())
+        current = {uid: status for uid, (status, _) in items.items()}
+
+        valid = []
+        for c in candidates:
+            if c[1] not in current:
+                reject(c[0], "not_found", "Item not found")
+                continue
+            error = policy.transition_error(current[c[1]], c[2], roles[c[3]])
+            if error:
+                reject(c[0], "conflict", error)
+                continue
+            current[c[1]] = c[2]
+            valid.append(c)
+
+        rejected = len(updates) - len(valid)
+        if mode == "atomic" and rejected:
+            for c in valid:
+                results[c[0]]["result"] = "skipped"
+            return jsonify({"mode": mode, "applied": 0, "rejected": rejected, "results": results}), 400
+
+        # Step 3: write
+        now = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
+        applied = 0
+        for chunk in chunked(valid, WRITE_CHUNK):
+            rows = [(uid, status, emp_id, note) for _, uid, status, emp_id, note in chunk]
+            try:
+                with metrics.phase("write"):
+                    written = write_status_rows(cur, rows, now, items)
+                if mode == "best_effort":
+                    check_status_write_deadline(now)
+                    conn.commit()
+            except Exception as e:
+                conn.rollback()
+                if mode == "atomic":
+                    raise
+                for c in chunk:
+                    reject(c[0], "error", str(e))
+                continue
+            items.update((uid, (status, items[uid][1])) for uid, status in written.items())
+            for c in chunk:
+                results[c[0]]["result"] = "ok"
+            applied += len(chunk)
+            if mode == "best_effort":
+                db_router.mark_written(*{c[1] for c in chunk})
+                scan_cache.invalidate(*{c[1] for c in chunk})
+                notify_changes()
+
+        if mode == "atomic":
+            check_status_write_deadline(now)
+            conn.commit()
+            db_router.mark_written(*{c[1] for c in valid})
+            scan_cache.invalidate(*{c[1] for c in valid})
+            notify_changes()
+
+        return jsonify({"mode": mode, "applied": applied, "rejected": len(updates) - applied,
+                        "results": results})
+
+    except Exception as e:
+        conn.rollback()
+        return jsonify({"error": str(e)}), 500
+    finally:
+        cur.close()
+        conn.close()
+
+# -------- 8) LOT STATUS ENDPOINT -----------------
+@app.route('/update_status/lot', methods=['POST'])
+def update_status_lot():
+    """
+    Input JSON: { "lot_no": "LOT-42", "vendor_id": "V-7" (optional), "new_status": "Received",
+                  "employee_id": 1, "note": "ok" }
+    - Same role rules as /update_status
+    - Audit rows are written server-side with INSERT ... SELECT (no UID round-trips)
+    - Only items whose current status can move to new_status are updated (the transition
+      check becomes a current_status IN (...) predicate); the rest are counted as skipped
+    Output: { "ok": true, "lot_no": ..., "vendor_id": ..., "new_status": ..., "role": ...,
+              "updated": 2400, "skipped": 3 }
+    """
+    data = request.get_json(force=True)
+    lot_no = data.get("lot_no")
+    vendor_id = data.get("vendor_id")
+    new_status = data.get("new_status")
+    employee_id = data.get("employee_id")
+    note = data.get("note", "")
+
+    if not lot_no or not new_status or not employee_id:
+        return jsonify({"error": "lot_no, new_status, employee_id required"}), 400
+
+    policy = authorizer.policy
+    role, denied = check_status_permission(employee_id, new_status, policy)
+    if denied:
+        return denied
+
+    where = "lot_no=%s"
+    params = [lot_no]
+    if vendor_id:
+        where += " AND vendor_id=%s"
+        params.append(vendor_id)
+
+    movable, movable_params = where, list(params)
+    sources = policy.sources_for(new_status, role)
+    if sources is not None:
+        # Legacy rows without a status may take any status (see authz.Policy.can_transition)
+        movable += " AND (current_status IS NULL"
+        if sources:
+            movable += f" OR current_status IN ({','.join(['%s'] * len(sources))})"
+            movable_params += sources
+        movable += ")"
+
+    conn = get_db_conn()
+    cur = conn.cursor()
+    try:
+        now = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
+
+        cur.execute(f"SELECT COUNT(*) FROM items WHERE {where}", params)
+        total = cur.fetchone()[0]
+        if not total:
+            conn.rollback()
+            return jsonify({"error": "No items found for lot"}), 404
+
+        # Lock the movable rows; their per-status counts are the rollup deltas
+        cur.execute(f"""
+            SELECT vendor_id, component_type, current_status, COUNT(*) FROM items WHERE {movable}
+            GROUP BY vendor_id, component_type, current_status FOR UPDATE
+        """, movable_params)
+        deltas = Counter()
+        for vendor, component, status, count in cur.fetchall():
+            deltas[analytics.rollup_key((vendor, lot_no, component), status)] -= count
+            deltas[analytics.rollup_key((vendor, lot_no, component), new_status)] += count
+
+        cur.execute(f"""
+            INSERT INTO statuses (uid, status, location, note, updated_at, employee_id)
+            SELECT uid, %s, %s, %s, %s, %s FROM items WHERE {movable}
+        """, [new_status, "MobileApp", note, now, employee_id] + movable_params)
+        updated = cur.rowcount
+
+        if not updated:
+            conn.rollback()
+            return jsonify({"error": f"No items in lot can move to '{new_status}'",
+                            "skipped": total}), 409
+
+        cur.execute(f"UPDATE items SET current_status=%s, last_updated=%s WHERE {movable}",
+                    [new_status, now] + movable_params)
+        analytics.apply_deltas(cur, deltas)
+
+        check_status_write_deadline(now)
+        conn.commit()
+        # The lot's UIDs are never fetched, so drop the whole scan cache (and read from the primary)
+        db_router.mark_written()
+        scan_cache.clear()
+        notify_changes()
+        return jsonify({"ok": True, "lot_no": lot_no, "vendor_id": vendor_id,
+                        "new_status": new_status, "role": role, "updated": updated,
+                        "skipped": total - updated})
+
+    except Exception as e:
+        conn.rollback()
+        return jsonify({"error": str(e)}), 500
+    finally:
+        cur.close()
+        conn.close()
+
+# -------- 9) SCAN CACHE ENDPOINTS -----------------
+@app.route('/scan_cache/stats', methods=['GET'])
+def scan_cache_stats():
+    """
+    Output: { "backend": "local", "size": 812, "hits": 5400, "misses": 900, "hit_ratio": 0.8571, ... }
+    """
+    return jsonify(scan_cache.stats())
+
+@app.route('/scan_cache/invalidate', methods=['POST'])
+def scan_cache_invalidate():
+    """
+    Input: { "uid": "UID-0001" }  → drop one entry
+           {}                    → drop everything
+    """
+    data = request.get_json(silent=True) or {}
+    if data.get("uid"):
+        scan_cache.invalidate(data["uid"])
+    else:
+        scan_cache.clear()
+    return jsonify({"ok": True})
+
+# -------- 10) METRICS ENDPOINT -----------------
+def db_gauges(router_stats):
+    """Prometheus gauges for a db.Router's stats() (shared with the async app)"""
+    gauges = {f"scanning_db_pool_{name}": value for name, value in router_stats["primary"].items()}
+    gauges["scanning_db_replicas"] = len(router_stats["replicas"])
+    gauges["scanning_db_replicas_down"] = sum(r["down"] for r in router_stats["replicas"])
+    gauges["scanning_db_replica_pool_in_use"] = sum(r["in_use"] for r in router_stats["replicas"])
+    for name, value in router_stats["routing"].items():
+        gauges[f"scanning_db_{name}"] = value
+    return gauges
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """
+    Prometheus text format: request counts, latency/phase histograms,
+    DB queries per request, slow requests, pool and cache gauges
+    """
+    gauges = db_gauges(db_router.stats())
+    for name, value in role_cache.stats().items():
+        gauges[f"scanning_role_cache_{name}"] = value
+    for name, value in scan_cache.stats().items():
+        if name != "backend":
+            gauges[f"scanning_scan_cache_{name}"] = value
+    for name, value in code_store.stats().items():
+        gauges[f"scanning_code_cache_{name}"] = value
+    return app.response_class(metrics.render_prometheus(gauges), mimetype="text/plain; version=0.0.4")
+
+# -------- 11) OFFLINE SYNC ENDPOINT -----------------
+@app.route('/sync', methods=['POST'])
+def sync_events():
+    """
+    Input JSON: {
+        "device_id": "HH-0042",
+        "events": [ { "key": "<client uuid>", "uid": "UID-0001", "new_status": "Inspected",
+                      "employee_id": 2, "note": "ok", "recorded_at": "2025-01-31T10:22:03Z" }, ... ]
+    }
+    - 'key' is the client-generated idempotency key; replays of a stored key are acked
+      as duplicates without writing (statuses.idempotency_key has a unique index)
+    - the audit row keeps the device-side time in recorded_at (updated_at is when the server
+      received it); events may arrive out of order and items.current_status only moves
+      forward in device time (a late, older event never overwrites it)
+    - events that move current_status must be legal lifecycle transitions (checked in
+      device-time order); late events that only land in the audit trail are not checked
+    Output: { "accepted": [keys], "duplicates": [keys], "rejected": { key: reason }, "ignored": 0 }
+    Devices can drop every key in the response from their queue; a non-200 means retry.
+    """
+    data = request.get_json(force=True)
+    device_id = data.get("device_id")
+    events = data.get("events")
+
+    if not isinstance(events, list) or not events:
+        return jsonify({"error": "events (non-empty list) required"}), 400
+    if len(events) > SYNC_MAX_EVENTS:
+        return jsonify({"error": f"max {SYNC_MAX_EVENTS} events per sync"}), 413
+
+    location = f"MobileApp:{device_id}" if device_id else "MobileApp"
+    received_at = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
+    latest_allowed = datetime.utcnow() + SYNC_MAX_CLOCK_SKEW
+    rejected = {}
+    ignored = 0  # events without a usable key can't be acked
+    policy = authorizer.policy
+    roles = {}
+    candidates = {}  # key -> (uid, new_status, employee_id, note, recorded_at)
+
+    # Step 1: validate + role check (once per employee); dedupe keys inside the batch
+    for e in events:
+        key = e.get("key") if isinstance(e, dict) else None
+        if not key or not isinstance(key, str) or len(key) > 64:
+            ignored += 1
+            continue
+        if key in candidates or key in rejected:
+            continue
+        error = status_fields_error(e.get("uid"), e.get("new_status"), e.get("employee_id"), e.get("note", ""))
+        if error is None and not e.get("recorded_at"):
+            error = "recorded_at required"
+        if error:
+            rejected[key] = error
+            continue
+        try:
+            recorded_at = parse_device_time(e["recorded_at"])
+        except (TypeError, ValueError):
+            rejected[key] = "recorded_at must be ISO-8601"
+            continue
+        if recorded_at > latest_allowed:
+            rejected[key] = "recorded_at is in the future"
+            continue
+
+        employee_id = e["employee_id"]
+        if employee_id not in roles:
+            with metrics.phase("role_lookup"):
+                roles[employee_id] = get_employee_role(employee_id)
+        role = roles[employee_id]
+        if not role:
+            rejected[key] = "Invalid employee"
+            continue
+        if not policy.can_set(role, e["new_status"]):
+            rejected[key] = f"Role '{role}' not allowed to set status '{e['new_status']}'"
+            continue
+
+        candidates[key] = (e["uid"], e["new_status"], employee_id, e.get("note", ""), recorded_at)
+
+    conn = get_db_conn()
+    cur = conn.cursor()
+    try:
+        # Step 2: unknown items; current state for the transition check (rows locked until commit)
+        wanted = list({c[0] for c in candidates.values()})
+        items, dims = {}, {}
+        for chunk in chunked(wanted, IN_CLAUSE_CHUNK):
+            placeholders = ",".join(["%s"] * len(chunk))
+            cur.execute(f"""
+                SELECT uid, current_status, last_updated, vendor_id, lot_no, component_type
+                FROM items WHERE uid IN ({placeholders}) FOR UPDATE
+            """, chunk)
+            for uid, status, ts, *item_dims in cur.fetchall():
+                items[uid] = (status, ts)
+                dims[uid] = tuple(item_dims)
+        for key in [k for k, c in candidates.items() if c[0] not in items]:
+            rejected[key] = "Item not found"
+            del candidates[key]
+
+        # Step 3: dedupe against stored keys, then write. A concurrent replay of the same
+        # keys trips the unique index; retry once so those come back as duplicates.
+        for attempt in (1, 2):
+            with metrics.phase("dedupe"):
+                duplicates = find_existing_keys(cur, list(candidates))
+            fresh = [(k, c) for k, c in candidates.items() if k not in duplicates]
+            fresh.sort(key=lambda kc: kc[1][4])  # replay in device-time order
+            fresh, conflicts, final = check_sync_transitions(policy, fresh, items, roles)
+            try:
+                with metrics.phase("write"):
+                    for chunk in chunked(fresh, WRITE_CHUNK):
+                        cur.executemany("""
+                            INSERT INTO statuses (uid, status, location, note, updated_at, recorded_at,
+                                                  employee_id, idempotency_key)
+                            VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+                        """, [(uid, status, location, note, received_at, ts, emp_id, key)
+                              for key, (uid, status, emp_id, note, ts) in chunk])
+                        # Only move the materialized status forward in time
+                        cur.executemany("""
+                            UPDATE items SET current_status=%s, last_updated=%s
+                            WHERE uid=%s AND (last_updated IS NULL OR last_updated <= %s)
+                        """, [(status, ts, uid, ts) for _, (uid, status, _, _, ts) in chunk])
+                    analytics.apply_deltas(cur, analytics.status_moves(
+                        {uid: (items[uid][0], dims[uid]) for uid in final},
+                        {uid: status for uid, (status, _) in final.items()}))
+                check_status_write_deadline(received_at)
+                conn.commit()
+                break
+            except mysql.connector.IntegrityError:
+                conn.rollback()
+                if attempt == 2:
+                    raise
+
+        rejected.update(conflicts)
+        db_router.mark_written(*{c[0] for _, c in fresh})
+        scan_cache.invalidate(*{c[0] for _, c in fresh})
+        notify_changes()
+        return jsonify({
+            "accepted": [k for k, _ in fresh],
+            "duplicates": sorted(duplicates),
+            "rejected": rejected,
+            "ignored": ignored
+        })
+
+    except Exception as e:
+        conn.rollback()
+        return jsonify({"error": str(e)}), 500
+    finally:
+        cur.close()
+        conn.close()
+
+# -------- 12) CHANGES FEED ENDPOINTS -----------------
+@app.route('/changes', methods=['GET'])
+def changes_feed():
+    """
+    Query: ?since=<cursor>&limit=500&status=Inspected&employee_id=2&lot_no=LOT-42&wait=20
+    - since: cursor from a previous response (omit to start from the beginning)
+    - wait: long-poll up to N seconds (max 30) when there is nothing new
+    Output: { "changes": [ { "cursor", "id", "uid", "status", "location", "note",
+                             "updated_at", "recorded_at", "employee_id" }, ... ],
+              "next_cursor": "...", "has_more": false }
+    Pass next_cursor back as ?since= to follow the feed. Changes come in the order the
+    server stored them (updated_at); recorded_at is the device time of /sync events.
+    A change shows up CHANGES_SETTLE_SECONDS (2 x STATUS_WRITE_MAX_SECONDS +
+    CHANGES_CLOCK_SKEW_SECONDS, 5s by default) after it is written. No change is skipped
+    as long as app server clocks agree within CHANGES_CLOCK_SKEW_SECONDS; status writes
+    that take longer than STATUS_WRITE_MAX_SECONDS are rolled back to keep that promise.
+    """
+    try:
+        cursor, after, limit, filters = parse_changes_args(request.args)
+        wait = min(float(request.args.get("wait", 0)), CHANGES_MAX_WAIT)
+    except ValueError as e:
+        return jsonify({"error": f"invalid query: {e}"}), 400
+
+    fetch = lambda: fetch_changes(after, limit, **filters)
+    changes, has_more = wait_for_changes(fetch, wait) if wait > 0 else fetch()
+
+    return jsonify({
+        "changes": changes,
+        "next_cursor": changes[-1]["cursor"] if changes else cursor,
+        "has_more": has_more
+    })
+
+@app.route('/changes/stream', methods=['GET'])
+def changes_stream():
+    """
+    Server-sent events version of /changes (same filters).
+    Each event: "id: <cursor>", "event: status", "data: <change JSON>".
+    Reconnecting clients resume from the Last-Event-ID header automatically.
+    A ": keepalive" comment is sent every CHANGES_MAX_WAIT seconds of silence.
+    """
+    try:
+        cursor, after, limit, filters = parse_changes_args(
+            request.args, cursor=request.headers.get("Last-Event-ID"))
+    except ValueError as e:
+        return jsonify({"error": f"invalid query: {e}"}), 400
+
+    def events():
+        position = after
+        while True:
+            changes, has_more = wait_for_changes(
+                lambda: fetch_changes(position, limit, **filters), CHANGES_MAX_WAIT)
+            if not changes:
+                yield ": keepalive\n\n"
+                continue
+            for change in changes:
+                yield f"id: {change['cursor']}\nevent: status\ndata: {app.json.dumps(change)}\n\n"
+            position = changes[-1]["id"]
+
+    return Response(stream_with_context(events()), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+# -------- 13) HISTORY EXPORT ENDPOINT -----------------
+@app.route('/export/history', methods=['GET'])
+def export_history_endpoint():
+    """
+    Query: ?format=ndjson|csv&gzip=1&uid=&vendor_id=&lot_no=&status=&since=&until=
+    Streams 'statuses' joined with 'items' (+ computed expiry_date) as a download.
+    Rows are read with an unbuffered cursor in chunks (see export_history.py), so
+    memory stays flat and the first bytes go out immediately.
+    """
+    fmt = request.args.get("format", "ndjson")
+    gzip = request.args.get("gzip", "0").lower() in ("1", "true", "yes")
+    filters = {k: request.args.get(k) for k in export_history.FILTERS}
+
+    if fmt not in ("ndjson", "csv"):
+        return jsonify({"error": "format must be 'ndjson' or 'csv'"}), 400
+
+    # Check out before the 200 goes out, so a busy pool still gets its 503 (handle_pool_timeout)
+    conn = db_router.read()
+    finished = False
+
+    def release():
+        # An abandoned download leaves unread rows on the connection; don't pool it
+        if finished:
+            conn.close()
+        else:
+            conn.discard()
+
+    def generate():
+        nonlocal finished
+        try:
+            yield from export_history.export(conn, fmt, gzip, filters)
+            finished = True
+        finally:
+            release()
+
+    response = Response(generate(), mimetype=export_history.content_type(fmt, gzip),
+                        headers={"Content-Disposition":
+                                 f"attachment; filename={export_history.filename(fmt, gzip)}"})
+    response.call_on_close(release)  # a no-op once generate() released it; covers a body never started
+    return response
+
+# -------- 14) EXPIRING WARRANTIES ENDPOINT -----------------
+EXPIRING_MAX_DAYS = 3650
+EXPIRING_MAX_LIMIT = 1000
+
+@app.route('/expiring', methods=['GET'])
+def expiring():
+    """
+    Query: ?days=90&from=2025-01-01&vendor_id=&lot_no=&component=&limit=100&cursor=
+    - window: [from, from + days), from defaults to today
+    - served by the items(expiry_date, ...) indexes; cursor pages by (expiry_date, uid)
+    Output: { "from": ..., "to": ..., "items": [ {uid, component, vendor, lot_no, serial_no,
+              mfg_date, warranty_years, expiry_date, current_status}, ... ],
+              "next_cursor": "..." | null }
+    """
+    try:
+        days = int(request.args.get("days", 90))
+        start = date.fromisoformat(request.args["from"]) if request.args.get("from") else datetime.utcnow().date()
+        limit = int(request.args.get("limit", 100))
+        after = None
+        if request.args.get("cursor"):
+            expiry, uid = decode_cursor(request.args["cursor"], parts=2)
+            after = (date.fromisoformat(expiry), uid)
+    except (ValueError, KeyError) as e:
+        return jsonify({"error": f"invalid query: {e}"}), 400
+    if not 0 < days <= EXPIRING_MAX_DAYS or not 0 < limit <= EXPIRING_MAX_LIMIT:
+        return jsonify({"error": f"days must be 1..{EXPIRING_MAX_DAYS}, limit 1..{EXPIRING_MAX_LIMIT}"}), 400
+
+    end = start + timedelta(days=days)
+    conn = get_read_conn()
+    try:
+        with metrics.phase("expiry_query"):
+            rows, has_more = find_expiring(conn, start, end,
+                                           vendor_id=request.args.get("vendor_id"),
+                                           lot_no=request.args.get("lot_no"),
+                                           component_type=request.args.get("component"),
+                                           after=after, limit=limit)
+    finally:
+        conn.close()
+
+    next_cursor = encode_cursor(rows[-1]["expiry_date"], rows[-1]["uid"]) if has_more and rows else None
+
+    return jsonify({
+        "from": str(start),
+        "to": str(end),
+        "items": [{
+            "uid": r["uid"],
+            "component": r["component_type"],
+            "vendor": r["vendor_id"],
+            "lot_no": r["lot_no"],
+            "serial_no": r["serial_no"],
+            "mfg_date": str(r["mfg_date"]),
+            "warranty_years": r["warranty_years"],
+            "expiry_date": str(r["expiry_date"]),
+            "current_status": r["current_status"]
+        } for r in rows],
+        "next_cursor": next_cursor
+    })
+
+# -------- 15) AUTHORIZATION POLICY ENDPOINTS -----------------
+@app.route('/authz', methods=['GET'])
+def authz_policy():
+    """
+    Output: { "version": "3f2a9c...", "statuses": [...], "roles": { role: [statuses] },
+              "transitions": { status: [next statuses] }, "override_roles": [...],
+              "path": ..., "reloads": 0, "reload_errors": 0 }
+    """
+    return jsonify({**authorizer.policy.describe(), **authorizer.stats()})
+
+@app.route('/authz/reload', methods=['POST'])
+def authz_reload():
+    """
+    Re-reads authz_config.json now (workers also pick up edits on their own within
+    AUTHZ_RELOAD_INTERVAL seconds). An invalid file is rejected and the current policy kept.
+    Output: { "ok": true, "version": "3f2a9c..." }
+    """
+    try:
+        policy = authorizer.reload()
+    except (OSError, ValueError) as e:
+        return jsonify({"error": f"Policy not reloaded: {e}", "version": authorizer.policy.version}), 400
+    return jsonify({"ok": True, "version": policy.version})
+
+# -------- 16) CODE GENERATION ENDPOINTS -----------------
+@app.route('/codes/<uid>', methods=['GET'])
+def item_code(uid):
+    """
+    Query: ?symbology=qr|datamatrix&format=png|svg&scale=10&border=4&module_mm=0.5
+    Returns the code image for a registered item. scale = PNG pixels per module,
+    module_mm = physical module size (SVG dimensions, PNG DPI). Rendered once, then
+    served from the on-disk cache (the ETag is the cache key, so clients can revalidate).
+    """
+    try:
+        spec = code_spec_from_args(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    conn = get_read_conn(uid)
+    cur = conn.cursor()
+    try:
+        with metrics.phase("item_query"):
+            cur.execute("SELECT 1 FROM items WHERE uid=%s", (uid,))
+            found = cur.fetchone()
+    finally:
+        cur.close()
+        conn.close()
+    if not found:
+        return jsonify({"error": "Item not found"}), 404
+
+    with metrics.phase("render"):
+        path = code_store.get(uid, spec)
+    return send_file(path, mimetype=codegen.FORMATS[spec.fmt], etag=codegen.cache_key(uid, spec),
+                     max_age=86400, download_name=codegen.archive_name(uid, spec))
+
+@app.route('/codes/lot/<lot_no>', methods=['GET'])
+def lot_codes(lot_no):
+    """
+    Query: same as /codes/<uid>, plus ?vendor_id=V-7
+    Streams a ZIP with one code per item of the lot (<uid>.<format>). Cache misses are
+    rendered in parallel (process pool) a chunk at a time while the archive streams.
+    """
+    try:
+        spec = code_spec_from_args(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    conn = get_read_conn()
+    try:
+        with metrics.phase("item_query"):
+            uids = codegen.lot_uids(conn, lot_no, request.args.get("vendor_id"))
+    finally:
+        conn.close()
+    if not uids:
+        return jsonify({"error": "No items found for lot"}), 404
+
+    name = codegen.archive_name(f"{lot_no}_{spec.symbology}", spec)[:-len(spec.fmt)] + "zip"
+    return Response(code_store.iter_zip(uids, spec), mimetype="application/zip",
+                    headers={"Content-Disposition": f"attachment; filename={name}"})
+
+# -------- 17) BULK INGEST ENDPOINT -----------------
+@app.route('/ingest', methods=['POST'])
+def ingest_manifest():
+    """
+    Query: ?employee_id=5&format=csv|ndjson&source=lot42.csv
+    Body: the manifest itself (text/csv or application/x-ndjson), or a multipart
+          upload in the 'manifest' field
+    - The employee's role must be allowed to set 'Manufactured' (authz_config.json)
+    - Rows are validated and loaded while the body streams in (see ingest.py);
+      each chunk commits on its own, so a retry after a failure skips what already loaded
+    Output: { "read": 20000, "inserted": 19998, "rejected": 2,
+              "rejects": [ { "line": 17, "uid": null, "error": "mfg_date must be YYYY-MM-DD" } ],
+              "lots": { "LOT-42": 19998 }, "elapsed_s": 1.9, "rows_per_s": 10526.3, ... }
+    """
+    employee_id = request.args.get("employee_id", type=int)
+    if not employee_id:
+        return jsonify({"error": "employee_id required"}), 400
+
+    role, denied = check_status_permission(employee_id, ingest.INITIAL_STATUS, authorizer.policy)
+    if denied:
+        return denied
+
+    upload = request.files.get("manifest")
+    if upload is not None:
+        raw, name, content_type = upload.stream, upload.filename, upload.mimetype
+    else:
+        raw, name, content_type = request.stream, None, request.mimetype
+    source = request.args.get("source") or name
+    fmt = request.args.get("format") or ingest.detect_format(name, content_type)
+    if fmt not in ("csv", "ndjson"):
+        return jsonify({"error": "format must be 'csv' or 'ndjson'"}), 400
+
+    stream = io.TextIOWrapper(raw, encoding="utf-8-sig", newline="")
+    conn = get_db_conn()
+    try:
+        with metrics.phase("ingest"):
+            report = ingest.ingest(conn, stream, fmt, employee_id, source=source)
+    except Exception as e:
+        conn.rollback()
+        return jsonify({"error": str(e)}), 500
+    finally:
+        conn.close()
+
+    if report.inserted:
+        db_router.mark_written()
+        notify_changes()
+    return jsonify({**report.as_dict(), "role": role})
+
+# -------- 18) IMAGE DECODE ENDPOINT -----------------
+@app.route('/scan/image', methods=['POST'])
+def scan_image():
+    """
+    Input: one image as the raw body (image/jpeg, image/png, ...), or a multipart
+           batch of files (any field name, up to MAX_DECODE_IMAGES)
+    Output: { "images": [ { "index": 0, "name": "cam1.jpg", "uids": ["UID-0001"],
+                            "results": [ <same shape as /scan> | {"uid": ..., "error": "Item not found"} ],
+                            "stage": "threshold", "timings_ms": { "load": 4.1, "raw": 9.8, ... } }, ... ],
+              "decoded": 1, "failed": 0, "decoders": ["opencv"],
+              "timings_ms": { "receive": 0.4, "decode": 31.2, "lookup": 0.9 } }
+    - Images decode in parallel in a process pool (see image_decode.py for the stages)
+    - Images where nothing decodes carry an "error" instead of uids/results
+    """
+    if not image_decode.available_decoders():
+        return jsonify({"error": "No barcode decoder installed (pip install pyzbar or opencv-python-headless)"}), 501
+
+    timings = {}
+    t0 = time.perf_counter()
+    if request.files:
+        uploads = [(f.filename, f.read()) for f in request.files.values()]
+    else:
+        uploads = [(None, request.get_data())]
+    uploads = [(name, data) for name, data in uploads if data]
+    timings["receive"] = round((time.perf_counter() - t0) * 1000, 3)
+
+    if not uploads:
+        return jsonify({"error": "image required"}), 400
+    if len(uploads) > MAX_DECODE_IMAGES:
+        return jsonify({"error": f"max {MAX_DECODE_IMAGES} images per request"}), 413
+
+    t0 = time.perf_counter()
+    with metrics.phase("decode"):
+        decoded = decode_pool.decode_many([data for _, data in uploads])
+    timings["decode"] = round((time.perf_counter() - t0) * 1000, 3)
+
+    t0 = time.perf_counter()
+    uids = list(dict.fromkeys(uid for d in decoded for uid in d["uids"]))
+    found = lookup_scan_results(uids) if uids else {}
+    timings["lookup"] = round((time.perf_counter() - t0) * 1000, 3)
+
+    images = []
+    for i, ((name, _), d) in enumerate(zip(uploads, decoded)):
+        entry = {"index": i, "name": name, **d}
+        if d["uids"]:
+            entry["results"] = [found.get(uid) or {"uid": uid, "error": "Item not found"} for uid in d["uids"]]
+        images.append(entry)
+
+    n_decoded = sum(1 for d in decoded if d["uids"])
+    return jsonify({"images": images, "decoded": n_decoded, "failed": len(decoded) - n_decoded,
+                    "decoders": image_decode.available_decoders(), "timings_ms": timings})
+
+# -------- 19) ITEM HISTORY ENDPOINT -----------------
+@app.route('/history/<uid>', methods=['GET'])
+def item_history(uid):
+    """
+    Output: { "uid": "UID-0001", "history": [ { "id", "status", "location", "note",
+              "updated_at", "recorded_at", "employee_id" } oldest first ], "archived": 3 }
+    - Rows moved out of 'statuses' by the archive job are read back from their
+      segment files and merged in; "archived" counts them
+    """
+    conn = get_read_conn(uid)
+    cur = conn.cursor()
+    try:
+        with metrics.phase("item_query"):
+            cur.execute("SELECT 1 FROM items WHERE uid=%s", (uid,))
+            exists = cur.fetchone() is not None
+        if not exists:
+            return jsonify({"error": "Item not found"}), 404
+        with metrics.phase("history_query"):
+            rows, archived = archive.item_history(conn, uid, archive_reader)
+    finally:
+        cur.close()
+        conn.close()
+    return jsonify({"uid": uid, "history": rows, "archived": archived})
+
+# -------- 20) FLEET ANALYTICS ENDPOINTS -----------------
+def analytics_args(args, default_group_by):
+    """?group_by=vendor,status&vendor_id=&lot_no=&component=&status= → (group_by, filters); ValueError if invalid"""
+    group_by = [d.strip() for d in args.get("group_by", default_group_by).split(",") if d.strip()]
+    unknown = [d for d in group_by if d not in analytics.DIMENSIONS]
+    if unknown:
+        raise ValueError(f"group_by must be from {', '.join(analytics.DIMENSIONS)}")
+    return group_by, {k: args.get(k) for k in analytics.FILTERS}
+
+@app.route('/analytics', methods=['GET'])
+def fleet_analytics():
+    """
+    Query: ?group_by=vendor,status (any of vendor, lot, component, status; default status)
+           &vendor_id=&lot_no=&component=&status=
+    Output: { "group_by": ["vendor", "status"], "total": 5000,
+              "groups": [ { "vendor_id": "V-1", "status": "Installed", "count": 4200 }, ... ] }
+    Counts come from item_rollups (a few thousand rows at most), never from items.
+    """
+    try:
+        group_by, filters = analytics_args(request.args, "status")
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    conn = get_read_conn()
+    try:
+        with metrics.phase("rollup_query"):
+            groups = analytics.query_counts(conn, group_by, filters)
+    finally:
+        conn.close()
+    return jsonify({"group_by": group_by, "total": sum(g["count"] for g in groups), "groups": groups})
+
+@app.route('/analytics/failures', methods=['GET'])
+def fleet_failures():
+    """
+    Query: ?group_by=vendor (any of vendor, lot, component) &vendor_id=&lot_no=&component=
+    Output: { "failure_statuses": ["Replacement Needed", "Replaced"],
+              "groups": [ { "vendor_id": "V-7", "items": 900, "failed": 45, "failure_rate": 0.05 }, ... ] }
+    Worst failure rate first.
+    """
+    try:
+        group_by, filters = analytics_args(request.args, "vendor")
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    filters.pop("status", None)
+    conn = get_read_conn()
+    try:
+        with metrics.phase("rollup_query"):
+            groups = analytics.failure_rates(conn, group_by, filters)
+    finally:
+        conn.close()
+    return jsonify({"failure_statuses": list(analytics.FAILURE_STATUSES), "groups": groups})
+
+@app.route('/analytics/reconcile', methods=['POST'])
+def fleet_reconcile():
+    """
+    Recompute item_rollups from items (normally run periodically: python analytics.py reconcile --every 3600)
+    Output: { "vendors": 12, "corrected": 0, "elapsed_s": 0.8 }
+    """
+    conn = get_db_conn()
+    try:
+        result = analytics.reconcile(conn)
+    finally:
+        conn.close()
+    return jsonify(result)
+
 # ---------------- MAIN ENTRY ----------------
 if __name__ == '__main__':
-    print("Starting scanning_service (with scan + modify status)...")
-    app.run(host='0.0.0.0', port=5001, debug=True)
+    import argparse
+    parser = argparse.ArgumentParser(description="QR scanning service")
+    parser.add_argument("--app", choices=["sync", "async"], default=os.getenv("SCANNING_APP", "sync"),
+                        help="sync: Flask dev server; async: ASGI app (async_scanning_service.py)")
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", 5001)))
+    args = parser.parse_args()
+
+    if args.app == "async":
+        import async_scanning_service
+        async_scanning_service.main(port=args.port)
+    else:
+        print("Starting scanning_service (with scan + modify status)...")
+        app.run(host='0.0.0.0', port=args.port, debug=os.getenv("FLASK_DEBUG", "1") != "0")
@@ -0,0 +1,177 @@
+"""
+sqlite_backend.py
+
+SQLite stand-in for the MySQL database, for tests and local benchmarks.
+
+connect() returns an object that behaves like a mysql.connector connection
+as far as the services use it:
+- cursor(dictionary=True) returns rows as dicts
+- %s placeholders are accepted
+- is_connected(), in_transaction, commit(), rollback() work as expected
+- constraint violations raise mysql.connector.IntegrityError, like MySQL would
+- SELECT ... FOR UPDATE is accepted (the clause is dropped; SQLite locks the whole DB on write)
+
+Use a shared-cache URI (e.g. "file:sih?mode=memory&cache=shared") so every
+pooled connection sees the same in-memory database.
+"""
+
+import re
+import sqlite3
+from datetime import datetime
+
+from mysql.connector import IntegrityError
+
+sqlite3.register_converter("DATETIME", lambda b: datetime.fromisoformat(b.decode()))
+
+_FOR_UPDATE = re.compile(r"\s+FOR\s+UPDATE\b", re.IGNORECASE)
+
+# Mirrors the columns of the MySQL tables that the services read/write
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS employees (
+    id INTEGER PRIMARY KEY,
+    name VARCHAR(100),
+    role VARCHAR(20) NOT NULL
+);
+CREATE TABLE IF NOT EXISTS items (
+    uid VARCHAR(64) PRIMARY KEY,
+    component_type VARCHAR(50),
+    vendor_id VARCHAR(50),
+    lot_no VARCHAR(50),
+    serial_no VARCHAR(50),
+    mfg_date DATE,
+    warranty_years INTEGER,
+    current_status VARCHAR(50) DEFAULT 'Manufactured',
+    last_updated DATETIME NULL,
+    -- same rule as MySQL DATE_ADD(mfg_date, INTERVAL warranty_years YEAR): 29 Feb clamps to 28 Feb
+    expiry_date DATE GENERATED ALWAYS AS (
+        CASE WHEN strftime('%m-%d', mfg_date) = '02-29'
+                  AND strftime('%m', date(mfg_date, '+' || warranty_years || ' years')) = '03'
+             THEN date(mfg_date, '+' || warranty_years || ' years', '-1 day')
+             ELSE date(mfg_date, '+' || warranty_years || ' years')
+        END) STORED
+);
+CREATE INDEX IF NOT EXISTS idx_items_expiry ON items (expiry_date, uid);
+CREATE INDEX IF NOT EXISTS idx_items_vendor_expiry ON items (vendor_id, expiry_date);
+CREATE INDEX IF NOT EXISTS idx_items_lot_expiry ON items (lot_no, expiry_date);
+CREATE TABLE IF NOT EXISTS statuses (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    uid VARCHAR(64) NOT NULL,
+    status VARCHAR(50) NOT NULL,
+    location VARCHAR(100),
+    note TEXT,
+    updated_at DATETIME NOT NULL,
+    employee_id INTEGER NULL,
+    idempotency_key VARCHAR(64) NULL,
+    recorded_at DATETIME NULL
+);
+CREATE INDEX IF NOT EXISTS idx_statuses_uid_updated ON statuses (uid, updated_at);
+CREATE INDEX IF NOT EXISTS idx_statuses_updated_id ON statuses (updated_at, id);
+CREATE INDEX IF NOT EXISTS idx_statuses_employee_updated ON statuses (employee_id, updated_at);
+CREATE UNIQUE INDEX IF NOT EXISTS uq_statuses_idempotency_key ON statuses (idempotency_key);
+CREATE TABLE IF NOT EXISTS item_rollups (
+    vendor_id VARCHAR(50) NOT NULL,
+    lot_no VARCHAR(50) NOT NULL,
+    component_type VARCHAR(50) NOT NULL,
+    status VARCHAR(50) NOT NULL,
+    item_count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (vendor_id, lot_no, component_type, status)
+);
+"""
+
+
+class SQLiteCursor:
+    def __init__(self, raw_cursor, dictionary=False):
+        self._cur = raw_cursor
+        self._dictionary = dictionary
+
+    @staticmethod
+    def _sql(query):
+        return _FOR_UPDATE.sub("", query).replace("%s", "?")
+
+    def execute(self, query, params=()):
+        try:
+            self._cur.execute(self._sql(query), tuple(params or ()))
+        except sqlite3.IntegrityError as e:
+            raise IntegrityError(msg=str(e)) from e
+
+    def executemany(self, query, seq_of_params):
+        try:
+            self._cur.executemany(self._sql(query), [tuple(p) for p in seq_of_params])
+        except sqlite3.IntegrityError as e:
+            raise IntegrityError(msg=str(e)) from e
+
+    @property
+    def rowcount(self):
+        return self._cur.rowcount
+
+    @property
+    def lastrowid(self):
+        return self._cur.lastrowid
+
+    @property
+    def description(self):
+        return self._cur.description
+
+    def _row(self, row):
+        if row is None or not self._dictionary:
+            return row
+        return {col[0]: value for col, value in zip(self._cur.description, row)}
+
+    def fetchone(self):
+        return self._row(self._cur.fetchone())
+
+    def fetchmany(self, size=1):
+        return [self._row(r) for r in self._cur.fetchmany(size)]
+
+    def fetchall(self):
+        return [self._row(r) for r in self._cur.fetchall()]
+
+    def __iter__(self):
+        for row in self._cur:
+            yield self._row(row)
+
+    def close(self):
+        self._cur.close()
+
+
+class SQLiteConnection:
+    dialect = "sqlite"  # MySQL connections have no such attribute (see migrations.check_indexes)
+
+    def __init__(self, database):
+        self._conn = sqlite3.connect(database, uri=database.startswith("file:"),
+                                     detect_types=sqlite3.PARSE_DECLTYPES,
+                                     check_same_thread=False)
+        self._closed = False
+
+    def cursor(self, dictionary=False, **kwargs):
+        return SQLiteCursor(self._conn.cursor(), dictionary=dictionary)
+
+    def start_transaction(self):
+        self._conn.execute("BEGIN")
+
+    @property
+    def in_transaction(self):
+        return self._conn.in_transaction
+
+    def commit(self):
+        self._conn.commit()
+
+    def rollback(self):
+        self._conn.rollback()
+
+    def is_connected(self):
+        return not self._closed
+
+    def close(self):
+        self._closed = True
+        self._conn.close()
+
+
+def connect(database=":memory:"):
+    """mysql.connector.connect() look-alike"""
+    return SQLiteConnection(database)
+
+
+def create_schema(conn):
+    conn._conn.executescript(SCHEMA)
+    conn.commit()
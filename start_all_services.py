@@ -1,12 +1,23 @@
 #!/usr/bin/env python3
 """
 Service Launcher - Start all QR Manufacturing System services
-This script starts both the combined backend service and the engraving service
+This script starts the scanning service (optionally N replicas on consecutive
+ports), the combined backend service and the engraving service, and supervises them:
+
+- every child's stdout and stderr is read by the asyncio event loop as it arrives
+  (no reader threads, no polling sleeps; full pipes can never stall a child)
+- a service is reported "started" only after its HTTP readiness check passes
+- children that exit, or fail LIVENESS_FAILURES health checks in a row, are
+  restarted with exponential backoff (reset once a run stays up for STABLE_AFTER)
+- Ctrl+C / SIGTERM stops everything (SIGTERM to each process group, then SIGKILL)
+
+Usage:
+  python start_all_services.py
+  python start_all_services.py --replicas 4 --only scanning_service   # ports 5001-5004
 """
 
-import subprocess
-import threading
-import time
+import argparse
+import asyncio
 import os
 import signal
 import sys
@@ -16,204 +27,283 @@ from pathlib import Path
 PROJECT_ROOT = Path(__file__).parent.absolute()
 VENV_PYTHON = PROJECT_ROOT / ".venv" / "bin" / "python"
 
-# Service configurations
+READY_TIMEOUT = 30.0       # seconds a (re)started service has to pass its readiness check
+PROBE_INTERVAL = 0.5       # between readiness probes while starting
+PROBE_TIMEOUT = 2.0
+LIVENESS_INTERVAL = 10.0   # between health checks once running
+LIVENESS_FAILURES = 3      # consecutive failed checks before a restart
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 60.0
+STABLE_AFTER = 60.0        # a run this long resets the backoff
+STOP_TIMEOUT = 5.0
+
+# Lines containing these are printed; everything else is drained silently (--verbose prints all)
+IMPORTANT = ('running on', 'started', 'ready', 'error', 'failed', 'traceback', 'exception',
+             'database', 'connection', 'listening', 'warning')
+
+# Service configurations ("{port}" in args is replaced per replica)
 SERVICES = {
+    "scanning_service": {
+        "name": "Scanning Service",
+        "script": PROJECT_ROOT / "scanning_service.py",
+        "args": ["--port", "{port}"],
+        "port": 5001,
+        "health": "/pool_stats",
+        "cwd": PROJECT_ROOT,
+        "env": {"FLASK_DEBUG": "0"}  # the debug reloader forks; we restart on our own
+    },
     "combined_backend": {
         "name": "Combined Backend Service",
         "script": PROJECT_ROOT / "qr-manufacturing-system" / "combined_backend_service.py",
         "port": 5002,
+        "health": "/health",
         "cwd": PROJECT_ROOT / "qr-manufacturing-system"
     },
     "engraving_service": {
-        "name": "Engraving Service", 
+        "name": "Engraving Service",
         "script": PROJECT_ROOT / "qr-manufacturing-system" / "services" / "engraving-service" / "main_updated.py",
         "port": 8004,
+        "health": "/engrave/status",
         "cwd": PROJECT_ROOT / "qr-manufacturing-system" / "services" / "engraving-service",
         "env": {"PYTHONPATH": str(PROJECT_ROOT / "qr-manufacturing-system" / "services" / "engraving-service")}
     }
 }
 
-class ServiceManager:
-    def __init__(self):
-        self.processes = {}
-        self.running = True
-        
-    def start_service(self, service_id, config):
-        """Start a single service"""
-        print(f"🚀 Starting {config['name']}...")
-        
+
+async def http_ok(port, path, timeout=PROBE_TIMEOUT, host="127.0.0.1"):
+    """True if GET path answers with a 2xx status"""
+    try:
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+    except (OSError, asyncio.TimeoutError):
+        return False
+    try:
+        writer.write(f"GET {path} HTTP/1.0\r\nHost: {host}:{port}\r\n\r\n".encode())
+        await writer.drain()
+        status_line = await asyncio.wait_for(reader.readline(), timeout)
+        parts = status_line.split()
+        return len(parts) >= 2 and parts[1].startswith(b"2")
+    except (OSError, asyncio.TimeoutError):
+        return False
+    finally:
+        writer.close()
+
+
+class Replica:
+    """One supervised process of a service, restarted with backoff until shutdown"""
+
+    def __init__(self, manager, service_id, config, port, python):
+        self.manager = manager
+        self.service_id = service_id
+        self.config = config
+        self.port = port
+        self.python = python
+        self.label = f"{config['name']}:{port}"
+        self.process = None
+        self.exited = None
+        self.state = "stopped"
+        self.restarts = 0
+        self.failures = 0
+        self.first_ready = asyncio.get_running_loop().create_future()
+
+    # ---------- process lifecycle ----------
+    async def spawn(self):
+        env = os.environ.copy()
+        env.update(self.config.get('env', {}))
+        env["PYTHONUNBUFFERED"] = "1"  # line-by-line output instead of 4 KB bursts
+        args = [a.replace("{port}", str(self.port)) for a in self.config.get('args', [])]
+        self.process = await asyncio.create_subprocess_exec(
+            self.python, str(self.config['script']), *args,
+            cwd=str(self.config['cwd']), env=env,
+            stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE,
+            start_new_session=True  # own process group: stop() reaches its children too
+        )
+        self.state = "starting"
+        return [asyncio.create_task(self.pump(self.process.stdout, "")),
+                asyncio.create_task(self.pump(self.process.stderr, "stderr: "))]
+
+    async def pump(self, stream, prefix):
+        async for raw in stream:
+            line = raw.decode(errors="replace").rstrip()
+            if line and (self.manager.verbose or any(k in line.lower() for k in IMPORTANT)):
+                print(f"[{self.label}] {prefix}{line}", flush=True)
+
+    async def wait_exit_or(self, timeout):
+        """Wait up to timeout seconds; returns True early if the process exits"""
         try:
-            env = os.environ.copy()
-            if 'env' in config:
-                env.update(config['env'])
-            
-            process = subprocess.Popen(
-                [str(VENV_PYTHON), str(config['script'])],
-                cwd=str(config['cwd']),
-                env=env,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                universal_newlines=True,
-                bufsize=1
-            )
-            
-            self.processes[service_id] = {
-                'process': process,
-                'config': config
-            }
-            
-            # Start output monitoring thread
-            threading.Thread(
-                target=self.monitor_service_output,
-                args=(service_id, process),
-                daemon=True
-            ).start()
-            
-            print(f"✅ {config['name']} started (PID: {process.pid})")
+            await asyncio.wait_for(asyncio.shield(self.exited), timeout)
             return True
-            
-        except Exception as e:
-            print(f"❌ Failed to start {config['name']}: {e}")
+        except asyncio.TimeoutError:
             return False
-    
-    def monitor_service_output(self, service_id, process):
-        """Monitor service output and print important messages"""
-        config = self.processes[service_id]['config']
-        
-        while self.running and process.poll() is None:
+
+    async def wait_ready(self):
+        deadline = asyncio.get_running_loop().time() + self.manager.ready_timeout
+        while not self.exited.done() and not self.manager.stopping.is_set():
+            if await http_ok(self.port, self.config['health']):
+                return True
+            remaining = deadline - asyncio.get_running_loop().time()
+            if remaining <= 0:
+                return False
+            await self.wait_exit_or(min(PROBE_INTERVAL, remaining))
+        return False
+
+    async def watch(self):
+        """Liveness checks until the process exits or shutdown starts"""
+        failed = 0
+        while not self.manager.stopping.is_set():
+            if await self.wait_exit_or(LIVENESS_INTERVAL):
+                return
+            if await http_ok(self.port, self.config['health']):
+                failed = 0
+                continue
+            failed += 1
+            if failed >= LIVENESS_FAILURES:
+                print(f"⚠️  {self.label} failed {failed} health checks, restarting")
+                await self.stop()
+                return
+
+    async def stop(self):
+        if self.process is None or self.process.returncode is not None:
+            return
+        try:
+            os.killpg(self.process.pid, signal.SIGTERM)
+        except ProcessLookupError:
+            return
+        if not await self.wait_exit_or(STOP_TIMEOUT):
+            print(f"⚠️  Force killing {self.label}...")
             try:
-                # Read stdout
-                line = process.stdout.readline()
-                if line:
-                    line = line.strip()
-                    # Print important messages
-                    if any(keyword in line.lower() for keyword in [
-                        'running on', 'started', 'ready', 'error', 'failed', 
-                        'database', 'connection', 'listening'
-                    ]):
-                        print(f"[{config['name']}] {line}")
-                
-                time.sleep(0.1)
-            except:
-                break
-    
-    def check_service_health(self, service_id):
-        """Check if a service is healthy"""
-        if service_id not in self.processes:
-            return False
-        
-        process = self.processes[service_id]['process']
-        return process.poll() is None
-    
-    def stop_all_services(self):
-        """Stop all services gracefully"""
-        print("\n🛑 Stopping all services...")
-        self.running = False
-        
-        for service_id, service_info in self.processes.items():
-            process = service_info['process']
-            config = service_info['config']
-            
-            if process.poll() is None:
-                print(f"🔄 Stopping {config['name']}...")
-                process.terminate()
-                
-                # Wait for graceful shutdown
+                os.killpg(self.process.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+        await self.exited
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        stop_task = asyncio.create_task(self.manager.stopping.wait())
+        try:
+            while not self.manager.stopping.is_set():
+                started = loop.time()
+                self.process = None
                 try:
-                    process.wait(timeout=5)
-                    print(f"✅ {config['name']} stopped gracefully")
-                except subprocess.TimeoutExpired:
-                    print(f"⚠️  Force killing {config['name']}...")
-                    process.kill()
-                    process.wait()
-    
-    def start_all_services(self):
-        """Start all services"""
-        print("🎯 QR Manufacturing System - Service Launcher")
-        print("=" * 60)
-        
-        # Check if virtual environment exists
-        if not VENV_PYTHON.exists():
-            print(f"❌ Virtual environment not found at: {VENV_PYTHON}")
-            print("Please ensure the virtual environment is set up correctly.")
-            return False
-        
-        # Start services with delay between them
+                    pumps = await self.spawn()
+                except OSError as e:
+                    print(f"❌ Failed to start {self.label}: {e}")
+                    pumps = []
+                    self.exited = loop.create_future()
+                    self.exited.set_result(None)
+                else:
+                    self.exited = asyncio.ensure_future(self.process.wait())
+                    if await self.wait_ready():
+                        self.state = "running"
+                        print(f"✅ {self.label} ready (PID: {self.process.pid})", flush=True)
+                        if not self.first_ready.done():
+                            self.first_ready.set_result(True)
+                        monitor = asyncio.create_task(self.watch())
+                        await asyncio.wait({monitor, self.exited, stop_task}, return_when=asyncio.FIRST_COMPLETED)
+                        monitor.cancel()
+                    elif not self.exited.done() and not self.manager.stopping.is_set():
+                        print(f"❌ {self.label} not ready after {self.manager.ready_timeout:.0f}s")
+                    await self.stop()
+                    await asyncio.gather(*pumps)
+
+                if not self.first_ready.done():
+                    self.first_ready.set_result(False)
+                if self.manager.stopping.is_set():
+                    break
+
+                self.state = "backoff"
+                if loop.time() - started >= STABLE_AFTER:
+                    self.failures = 0
+                self.failures += 1
+                self.restarts += 1
+                delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (self.failures - 1))
+                code = self.process.returncode if self.process else None
+                print(f"⚠️  {self.label} stopped (exit code {code}); restarting in {delay:.0f}s", flush=True)
+                await asyncio.wait({stop_task}, timeout=delay)
+        finally:
+            stop_task.cancel()
+            self.state = "stopped"
+
+
+class ServiceManager:
+    def __init__(self, only=None, replicas=1, base_port=None, verbose=False, ready_timeout=READY_TIMEOUT):
+        self.only = only
+        self.replicas = replicas
+        self.base_port = base_port
+        self.verbose = verbose
+        self.ready_timeout = ready_timeout
+        self.replica_list = []
+        self.stopping = None
+
+    def python(self):
+        if VENV_PYTHON.exists():
+            return str(VENV_PYTHON)
+        print(f"ℹ️  Virtual environment not found at {VENV_PYTHON}; using {sys.executable}")
+        return sys.executable
+
+    def build(self):
+        python = self.python()
         for service_id, config in SERVICES.items():
+            if self.only and service_id not in self.only:
+                continue
             if not config['script'].exists():
                 print(f"❌ Service script not found: {config['script']}")
                 continue
-                
-            success = self.start_service(service_id, config)
-            if not success:
-                print(f"❌ Failed to start {config['name']}")
-                return False
-            
-            # Wait a bit between service starts
-            time.sleep(2)
-        
+            count = self.replicas if service_id == "scanning_service" else 1
+            first = self.base_port if service_id == "scanning_service" and self.base_port else config['port']
+            for i in range(count):
+                self.replica_list.append(Replica(self, service_id, config, first + i, python))
+
+    def print_status(self):
         print("\n" + "=" * 60)
-        print("🎉 All services started successfully!")
-        print("\n📊 Service Status:")
-        
-        for service_id, config in SERVICES.items():
-            if service_id in self.processes:
-                status = "🟢 Running" if self.check_service_health(service_id) else "🔴 Stopped"
-                print(f"   {config['name']}: {status} (Port {config['port']})")
-        
-        print("\n🌐 Service URLs:")
-        print("   Combined Backend: http://localhost:5002")
-        print("   Engraving Service: http://localhost:8004")
-        
-        print("\n📝 API Endpoints:")
-        print("   Health Check: http://localhost:5002/health")
-        print("   Manufactured Items: http://localhost:5002/items/manufactured")
-        print("   Engraving Status: http://localhost:8004/engrave/status")
-        
+        print("📊 Service Status:")
+        for r in self.replica_list:
+            status = "🟢 Running" if r.state == "running" else f"🔴 {r.state.capitalize()}"
+            print(f"   {r.label}: {status} (http://localhost:{r.port}{r.config['health']})")
         print("\n⌨️  Press Ctrl+C to stop all services")
+        print("=" * 60, flush=True)
+
+    async def run(self):
+        print("🎯 QR Manufacturing System - Service Launcher")
         print("=" * 60)
-        
-        return True
-    
-    def run(self):
-        """Main run loop"""
-        try:
-            if not self.start_all_services():
-                return False
-            
-            # Keep the main thread alive and monitor services
-            while self.running:
-                time.sleep(1)
-                
-                # Check if any service died
-                for service_id, service_info in self.processes.items():
-                    if not self.check_service_health(service_id):
-                        config = service_info['config']
-                        print(f"⚠️  {config['name']} has stopped unexpectedly!")
-                
-        except KeyboardInterrupt:
-            print("\n\n⌨️  Keyboard interrupt received")
-        except Exception as e:
-            print(f"\n❌ Unexpected error: {e}")
-        finally:
-            self.stop_all_services()
-            print("\n👋 All services stopped. Goodbye!")
+        self.stopping = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, self.stopping.set)
+
+        self.build()
+        if not self.replica_list:
+            print("❌ Nothing to start")
+            return False
+
+        for r in self.replica_list:
+            print(f"🚀 Starting {r.label}...")
+        tasks = [asyncio.create_task(r.run()) for r in self.replica_list]
+
+        ready = await asyncio.gather(*(r.first_ready for r in self.replica_list))
+        if not self.stopping.is_set():
+            print(f"\n🎉 {sum(ready)}/{len(ready)} services ready")
+            self.print_status()
+
+        await self.stopping.wait()
+        print("\n🛑 Stopping all services...")
+        await asyncio.gather(*tasks)
+        print("\n👋 All services stopped. Goodbye!")
+        return all(ready)
 
-def signal_handler(sig, frame):
-    """Handle shutdown signals"""
-    print(f"\n🛑 Received signal {sig}")
-    sys.exit(0)
 
 def main():
-    # Set up signal handlers
-    signal.signal(signal.SIGINT, signal_handler)
-    signal.signal(signal.SIGTERM, signal_handler)
-    
-    # Start service manager
-    manager = ServiceManager()
-    success = manager.run()
-    
+    parser = argparse.ArgumentParser(description="Start and supervise the QR Manufacturing System services")
+    parser.add_argument("--only", nargs="+", choices=list(SERVICES), help="start just these services")
+    parser.add_argument("--replicas", type=int, default=int(os.getenv("SCANNING_REPLICAS", 1)),
+                        help="scanning_service processes, on consecutive ports")
+    parser.add_argument("--base-port", type=int, help="first scanning_service port (default 5001)")
+    parser.add_argument("--ready-timeout", type=float, default=READY_TIMEOUT)
+    parser.add_argument("--verbose", action="store_true", help="print every output line, not just important ones")
+    args = parser.parse_args()
+
+    manager = ServiceManager(args.only, max(1, args.replicas), args.base_port, args.verbose, args.ready_timeout)
+    success = asyncio.run(manager.run())
     sys.exit(0 if success else 1)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,1157 @@
+"""
+API tests for scanning_service.
+
+Runs against the SQLite stand-in (sqlite_backend.py), so no MySQL is needed.
+The parity tests drive the sync (Flask) and async (Quart) apps with the same
+requests over identically seeded databases and expect identical responses.
+"""
+
+import asyncio
+import base64
+import csv
+import gzip
+import io
+import itertools
+import json
+import os
+import re
+from datetime import date
+from types import SimpleNamespace
+
+import pytest
+
+import cache
+import db
+import metrics
+import scanning_service
+import sqlite_backend
+from db_pool import ConnectionPool, PoolTimeout
+
+_db_counter = itertools.count()
+
+EMPLOYEES = [(1, "John Receiver", "receiver"), (2, "Alice Inspector", "inspector"),
+             (4, "Carol Maintenance", "maintenance"), (5, "Admin User", "admin")]
+ITEMS = [(f"UID-{i:04d}", "ERC", "V-1", "LOT-1", f"S{i}", date(2024, 2, 29), 5, "Manufactured")
+         for i in range(1, 6)]
+
+
+def seeded_pool(**pool_config):
+    """Fresh shared in-memory SQLite DB with the standard fixtures, behind a ConnectionPool"""
+    uri = f"file:sih_test_{next(_db_counter)}?mode=memory&cache=shared"
+    keeper = sqlite_backend.connect(uri)  # keeps the in-memory DB alive
+    sqlite_backend.create_schema(keeper)
+    cur = keeper.cursor()
+    cur.executemany("INSERT INTO employees (id, name, role) VALUES (%s, %s, %s)", EMPLOYEES)
+    cur.executemany("""
+        INSERT INTO items (uid, component_type, vendor_id, lot_no, serial_no, mfg_date, warranty_years, current_status)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+    """, ITEMS)
+    keeper.commit()
+    pool = ConnectionPool(lambda: sqlite_backend.connect(uri), **{"size": 4, **pool_config})
+    pool.keeper = keeper
+    return pool
+
+
+@pytest.fixture(autouse=True)
+def clear_caches():
+    scanning_service.role_cache.invalidate()
+    scanning_service.scan_cache.clear()
+    yield
+
+
+@pytest.fixture
+def sync_client(monkeypatch):
+    monkeypatch.setattr(scanning_service, "db_router", db.Router(seeded_pool()))
+    return scanning_service.app.test_client()
+
+
+# Each step: (method, path, json body)
+SCENARIO = [
+    ("POST", "/scan", {"uid": "UID-0001"}),
+    ("POST", "/scan", {"uid": "UID-9999"}),
+    ("POST", "/scan", {}),
+    ("POST", "/allowed_statuses", {"employee_id": 2}),
+    ("POST", "/allowed_statuses", {"employee_id": 77}),
+    ("POST", "/allowed_statuses", {}),
+    ("POST", "/update_status", {"uid": "UID-0001", "new_status": "Received", "employee_id": 1}),
+    ("POST", "/update_status", {"uid": "UID-0001", "new_status": "Installed", "employee_id": 1}),
+    ("POST", "/update_status", {"uid": "UID-0001", "new_status": "Received", "employee_id": 77}),
+    ("POST", "/update_status", {"uid": "UID-0001"}),
+    ("POST", "/scan", {"uid": "UID-0001"}),
+    ("POST", "/update_status", {"uid": "UID-0001", "new_status": "Inspected", "employee_id": 2, "note": "ok"}),
+    ("POST", "/scan", {"uid": "UID-0001"}),
+    ("POST", "/update_status", {"uid": "UID-0002", "new_status": "Inspected", "employee_id": 2}),
+    ("POST", "/allowed_statuses", {"employee_id": 5, "uid": "UID-0002"}),
+]
+
+
+def normalize(body):
+    # Timestamps come from the wall clock; only their presence is comparable
+    if isinstance(body, dict) and body.get("last_updated"):
+        body = dict(body, last_updated="<set>")
+    return body
+
+
+def run_sync(client):
+    out = []
+    for method, path, payload in SCENARIO:
+        resp = client.open(path, method=method, json=payload)
+        out.append((resp.status_code, normalize(resp.get_json())))
+    return out
+
+
+def run_async(monkeypatch):
+    async_scanning_service = pytest.importorskip("async_scanning_service")
+    monkeypatch.setattr(async_scanning_service, "db",
+                        async_scanning_service.AsyncRouter(async_scanning_service.ThreadedDB(seeded_pool())))
+
+    async def go():
+        client = async_scanning_service.app.test_client()
+        out = []
+        for method, path, payload in SCENARIO:
+            resp = await client.open(path, method=method, json=payload)
+            out.append((resp.status_code, normalize(await resp.get_json())))
+        return out
+
+    return asyncio.run(go())
+
+
+def test_scenario_sync(sync_client):
+    results = run_sync(sync_client)
+    assert results[0][0] == 200 and results[0][1]["current_status"] == "Manufactured"
+    assert results[0][1]["last_updated"] is None
+    assert [code for code, _ in results[1:3]] == [404, 400]
+    assert results[3] == (200, {"role": "inspector", "allowed": ["Inspected"]})
+    assert [code for code, _ in results[6:10]] == [200, 403, 403, 400]
+    assert results[10][1]["current_status"] == "Received"
+    assert results[12][1]["current_status"] == "Inspected"
+    assert results[13][0] == 409 and results[13][1]["current_status"] == "Manufactured"
+    assert results[14][1]["allowed"] == ["Received", "Discarded"]
+
+
+def test_sync_async_parity(sync_client, monkeypatch):
+    pytest.importorskip("quart")
+    sync_results = run_sync(sync_client)
+    scanning_service.role_cache.invalidate()
+    scanning_service.scan_cache.clear()
+    async_results = run_async(monkeypatch)
+    assert async_results == sync_results
+
+
+def test_hot_queries_use_indexes():
+    migrations = pytest.importorskip("migrations")
+    pool = seeded_pool()
+    conn = pool.get()
+    try:
+        results = migrations.check_indexes(conn)
+    finally:
+        conn.close()
+    assert [r["query"] for r in results if not r["ok"]] == []
+    plans = {r["query"]: " ".join(r["plan"]) for r in results}
+    assert "idx_items_vendor_expiry" in plans["expiring.vendor"]  # same index as migration m005
+
+
+def test_archived_history_is_merged(sync_client, tmp_path, monkeypatch):
+    import archive
+    pool = scanning_service.db_router.primary
+    cur = pool.keeper.cursor()
+    cur.executemany("INSERT INTO statuses (uid, status, location, updated_at) VALUES (%s, %s, %s, %s)", [
+        (f"UID-{i:04d}", status, "Depot", f"2023-{month:02d}-1{i} 08:00:00")
+        for i in range(1, 6) for month, status in [(1, "Received"), (2, "Inspected")]
+    ])
+    pool.keeper.commit()
+    sync_client.post("/update_status", json={"uid": "UID-0003", "new_status": "Discarded", "employee_id": 5})
+
+    conn = pool.get()
+    try:
+        summary = archive.archive_statuses(conn, before=archive.datetime(2024, 1, 1),
+                                           archive_dir=str(tmp_path), block_rows=3)
+    finally:
+        conn.close()
+    assert summary["archived"] == summary["deleted"] == 10 and len(summary["segments"]) == 2
+    cur.execute("SELECT COUNT(*) FROM statuses")
+    assert cur.fetchone()[0] == 1
+
+    monkeypatch.setattr(scanning_service, "archive_reader", archive.ArchiveReader(str(tmp_path)))
+    body = sync_client.get("/history/UID-0003").get_json()
+    assert [r["status"] for r in body["history"]] == ["Received", "Inspected", "Discarded"]
+    assert body["archived"] == 2
+    assert sync_client.get("/history/UID-9999").status_code == 404
+
+
+def test_archive_segments_sort_mixed_case_uids_for_lookup(tmp_path, monkeypatch):
+    import archive
+    use_case_insensitive_uids(monkeypatch)  # ORDER BY uid alone would interleave the cases
+    pool = seeded_pool()
+    uids = ["a-1", "B-2", "c-3", "D-4", "E-5", "f-6", "G-7"]
+    cur = pool.keeper.cursor()
+    cur.executemany("INSERT INTO statuses (uid, status, location, updated_at) VALUES (%s, %s, %s, %s)",
+                    [(uid, "Received", "Depot", f"2023-01-0{i + 1} 08:00:00") for i, uid in enumerate(uids)])
+    pool.keeper.commit()
+
+    conn = pool.get()
+    try:
+        archive.archive_statuses(conn, before=archive.datetime(2024, 1, 1), archive_dir=str(tmp_path), block_rows=2)
+    finally:
+        conn.close()
+    reader = archive.ArchiveReader(str(tmp_path))
+    assert {uid: [r["uid"] for r in reader.rows_for(uid)] for uid in uids} == {uid: [uid] for uid in uids}
+    assert reader.rows_for("A-1") == []
+
+
+def test_analytics_rollups_track_every_write_path(sync_client):
+    assert sync_client.post("/analytics/reconcile").get_json()["corrected"] == 1  # seeded rows
+    sync_client.post("/update_status", json={"uid": "UID-0001", "new_status": "Received", "employee_id": 1})
+    sync_client.post("/update_status/batch", json={"updates": [
+        {"uid": "UID-0002", "new_status": "Received", "employee_id": 5},
+        {"uid": "UID-0002", "new_status": "Inspected", "employee_id": 5}]})
+    sync_client.post("/sync", json={"events": [{"key": "k1", "uid": "UID-0003", "new_status": "Received",
+                                                "employee_id": 1, "recorded_at": "2024-05-01T08:00:00Z"}]})
+    counts = {g["status"]: g["count"] for g in sync_client.get("/analytics").get_json()["groups"]}
+    assert counts == {"Manufactured": 2, "Received": 2, "Inspected": 1}
+    assert sync_client.post("/analytics/reconcile").get_json()["corrected"] == 0
+
+    sync_client.post("/update_status/lot", json={"lot_no": "LOT-1", "new_status": "Discarded", "employee_id": 5})
+    body = sync_client.get("/analytics?group_by=vendor,status").get_json()
+    assert body["total"] == 5 and body["groups"] == [{"vendor_id": "V-1", "status": "Discarded", "count": 5}]
+    assert sync_client.get("/analytics?group_by=colour").status_code == 400
+    failures = sync_client.get("/analytics/failures").get_json()["groups"]
+    assert failures == [{"vendor_id": "V-1", "items": 5, "failed": 0, "failure_rate": 0.0}]
+    assert sync_client.post("/analytics/reconcile").get_json()["corrected"] == 0
+
+
+def test_reads_route_to_replicas_with_read_your_writes(monkeypatch):
+    # The "replica" is a separately seeded copy, so it never sees the primary's writes
+    router = db.Router(seeded_pool(), [("replica-1", seeded_pool())])
+    monkeypatch.setattr(scanning_service, "db_router", router)
+    client = scanning_service.app.test_client()
+
+    assert client.post("/scan", json={"uid": "UID-0001"}).get_json()["current_status"] == "Manufactured"
+    assert router.stats()["routing"]["replica_reads"] >= 1
+    resp = client.post("/update_status", json={"uid": "UID-0001", "new_status": "Received", "employee_id": 1})
+    assert resp.status_code == 200
+    # Sticky: the writer's next read sees its own write, other UIDs still use the replica
+    assert client.post("/scan", json={"uid": "UID-0001"}).get_json()["current_status"] == "Received"
+    assert router.stats()["routing"]["sticky_reads"] == 1
+    reads = router.stats()["routing"]["replica_reads"]
+    assert client.post("/scan", json={"uid": "UID-0002"}).status_code == 200
+    assert router.stats()["routing"]["replica_reads"] == reads + 1
+
+
+def test_failed_replica_falls_back_to_primary():
+    def refuse():
+        raise ConnectionError("replica unreachable")
+
+    router = db.Router(seeded_pool(), [("replica-1", ConnectionPool(refuse, size=1))], down_seconds=60)
+    for _ in range(3):
+        conn = router.read("UID-0001")
+        conn.close()
+    stats = router.stats()
+    assert stats["replicas"][0]["down"] is True
+    assert stats["routing"]["replica_failures"] == 1  # skipped while marked down
+    assert stats["routing"]["primary_fallbacks"] == 3
+
+
+def test_pool_is_bounded_and_times_out(monkeypatch):
+    pool = seeded_pool(size=2, timeout=0.05)
+    held = [pool.get(), pool.get()]
+    with pytest.raises(PoolTimeout):
+        pool.get()
+    assert pool.stats()["timeouts"] == 1 and pool.stats()["in_use"] == 2
+
+    # The endpoints turn an exhausted pool into a 503 instead of hanging
+    monkeypatch.setattr(scanning_service, "db_router", db.Router(pool))
+    resp = scanning_service.app.test_client().post("/scan", json={"uid": "UID-0001"})
+    assert resp.status_code == 503 and resp.get_json()["error"] == "Database busy, try again"
+
+    held.pop().close()
+    pool.get().close()
+    assert pool.stats()["created"] == 2  # the released connection was reused
+
+
+def test_pool_rolls_back_on_release_and_replaces_unhealthy_connections():
+    healthy = {"ok": True}
+    pool = seeded_pool(size=1, health_check=lambda conn: healthy["ok"])
+    conn = pool.get()
+    cur = conn.cursor()
+    cur.execute("UPDATE items SET current_status='Lost' WHERE uid='UID-0001'")
+    cur.close()
+    conn.close()  # never committed: must not leak into the next checkout
+
+    conn = pool.get()
+    cur = conn.cursor()
+    cur.execute("SELECT current_status FROM items WHERE uid='UID-0001'")
+    assert cur.fetchone()[0] == "Manufactured"
+    cur.close()
+    conn.close()
+
+    healthy["ok"] = False
+    pool.get().close()
+    stats = pool.stats()
+    assert stats["failed_health_checks"] == 1 and stats["created"] == 2 and stats["open"] == 1
+
+
+def test_ttl_cache_expires_and_evicts_least_recently_used(monkeypatch):
+    clock = SimpleNamespace(now=1000.0)
+    monkeypatch.setattr(cache, "time", SimpleNamespace(monotonic=lambda: clock.now))
+    roles = cache.TTLCache(maxsize=2, ttl=60)
+    roles.set("1", "receiver")
+    roles.set("2", "inspector")
+    assert roles.get("1") == "receiver"  # 1 is now the most recently used
+    roles.set("3", None, ttl=5)          # negative entry, evicts 2
+    assert roles.get("2") is cache.MISSING and roles.get("3") is None
+    clock.now += 6
+    assert roles.get("3") is cache.MISSING and roles.get("1") == "receiver"
+    clock.now += 60
+    assert roles.get("1") is cache.MISSING
+    stats = roles.stats()
+    assert (stats["evictions"], stats["expirations"], stats["size"]) == (1, 2, 0)
+
+
+def test_employee_roles_are_cached_until_invalidated(sync_client):
+    keeper = scanning_service.db_router.primary.keeper
+    assert sync_client.post("/allowed_statuses", json={"employee_id": 2}).get_json()["role"] == "inspector"
+    assert sync_client.post("/allowed_statuses", json={"employee_id": 77}).status_code == 404
+    keeper.cursor().execute("UPDATE employees SET role='receiver' WHERE id=2")
+    keeper.cursor().execute("INSERT INTO employees (id, name, role) VALUES (77, 'New Hire', 'receiver')")
+    keeper.commit()
+    hits = scanning_service.role_cache.stats()["hits"]
+
+    # Served from the cache (including the negative entry) until invalidated
+    assert sync_client.post("/allowed_statuses", json={"employee_id": 2}).get_json()["role"] == "inspector"
+    assert sync_client.post("/allowed_statuses", json={"employee_id": 77}).status_code == 404
+    assert scanning_service.role_cache.stats()["hits"] == hits + 2
+
+    assert sync_client.post("/role_cache/invalidate", json={"employee_id": 2}).get_json()["invalidated"] == 1
+    assert sync_client.post("/allowed_statuses", json={"employee_id": 2}).get_json()["role"] == "receiver"
+    sync_client.post("/role_cache/invalidate", json={})
+    assert sync_client.post("/allowed_statuses", json={"employee_id": 77}).get_json()["role"] == "receiver"
+
+
+def test_scan_batch_resolves_in_request_order(sync_client, monkeypatch):
+    monkeypatch.setattr(scanning_service, "IN_CLAUSE_CHUNK", 2)  # several chunks for 5 UIDs
+    sync_client.post("/scan", json={"uid": "UID-0004"})           # one comes from scan_cache
+    uids = ["UID-0005", "UID-9999", "UID-0001", "UID-0005", "UID-0004", "UID-0002", "UID-0003"]
+    body = sync_client.post("/scan/batch", json={"uids": uids}).get_json()
+    assert [r["uid"] for r in body["results"]] == list(dict.fromkeys(uids))
+    assert body["results"][1] == {"uid": "UID-9999", "error": "Item not found"}
+    assert (body["found"], body["not_found"]) == (5, 1)
+    single = sync_client.post("/scan", json={"uid": "UID-0001"}).get_json()
+    assert body["results"][2] == single
+
+    assert sync_client.post("/scan/batch", json={"uids": []}).status_code == 400
+    assert sync_client.post("/scan/batch", json={"uids": ["UID-0001", 7]}).status_code == 400
+    monkeypatch.setattr(scanning_service, "MAX_BATCH_SIZE", 2)
+    assert sync_client.post("/scan/batch", json={"uids": ["A", "B", "C"]}).status_code == 413
+
+
+def use_case_insensitive_uids(monkeypatch):
+    """MySQL's default collation compares uids case-insensitively; NOCASE stands in for it"""
+    schema = (sqlite_backend.SCHEMA
+              .replace("uid VARCHAR(64) PRIMARY KEY,", "uid VARCHAR(64) PRIMARY KEY COLLATE NOCASE,")
+              .replace("uid VARCHAR(64) NOT NULL,", "uid VARCHAR(64) NOT NULL COLLATE NOCASE,"))
+    monkeypatch.setattr(sqlite_backend, "SCHEMA", schema)
+
+
+def test_scan_batch_files_rows_under_the_requested_spelling(monkeypatch):
+    use_case_insensitive_uids(monkeypatch)
+    monkeypatch.setattr(scanning_service, "db_router", db.Router(seeded_pool()))
+    client = scanning_service.app.test_client()
+    uids = ["uid-0001", "UID-0002", "Uid-0002", "uid-9999"]
+    body = client.post("/scan/batch", json={"uids": uids}).get_json()
+    assert [r["uid"] for r in body["results"]] == uids
+    assert (body["found"], body["not_found"]) == (3, 1)
+    assert body["results"][0]["current_status"] == "Manufactured"
+
+
+BATCH_UPDATES = [
+    {"uid": "UID-0001", "new_status": "Received", "employee_id": 1},
+    {"uid": "UID-0001", "new_status": "Inspected", "employee_id": 2, "note": "ok"},  # chains on the row above
+    {"uid": {"nested": 1}, "new_status": "Received", "employee_id": 1},
+    {"uid": "UID-0002", "new_status": "Received", "employee_id": [1]},
+    {"uid": "UID-0002", "new_status": "Received", "employee_id": 1, "note": {"a": 1}},
+    "UID-0002",
+    {"uid": "UID-9999", "new_status": "Received", "employee_id": 1},
+    {"uid": "UID-0003", "new_status": "Inspected", "employee_id": 2},
+    {"uid": "UID-0003", "new_status": "Inspected", "employee_id": 1},
+    {"uid": "UID-0003", "new_status": "Received", "employee_id": 77},
+]
+BATCH_REJECTED = ["invalid", "invalid", "invalid", "invalid", "not_found", "conflict", "forbidden", "forbidden"]
+
+
+def test_batch_update_atomic_writes_nothing_on_any_rejection(sync_client):
+    resp = sync_client.post("/update_status/batch", json={"updates": BATCH_UPDATES})
+    body = resp.get_json()
+    assert resp.status_code == 400 and (body["applied"], body["rejected"]) == (0, 8)
+    assert [r["result"] for r in body["results"]] == ["skipped", "skipped"] + BATCH_REJECTED
+    assert sync_client.post("/scan", json={"uid": "UID-0001"}).get_json()["current_status"] == "Manufactured"
+
+    resp = sync_client.post("/update_status/batch", json={"updates": BATCH_UPDATES[:2]})
+    assert resp.status_code == 200 and resp.get_json()["applied"] == 2
+    assert sync_client.post("/scan", json={"uid": "UID-0001"}).get_json()["current_status"] == "Inspected"
+
+
+def test_batch_update_best_effort_writes_the_valid_rows(sync_client):
+    resp = sync_client.post("/update_status/batch", json={"mode": "best_effort", "updates": BATCH_UPDATES})
+    body = resp.get_json()
+    assert resp.status_code == 200 and (body["applied"], body["rejected"]) == (2, 8)
+    assert [r["result"] for r in body["results"]] == ["ok", "ok"] + BATCH_REJECTED
+    assert body["results"][3]["error"] == "employee_id must be an integer or string"
+    assert sync_client.post("/scan", json={"uid": "UID-0001"}).get_json()["current_status"] == "Inspected"
+    assert sync_client.post("/scan", json={"uid": "UID-0002"}).get_json()["current_status"] == "Manufactured"
+    history = sync_client.get("/history/UID-0001").get_json()["history"]
+    assert [(r["status"], r["note"]) for r in history] == [("Received", ""), ("Inspected", "ok")]
+
+    assert sync_client.post("/update_status/batch", json={"mode": "all", "updates": BATCH_UPDATES}).status_code == 400
+    assert sync_client.post("/update_status/batch", json={"updates": []}).status_code == 400
+
+
+def test_lot_update_moves_only_items_that_can_transition(sync_client):
+    sync_client.post("/scan", json={"uid": "UID-0002"})  # cached before the lot write
+    sync_client.post("/update_status", json={"uid": "UID-0001", "new_status": "Received", "employee_id": 1})
+    sync_client.post("/update_status", json={"uid": "UID-0001", "new_status": "Inspected", "employee_id": 2})
+
+    lot = {"lot_no": "LOT-1", "new_status": "Received", "employee_id": 1}
+    body = sync_client.post("/update_status/lot", json=lot).get_json()
+    assert (body["updated"], body["skipped"]) == (4, 1)
+    assert sync_client.post("/scan", json={"uid": "UID-0002"}).get_json()["current_status"] == "Received"
+    assert sync_client.post("/scan", json={"uid": "UID-0001"}).get_json()["current_status"] == "Inspected"
+    cur = scanning_service.db_router.primary.keeper.cursor()
+    cur.execute("SELECT COUNT(*) FROM statuses WHERE uid='UID-0005'")
+    assert cur.fetchone()[0] == 1
+
+    resp = sync_client.post("/update_status/lot", json=lot)
+    assert resp.status_code == 409 and resp.get_json()["skipped"] == 5
+    assert sync_client.post("/update_status/lot", json={**lot, "vendor_id": "V-2"}).status_code == 404
+    assert sync_client.post("/update_status/lot", json={**lot, "employee_id": 2}).status_code == 403
+    assert sync_client.post("/update_status/lot", json={"lot_no": "LOT-1"}).status_code == 400
+
+
+def make_response_cache(kind, ttl=300.0):
+    if kind == "redis":
+        fakeredis = pytest.importorskip("fakeredis")
+        return cache.ResponseCache(cache.RedisBackend(fakeredis.FakeRedis(), ttl=ttl))
+    return cache.ResponseCache(cache.LocalBackend(ttl=ttl))
+
+
+def test_scan_cache_serves_hits_until_a_write_invalidates(sync_client):
+    keeper = scanning_service.db_router.primary.keeper
+    hits = scanning_service.scan_cache.stats()["hits"]
+    assert sync_client.post("/scan", json={"uid": "UID-0001"}).get_json()["current_status"] == "Manufactured"
+    keeper.cursor().execute("UPDATE items SET serial_no='edited' WHERE uid='UID-0001'")
+    keeper.commit()
+    assert sync_client.post("/scan", json={"uid": "UID-0001"}).get_json()["serial_no"] == "S1"  # cached
+    assert scanning_service.scan_cache.stats()["hits"] == hits + 1
+
+    sync_client.post("/update_status", json={"uid": "UID-0001", "new_status": "Received", "employee_id": 1})
+    body = sync_client.post("/scan", json={"uid": "UID-0001"}).get_json()
+    assert (body["current_status"], body["serial_no"]) == ("Received", "edited")
+
+
+def test_scan_cache_entries_expire_after_ttl(monkeypatch):
+    clock = SimpleNamespace(now=1000.0)
+    monkeypatch.setattr(cache, "time", SimpleNamespace(monotonic=lambda: clock.now))
+    local = make_response_cache("local", ttl=300)
+    local.set("UID-0001", "{}")
+    clock.now += 299
+    assert local.get("UID-0001") == "{}"
+    clock.now += 2
+    assert local.get("UID-0001") is None
+
+    shared = make_response_cache("redis", ttl=300)
+    shared.set("UID-0001", "{}")
+    assert 0 < shared.backend._client.ttl("scan:UID-0001") <= 300
+
+
+@pytest.mark.parametrize("kind", ["local", "redis"])
+def test_response_cache_skips_sets_that_raced_an_invalidation(kind):
+    scans = make_response_cache(kind)
+    before = scans.generations(["UID-0001", "UID-0002"])
+    scans.invalidate("UID-0001")                   # a writer committed after our read
+    scans.set("UID-0001", "stale", before["UID-0001"])
+    scans.set("UID-0002", "fresh", before["UID-0002"])
+    assert scans.get("UID-0001") is None and scans.get("UID-0002") in ("fresh", b"fresh")
+
+    before = scans.generations(["UID-0002"])
+    scans.clear()
+    scans.set("UID-0002", "stale", before["UID-0002"])
+    assert scans.get("UID-0002") is None
+    scans.set("UID-0002", "fresh", scans.generations(["UID-0002"])["UID-0002"])
+    assert scans.get("UID-0002") in ("fresh", b"fresh")
+    assert (scans.stats()["sets"], scans.stats()["stale_sets"]) == (2, 2)
+
+
+def test_scan_racing_a_write_does_not_cache_the_old_row(sync_client, monkeypatch):
+    keeper = scanning_service.db_router.primary.keeper
+    build = scanning_service.build_scan_result
+
+    def write_after_read(uid, item):
+        # Another worker commits and invalidates between our SELECT and scan_cache.set
+        keeper.cursor().execute("UPDATE items SET current_status='Received' WHERE uid=%s", (uid,))
+        keeper.commit()
+        scanning_service.scan_cache.invalidate(uid)
+        return build(uid, item)
+
+    monkeypatch.setattr(scanning_service, "build_scan_result", write_after_read)
+    assert sync_client.post("/scan", json={"uid": "UID-0001"}).get_json()["current_status"] == "Manufactured"
+    monkeypatch.setattr(scanning_service, "build_scan_result", build)
+    assert sync_client.post("/scan", json={"uid": "UID-0001"}).get_json()["current_status"] == "Received"
+
+
+METRICS_REQUESTS = [("/scan", {"uid": "UID-0001"}),
+                    ("/update_status", {"uid": "UID-0001", "new_status": "Received", "employee_id": 1})]
+
+
+def phase_series(text):
+    """{(endpoint, phase)} with a phase histogram in a /metrics scrape"""
+    prefix = "scanning_phase_duration_seconds_count{"
+    return {tuple(part.split("=")[1].strip('"') for part in line[len(prefix):line.index("}")].split(","))
+            for line in text.splitlines() if line.startswith(prefix)}
+
+
+def test_metrics_expose_phase_histograms_for_both_apps(sync_client, monkeypatch):
+    async_scanning_service = pytest.importorskip("async_scanning_service")
+    metrics.registry.reset()
+    for path, payload in METRICS_REQUESTS:
+        sync_client.post(path, json=payload)
+    sync_text = sync_client.get("/metrics").get_data(as_text=True)
+    expected = {("scan_qr", "cache"), ("scan_qr", "connect"), ("scan_qr", "item_query"), ("scan_qr", "serialize"),
+                ("update_status", "role_lookup"), ("update_status", "item_query"), ("update_status", "insert"),
+                ("update_status", "update"), ("update_status", "rollup"), ("update_status", "commit")}
+    assert expected <= phase_series(sync_text)
+
+    metrics.registry.reset()
+    scanning_service.role_cache.invalidate()
+    scanning_service.scan_cache.clear()
+    monkeypatch.setattr(async_scanning_service, "db",
+                        async_scanning_service.AsyncRouter(async_scanning_service.ThreadedDB(seeded_pool())))
+
+    async def go():
+        client = async_scanning_service.app.test_client()
+        for path, payload in METRICS_REQUESTS:
+            await client.post(path, json=payload)
+        return await (await client.get("/metrics")).get_data(as_text=True)
+
+    async_text = asyncio.run(go())
+    assert phase_series(async_text) == phase_series(sync_text)
+    assert 'scanning_db_queries_per_request_count{endpoint="update_status"} 1' in async_text
+    for gauge in ("scanning_db_pool_checkouts", "scanning_role_cache_hits", "scanning_scan_cache_misses"):
+        assert f"\n{gauge} " in async_text
+
+
+def sync_event(key, uid, new_status, employee_id, recorded_at, **extra):
+    return {"key": key, "uid": uid, "new_status": new_status, "employee_id": employee_id,
+            "recorded_at": recorded_at, **extra}
+
+
+def test_sync_replays_are_acked_as_duplicates(sync_client):
+    events = [sync_event("k1", "UID-0001", "Received", 1, "2024-05-01T08:00:00Z"),
+              sync_event("k2", "UID-0001", "Inspected", 2, "2024-05-01T09:00:00Z")]
+    body = sync_client.post("/sync", json={"device_id": "HH-1", "events": events + events[:1]}).get_json()
+    assert body == {"accepted": ["k1", "k2"], "duplicates": [], "rejected": {}, "ignored": 0}
+
+    # The device lost the ack and sends its whole queue again
+    body = sync_client.post("/sync", json={"device_id": "HH-1", "events": events}).get_json()
+    assert body == {"accepted": [], "duplicates": ["k1", "k2"], "rejected": {}, "ignored": 0}
+    assert len(sync_client.get("/history/UID-0001").get_json()["history"]) == 2
+    assert sync_client.post("/scan", json={"uid": "UID-0001"}).get_json()["current_status"] == "Inspected"
+
+
+def test_sync_applies_out_of_order_events_in_device_time_order(sync_client):
+    delivered = [sync_event("k2", "UID-0001", "Inspected", 2, "2024-05-01T09:00:00Z"),
+                 sync_event("k1", "UID-0001", "Received", 1, "2024-05-01T10:00:00+02:00")]  # 08:00 UTC
+    assert sync_client.post("/sync", json={"events": delivered}).get_json()["accepted"] == ["k1", "k2"]
+    scan = sync_client.post("/scan", json={"uid": "UID-0001"}).get_json()
+    assert (scan["current_status"], scan["last_updated"]) == ("Inspected", "2024-05-01 09:00:00")
+
+    # A straggler older than the item's latest status only lands in the audit trail
+    late = sync_event("k0", "UID-0001", "Received", 1, "2024-05-01T07:00:00Z")
+    assert sync_client.post("/sync", json={"events": [late]}).get_json()["accepted"] == ["k0"]
+    assert sync_client.post("/scan", json={"uid": "UID-0001"}).get_json()["current_status"] == "Inspected"
+    assert len(sync_client.get("/history/UID-0001").get_json()["history"]) == 3
+
+    # A newer event still has to be a legal transition from the latest status
+    newer = sync_event("k3", "UID-0001", "Received", 1, "2024-05-01T10:00:00Z")
+    body = sync_client.post("/sync", json={"events": [newer]}).get_json()
+    assert body["rejected"] == {"k3": "Cannot move item from 'Inspected' to 'Received'"}
+
+
+def test_sync_rejects_malformed_events_one_by_one(sync_client):
+    ts = "2024-05-01T08:00:00Z"
+    events = [sync_event("bad-employee", "UID-0002", "Received", [1], ts),
+              sync_event("bad-uid", {"uid": "UID-0002"}, "Received", 1, ts),
+              sync_event("bad-note", "UID-0002", "Received", 1, ts, note=["x"]),
+              sync_event("bad-time", "UID-0002", "Received", 1, "yesterday"),
+              sync_event("no-time", "UID-0002", "Received", 1, None),
+              sync_event("future", "UID-0002", "Received", 1, "2999-01-01T00:00:00Z"),
+              sync_event("unknown", "UID-9999", "Received", 1, ts),
+              sync_event("forbidden", "UID-0002", "Received", 2, ts),
+              {"uid": "UID-0002", "new_status": "Received"},  # no key: can't be acked
+              "k9",
+              sync_event("ok", "UID-0002", "Received", 1, ts)]
+    resp = sync_client.post("/sync", json={"events": events})
+    body = resp.get_json()
+    assert resp.status_code == 200 and body["accepted"] == ["ok"] and body["ignored"] == 2
+    assert body["rejected"] == {
+        "bad-employee": "employee_id must be an integer or string",
+        "bad-uid": "uid and new_status must be strings",
+        "bad-note": "note must be a string",
+        "bad-time": "recorded_at must be ISO-8601",
+        "no-time": "recorded_at required",
+        "future": "recorded_at is in the future",
+        "unknown": "Item not found",
+        "forbidden": "Role 'inspector' not allowed to set status 'Received'",
+    }
+
+
+def test_changes_feed_never_skips_back_dated_or_same_second_rows(sync_client, monkeypatch):
+    monkeypatch.setattr(scanning_service, "CHANGES_SETTLE_SECONDS", 0)
+    for uid in ("UID-0001", "UID-0002"):  # same second
+        sync_client.post("/update_status", json={"uid": uid, "new_status": "Received", "employee_id": 1})
+    first = sync_client.get("/changes?limit=1").get_json()
+    assert [c["uid"] for c in first["changes"]] == ["UID-0001"] and first["has_more"]
+
+    # A handheld that was offline since 2024 syncs after that cursor went out
+    event = sync_event("k1", "UID-0003", "Received", 1, "2024-05-01T08:00:00Z")
+    assert sync_client.post("/sync", json={"events": [event]}).get_json()["accepted"] == ["k1"]
+    rest = sync_client.get(f"/changes?since={first['next_cursor']}").get_json()
+    assert [c["uid"] for c in rest["changes"]] == ["UID-0002", "UID-0003"] and not rest["has_more"]
+    synced = rest["changes"][-1]
+    assert synced["recorded_at"] == "2024-05-01 08:00:00" and synced["updated_at"] > "2025"
+
+    # Cursors handed out before id paging ("updated_at|id") still resume at their id
+    legacy = base64.urlsafe_b64encode(f"2024-01-01 00:00:00|{first['changes'][0]['id']}".encode()).decode()
+    assert sync_client.get(f"/changes?since={legacy}").get_json()["changes"] == rest["changes"]
+    assert sync_client.get("/changes?since=not-a-cursor").status_code == 400
+
+    # Rows younger than the settle window wait, so a slower lower-id transaction can commit first
+    monkeypatch.setattr(scanning_service, "CHANGES_SETTLE_SECONDS", 60)
+    sync_client.post("/update_status", json={"uid": "UID-0004", "new_status": "Received", "employee_id": 1})
+    assert sync_client.get(f"/changes?since={rest['next_cursor']}").get_json()["changes"] == []
+    monkeypatch.setattr(scanning_service, "CHANGES_SETTLE_SECONDS", 0)
+    later = sync_client.get(f"/changes?since={rest['next_cursor']}").get_json()["changes"]
+    assert [c["uid"] for c in later] == ["UID-0004"]
+
+
+def test_status_writes_past_the_changes_settle_bound_roll_back(sync_client, monkeypatch):
+    assert scanning_service.CHANGES_SETTLE_SECONDS == 2 * scanning_service.STATUS_WRITE_MAX_SECONDS + \
+        scanning_service.CHANGES_CLOCK_SKEW_SECONDS
+    monkeypatch.setattr(scanning_service, "CHANGES_SETTLE_SECONDS", 0)
+    monkeypatch.setattr(scanning_service, "STATUS_WRITE_MAX_SECONDS", -1)  # every write is late
+    resp = sync_client.post("/update_status", json={"uid": "UID-0001", "new_status": "Received", "employee_id": 1})
+    assert resp.status_code == 500 and "rolled back" in resp.get_json()["error"]
+    event = sync_event("k1", "UID-0002", "Received", 1, "2024-05-01T08:00:00Z")
+    assert sync_client.post("/sync", json={"events": [event]}).status_code == 500
+    assert sync_client.get("/changes").get_json()["changes"] == []
+    assert sync_client.post("/scan", json={"uid": "UID-0001"}).get_json()["current_status"] == "Manufactured"
+
+
+def test_history_export_streams_csv_and_gzipped_ndjson(sync_client):
+    import export_history
+    sync_client.post("/update_status", json={"uid": "UID-0001", "new_status": "Received", "employee_id": 1})
+    sync_client.post("/update_status", json={"uid": "UID-0001", "new_status": "Inspected", "employee_id": 2})
+    sync_client.post("/update_status", json={"uid": "UID-0002", "new_status": "Received", "employee_id": 1})
+
+    resp = sync_client.get("/export/history?format=csv&uid=UID-0001")
+    assert resp.mimetype == "text/csv" and "status_history.csv" in resp.headers["Content-Disposition"]
+    rows = list(csv.DictReader(io.StringIO(resp.get_data(as_text=True))))
+    assert [r["status"] for r in rows] == ["Received", "Inspected"]
+    assert (rows[0]["mfg_date"], rows[0]["expiry_date"], rows[0]["recorded_at"]) == ("2024-02-29", "2029-02-28", "")
+
+    resp = sync_client.get("/export/history?format=ndjson&gzip=1&lot_no=LOT-1&status=Received")
+    assert resp.mimetype == "application/gzip"
+    lines = [json.loads(line) for line in gzip.decompress(resp.get_data()).decode().splitlines()]
+    assert [(r["uid"], r["status"], r["employee_id"]) for r in lines] == [("UID-0001", "Received", 1),
+                                                                          ("UID-0002", "Received", 1)]
+    assert sync_client.get("/export/history?format=xml").status_code == 400
+    assert scanning_service.db_router.primary.stats()["in_use"] == 0
+
+    # The connection is checked out before the response starts, so a busy pool is a 503
+    held = [scanning_service.db_router.primary.get() for _ in range(4)]
+    scanning_service.db_router.primary.timeout = 0.05
+    try:
+        assert sync_client.get("/export/history?format=csv").status_code == 503
+    finally:
+        for c in held:
+            c.close()
+
+    # Rows are pulled and encoded a chunk at a time (header first for CSV)
+    conn = scanning_service.db_router.primary.get()
+    try:
+        parts = list(export_history.export(conn, "csv", chunk_size=1))
+    finally:
+        conn.close()
+    assert len(parts) == 4 and parts[0].decode().startswith("status_id,uid,status")
+
+
+LEAP_CASES = [  # (mfg_date, warranty_years, expiry); the old 365-day-year formula got all but the first wrong
+    (date(2024, 2, 29), 1, date(2025, 2, 28)),
+    (date(2020, 2, 29), 5, date(2025, 2, 28)),
+    (date(2023, 3, 1), 1, date(2024, 3, 1)),
+    (date(2022, 6, 15), 10, date(2032, 6, 15)),
+    (date(2024, 2, 28), 1, date(2025, 2, 28)),
+    (date(2024, 2, 29), 4, date(2028, 2, 29)),
+    (date(2019, 12, 31), 1, date(2020, 12, 31)),
+    (None, 5, None),
+    (date(2024, 2, 29), None, None),
+]
+
+
+@pytest.mark.parametrize("vectorized", [True, False], ids=["numpy", "python"])
+def test_expiry_adds_calendar_years_across_leap_days(monkeypatch, vectorized):
+    import warranty
+    if vectorized and warranty.np is None:
+        pytest.skip("numpy not installed")
+    if not vectorized:
+        monkeypatch.setattr(warranty, "np", None)
+    mfg_dates, years, expected = (list(col) for col in zip(*LEAP_CASES))
+    assert warranty.expiry_dates(mfg_dates, years) == expected
+    assert [warranty.compute_expiry(m, y) for m, y in zip(mfg_dates, years)] == expected
+    assert warranty.expiry_dates([], []) == []
+
+
+def test_expiring_pages_through_feb_29_items(sync_client):
+    # Seeded items: made 2024-02-29 with 5-year warranties → the generated column says 2029-02-28
+    assert sync_client.post("/scan", json={"uid": "UID-0001"}).get_json()["expiry_date"] == "2029-02-28"
+    uids, cursor = [], ""
+    for _ in range(3):
+        body = sync_client.get(f"/expiring?from=2029-02-28&days=1&limit=2&cursor={cursor}").get_json()
+        assert all(item["expiry_date"] == "2029-02-28" for item in body["items"])
+        uids += [item["uid"] for item in body["items"]]
+        cursor = body["next_cursor"]
+        if cursor is None:
+            break
+    assert uids == [f"UID-{i:04d}" for i in range(1, 6)]
+    assert sync_client.get("/expiring?from=2029-03-01&days=365").get_json()["items"] == []
+    assert sync_client.get("/expiring?from=2029-02-27&days=1").get_json()["items"] == []
+    assert sync_client.get("/expiring?cursor=%%%").status_code == 400
+
+
+def test_policy_compiles_to_bitmasks():
+    import authz
+    policy = authz.compile_policy({
+        "statuses": ["Manufactured", "Received", "Inspected", "Discarded"],
+        "roles": {"receiver": ["Received"], "admin": ["Received", "Inspected", "Discarded"]},
+        "transitions": {"Manufactured": ["Received", "Discarded"], "Received": ["Inspected"]},
+        "override_roles": ["admin"],
+    }, version="v1")
+    assert policy.bit == {"Manufactured": 1, "Received": 2, "Inspected": 4, "Discarded": 8}
+    assert policy.role_mask == {"receiver": 2, "admin": 14}
+    assert policy.next_mask == {"Manufactured": 10, "Received": 4}
+
+    assert policy.can_set("receiver", "Received") and not policy.can_set("receiver", "Inspected")
+    assert not policy.can_set("nobody", "Received") and not policy.can_set("admin", "Unknown")
+    assert policy.can_transition("Manufactured", "Received") and not policy.can_transition("Received", "Discarded")
+    assert policy.can_transition(None, "Inspected")                  # legacy rows without a status
+    assert not policy.can_transition("Discarded", "Received")        # terminal: no outgoing edges
+    assert policy.can_transition("Discarded", "Received", "admin")   # override role
+    assert policy.transition_error("Received", "Discarded") == "Cannot move item from 'Received' to 'Discarded'"
+    assert policy.allowed_for("admin", "Received") == ["Received", "Inspected", "Discarded"]
+    assert policy.allowed_for("receiver", "Received") == []
+    assert policy.sources_for("Received") == ("Manufactured",) and policy.sources_for("Received", "admin") is None
+
+    for bad in ({"statuses": []}, {"statuses": ["A", "A"]}, {"statuses": ["A"], "roles": {"r": ["B"]}},
+                {"statuses": ["A"], "transitions": {"B": ["A"]}}, {"statuses": ["A"], "transitions": {"A": ["B"]}}):
+        with pytest.raises(ValueError):
+            authz.compile_policy(bad)
+
+
+def test_authorizer_hot_reload_retries_a_half_written_file(tmp_path, monkeypatch):
+    import authz
+    path = tmp_path / "authz.json"
+    config = {"statuses": ["Manufactured", "Received"], "roles": {"receiver": ["Received"]},
+              "transitions": {"Manufactured": ["Received"]}}
+    path.write_text(json.dumps(config))
+    clock = SimpleNamespace(now=1000.0)
+    monkeypatch.setattr(authz, "time", SimpleNamespace(monotonic=lambda: clock.now))
+    authorizer = authz.Authorizer(str(path), check_interval=60)
+    old = authorizer.policy
+
+    def write(text, mtime):
+        path.write_text(text)
+        os.utime(path, (mtime, mtime))
+        clock.now += 61
+
+    write(json.dumps(config)[:20], 2000000000)  # caught mid-write
+    assert authorizer.policy is old and authorizer.reload_errors == 1
+    config["roles"]["inspector"] = ["Received"]
+    write(json.dumps(config), 2000000000)       # finished within the same mtime tick
+    assert authorizer.policy.can_set("inspector", "Received") and authorizer.reloads == 1
+
+    unchanged = authorizer.policy
+    clock.now += 61
+    assert authorizer.policy is unchanged      # same mtime, already loaded: not re-read
+    write("{}", 2000000100)
+    with pytest.raises(ValueError):
+        authorizer.reload()
+    assert authorizer.policy is unchanged
+
+
+MANIFEST = ("vendor_id,lot_no,serial_no,mfg_date,warranty_years,component_type\n"
+            "V-9,LOT-9,S1,2024-01-10,2,ERC\n"
+            "V-9,LOT-9,S2,2024-13-01,2,ERC\n"
+            "V-9,LOT-9,S3,2024-01-10,2,ERC\n")
+
+
+def test_ingest_rejects_bad_and_already_registered_rows(sync_client):
+    assert sync_client.post("/analytics/reconcile").get_json()["corrected"] == 1  # seeded rows
+    first = sync_client.post("/ingest?employee_id=5", data=MANIFEST, content_type="text/csv").get_json()
+    assert (first["read"], first["inserted"], first["lots"]) == (3, 2, {"LOT-9": 2})
+    assert first["rejects"] == [{"line": 3, "uid": None, "error": "mfg_date must be YYYY-MM-DD"}]
+
+    ndjson = "".join(json.dumps(row) + "\n" for row in csv.DictReader(io.StringIO(MANIFEST)))
+    again = sync_client.post("/ingest?employee_id=5", data=ndjson, content_type="application/x-ndjson").get_json()
+    assert (again["inserted"], again["rejected"]) == (0, 3)
+    assert [r["error"] for r in again["rejects"]] == ["mfg_date must be YYYY-MM-DD"] + ["uid already registered"] * 2
+    assert sync_client.post("/ingest?employee_id=1", data=MANIFEST, content_type="text/csv").status_code == 403
+    assert sync_client.post("/analytics/reconcile").get_json()["corrected"] == 0
+
+
+class LoadDataCursor:
+    """MySQL's LOAD DATA LOCAL on SQLite: rows with a duplicate key are skipped, not an error"""
+
+    def __init__(self, cur):
+        self._cur = cur
+        self._loaded = None
+
+    def execute(self, query, params=()):
+        self._loaded = None
+        if not query.startswith("LOAD DATA"):
+            return self._cur.execute(query, params)
+        table, columns = re.search(r"INTO TABLE (\w+) .*\((.*)\)$", query).groups()
+        with open(params[0], encoding="utf-8") as f:
+            rows = [[None if v == "\\N" else v for v in line.rstrip("\n").split("\t")] for line in f]
+        self._loaded = 0
+        for row in rows:
+            self._cur.execute(f"INSERT OR IGNORE INTO {table} ({columns}) VALUES ({','.join(['%s'] * len(row))})",
+                              row)
+            self._loaded += self._cur.rowcount
+
+    @property
+    def rowcount(self):
+        return self._cur.rowcount if self._loaded is None else self._loaded
+
+    def __getattr__(self, name):
+        return getattr(self._cur, name)
+
+
+@pytest.mark.parametrize("load_data", [False, True])
+def test_ingest_racing_a_concurrent_registration_keeps_rollups_exact(monkeypatch, load_data):
+    import analytics
+    import ingest
+    conn = seeded_pool().keeper
+    analytics.reconcile(conn)
+    # UID-0001 is registered by "another ingest" between the existence check and the load
+    real_existing_uids = ingest.existing_uids
+    checks = []
+
+    def stale_first_check(cur, uids):
+        checks.append(uids)
+        return set() if len(checks) == 1 else real_existing_uids(cur, uids)
+
+    monkeypatch.setattr(ingest, "existing_uids", stale_first_check)
+    wrapped = SimpleNamespace(cursor=lambda **kw: LoadDataCursor(conn.cursor(**kw)),
+                              commit=conn.commit, rollback=conn.rollback)
+    manifest = ("uid,vendor_id,lot_no,serial_no,mfg_date,warranty_years\n"
+                "UID-0001,V-1,LOT-1,S1,2024-02-29,5\n"
+                "UID-0100,V-1,LOT-1,S100,2024-02-29,5\n")
+    report = ingest.ingest(wrapped, io.StringIO(manifest), load_data=load_data).as_dict()
+
+    assert (report["inserted"], len(checks)) == (1, 2)
+    assert report["rejects"] == [{"line": 2, "uid": "UID-0001", "error": "uid already registered"}]
+    cur = conn.cursor()
+    cur.execute("SELECT uid FROM statuses")
+    assert cur.fetchall() == [("UID-0100",)]
+    assert analytics.reconcile(conn)["corrected"] == 0
+
+
+def png_bytes(side):
+    from PIL import Image
+    out = io.BytesIO()
+    Image.new("L", (side, side), 255).save(out, "PNG")
+    return out.getvalue()
+
+
+def test_scan_image_fails_bad_images_without_failing_the_batch(sync_client, monkeypatch):
+    import image_decode
+    from PIL import Image
+
+    def decoder(img):  # finds a code in 32px images, crashes on 33px ones
+        if img.width == 33:
+            raise RuntimeError("decoder bug")
+        return ["UID-0001"] if img.width == 32 else []
+
+    monkeypatch.setattr(image_decode, "DECODERS", [("fake", decoder)])
+    monkeypatch.setattr(scanning_service, "decode_pool", image_decode.DecodePool(workers=1))
+    monkeypatch.setattr(Image, "MAX_IMAGE_PIXELS", 600)  # 64x64 is over twice the limit: a "bomb"
+    uploads = {"a": (png_bytes(32), "a.png"), "b": (b"not an image", "b.png"),
+               "c": (png_bytes(64), "c.png"), "d": (png_bytes(33), "d.png"), "e": (png_bytes(16), "e.png")}
+    with pytest.warns(Image.DecompressionBombWarning):
+        body = sync_client.post("/scan/image", content_type="multipart/form-data",
+                                data={k: (io.BytesIO(data), name) for k, (data, name) in uploads.items()}).get_json()
+
+    assert (body["decoded"], body["failed"]) == (1, 4)
+    images = body["images"]
+    assert images[0]["uids"] == ["UID-0001"] and images[0]["results"][0]["current_status"] == "Manufactured"
+    assert [img.get("error") for img in images] == [
+        None, "not a readable image", "image too large", "decode failed at raw (RuntimeError)", "no code found"]
+
+
+def test_process_pools_decode_in_order_and_recover_from_a_dead_worker():
+    from concurrent.futures.process import BrokenProcessPool
+
+    import image_decode
+    from process_pool import ProcessPool
+
+    decode_pool = image_decode.DecodePool(workers=2)
+    try:
+        results = decode_pool.decode_many([b"junk", png_bytes(16), b""])
+        assert [r["error"] for r in results] == ["not a readable image", "no code found", "not a readable image"]
+    finally:
+        decode_pool.close()
+
+    pool = ProcessPool(2)
+    try:
+        assert pool.map(abs, [-1, -2, 3]) == [1, 2, 3]
+        with pytest.raises(BrokenProcessPool):
+            pool.submit(os._exit, 1).result()
+        pool.close()
+        assert pool.map(abs, [-4]) == [4]  # a fresh pool after close()
+    finally:
+        pool.close()
+
+
+@pytest.fixture
+def code_store(tmp_path, monkeypatch):
+    import codegen
+    store = codegen.CodeStore(str(tmp_path), workers=1)
+    monkeypatch.setattr(scanning_service, "code_store", store)
+    return store
+
+
+def test_codes_render_png_and_svg_once_then_serve_the_cache(sync_client, code_store):
+    import codegen
+    from PIL import Image
+
+    resp = sync_client.get("/codes/UID-0001?scale=3&border=2&module_mm=0.25")
+    assert resp.status_code == 200 and resp.mimetype == "image/png"
+    spec = codegen.make_spec(scale=3, border=2, module_mm=0.25)
+    assert resp.headers["ETag"].strip('"') == codegen.cache_key("UID-0001", spec)
+    img = Image.open(io.BytesIO(resp.get_data()))
+    matrix = codegen.qr_matrix("UID-0001")
+    assert img.mode == "1" and img.size == ((len(matrix) + 4) * 3,) * 2 and round(img.info["dpi"][0]) == 305
+    px = img.load()
+    assert [[px[3 * (x + 2) + 1, 3 * (y + 2) + 1] == 0 for x in range(len(matrix))]
+            for y in range(len(matrix))] == matrix
+
+    again = sync_client.get("/codes/UID-0001?scale=3&border=2&module_mm=0.25")
+    assert again.get_data() == resp.get_data()
+    assert (code_store.stats()["hits"], code_store.stats()["rendered"]) == (1, 1)
+
+    svg = sync_client.get("/codes/UID-0001?format=svg&border=0&module_mm=0.5")
+    assert svg.mimetype == "image/svg+xml"
+    text = svg.get_data(as_text=True)
+    side = len(matrix)
+    assert f'width="{side * 0.5:g}mm"' in text and f'viewBox="0 0 {side} {side}"' in text
+    assert code_store.stats()["rendered"] == 2
+
+    assert sync_client.get("/codes/UID-9999").status_code == 404
+    for query in ("format=gif", "symbology=aztec", "scale=0", "scale=abc", "border=21", "module_mm=20"):
+        assert sync_client.get(f"/codes/UID-0001?{query}").status_code == 400, query
+
+
+def test_lot_codes_stream_a_zip_of_every_item(sync_client, code_store):
+    import zipfile
+
+    sync_client.get("/codes/UID-0002?format=svg")  # already cached
+    resp = sync_client.get("/codes/lot/LOT-1?format=svg")
+    assert resp.mimetype == "application/zip" and "LOT-1_qr.zip" in resp.headers["Content-Disposition"]
+    with zipfile.ZipFile(io.BytesIO(resp.get_data())) as zf:
+        assert zf.namelist() == [f"UID-{i:04d}.svg" for i in range(1, 6)]
+        assert zf.read("UID-0002.svg") == sync_client.get("/codes/UID-0002?format=svg").get_data()
+    assert (code_store.stats()["hits"], code_store.stats()["rendered"]) == (2, 5)
+
+    assert sync_client.get("/codes/lot/LOT-1?vendor_id=V-9").status_code == 404
+    assert sync_client.get("/codes/lot/LOT-404").status_code == 404
+    assert sync_client.get("/codes/lot/LOT-1?format=pdf").status_code == 400
+
+
+def test_code_store_retries_a_crashed_render_pool_once(tmp_path):
+    from concurrent.futures.process import BrokenProcessPool
+
+    import codegen
+
+    class CrashingPool:  # crashes the first `crashes` maps after rendering part of the jobs
+        def __init__(self, crashes):
+            self.crashes, self.closed, self.jobs = crashes, 0, []
+
+        def map(self, fn, jobs, chunksize=1):
+            self.jobs.append(len(jobs))
+            if len(self.jobs) <= self.crashes:
+                fn(jobs[0])
+                raise BrokenProcessPool("worker died")
+            return [fn(job) for job in jobs]
+
+        def close(self):
+            self.closed += 1
+
+    uids = [f"UID-{i:04d}" for i in range(1, 6)]
+    spec = codegen.make_spec(fmt="svg")
+    store = codegen.CodeStore(str(tmp_path / "a"), workers=2)
+    store._pool = CrashingPool(crashes=1)
+    paths = store.ensure(uids, spec)
+    assert all(os.path.exists(p) for p in paths)
+    assert (store._pool.jobs, store._pool.closed) == ([5, 4], 1)  # the retry skips what was written
+
+    store = codegen.CodeStore(str(tmp_path / "b"), workers=2)
+    store._pool = CrashingPool(crashes=2)
+    with pytest.raises(BrokenProcessPool):
+        store.ensure(uids, spec)
+    assert store._pool.closed == 2  # the next request starts a fresh pool
+
+
+SUPERVISED_CHILD = '''
+import http.server, sys
+port, runs, crashes = int(sys.argv[1]), sys.argv[2], int(sys.argv[3])
+with open(runs, "a") as f:
+    f.write("run\\n")
+with open(runs) as f:
+    if len(f.readlines()) <= crashes:
+        sys.exit(3)
+
+
+class Health(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.send_response(200 if self.path == "/health" else 404)
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+http.server.HTTPServer(("127.0.0.1", port), Health).serve_forever()
+'''
+
+
+def supervise(tmp_path, monkeypatch, crashes, scenario, ready_timeout=10.0):
+    """Run one start_all_services.Replica of SUPERVISED_CHILD through scenario(replica)"""
+    import socket
+    import sys
+
+    import start_all_services as sas
+    for name, value in {"PROBE_INTERVAL": 0.05, "BACKOFF_BASE": 0.05, "LIVENESS_INTERVAL": 0.2}.items():
+        monkeypatch.setattr(sas, name, value)
+    script = tmp_path / "child.py"
+    script.write_text(SUPERVISED_CHILD)
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    config = {"name": "Child", "script": script, "args": ["{port}", str(tmp_path / "runs"), str(crashes)],
+              "cwd": tmp_path, "health": "/health"}
+
+    async def main():
+        manager = sas.ServiceManager(ready_timeout=ready_timeout)
+        manager.stopping = asyncio.Event()
+        replica = sas.Replica(manager, "child", config, port, sys.executable)
+        task = asyncio.create_task(replica.run())
+        try:
+            await scenario(replica)
+        finally:
+            manager.stopping.set()
+            await asyncio.wait_for(task, 10)
+        assert replica.state == "stopped" and replica.process.returncode is not None
+        return replica
+
+    return asyncio.run(main())
+
+
+async def wait_for_state(replica, state, pid=None):
+    for _ in range(200):
+        if replica.state == state and replica.process and replica.process.pid != pid:
+            return
+        await asyncio.sleep(0.05)
+    raise AssertionError(f"{replica.label} never reached {state}")
+
+
+def test_supervisor_restarts_with_backoff_until_ready(tmp_path, monkeypatch, capsys):
+    import start_all_services
+
+    async def scenario(replica):
+        assert await replica.first_ready is False  # the launcher's "n/m ready" counts the first run only
+        await wait_for_state(replica, "running")
+        # Two crashed runs back to back: the backoff kept growing instead of resetting
+        assert (replica.restarts, replica.failures, replica.state) == (2, 2, "running")
+
+        # A run that stayed up past STABLE_AFTER starts the backoff over
+        monkeypatch.setattr(start_all_services, "STABLE_AFTER", 0.0)
+        pid = replica.process.pid
+        os.kill(pid, 9)
+        await wait_for_state(replica, "running", pid)
+        assert (replica.restarts, replica.failures) == (3, 1)
+
+    supervise(tmp_path, monkeypatch, crashes=2, scenario=scenario)
+    out = capsys.readouterr().out
+    assert out.count("stopped (exit code 3)") == 2 and "stopped (exit code -9)" in out
+
+
+def test_supervisor_reports_a_child_that_never_gets_ready(tmp_path, monkeypatch, capsys):
+    async def scenario(replica):
+        assert await replica.first_ready is False
+        assert replica.process.returncode is not None  # stopped, not left running unready
+
+    supervise(tmp_path, monkeypatch, crashes=0, scenario=scenario, ready_timeout=0.0)
+    assert "not ready after 0s" in capsys.readouterr().out
+
+
+def test_writer_reads_its_write_through_a_shared_cache(monkeypatch):
+    # Two workers: own routers (stickiness is per process), one primary, one lagging
+    # replica (a separately seeded copy), one Redis scan cache
+    primary, replica = seeded_pool(), seeded_pool()
+    writer = db.Router(primary, [("replica-1", replica)])
+    other = db.Router(primary, [("replica-1", replica)])
+    monkeypatch.setattr(scanning_service, "scan_cache", make_response_cache("redis"))
+    client = scanning_service.app.test_client()
+
+    def scan(router, path="/scan", body=None):
+        monkeypatch.setattr(scanning_service, "db_router", router)
+        return client.post(path, json=body or {"uid": "UID-0001"}).get_json()
+
+    monkeypatch.setattr(scanning_service, "db_router", writer)
+    assert client.post("/update_status", json={"uid": "UID-0001", "new_status": "Received",
+                                               "employee_id": 1}).status_code == 200
+    # The other worker caches the replica's pre-write row after the invalidation
+    assert scan(other)["current_status"] == "Manufactured"
+    assert scan(writer)["current_status"] == "Received"
+    batch = scan(writer, "/scan/batch", {"uids": ["UID-0001", "UID-0002"]})
+    assert [r["current_status"] for r in batch["results"]] == ["Received", "Manufactured"]
+    # ...and the writer's primary read replaced the stale entry for everyone
+    assert scan(other)["current_status"] == "Received"
+
+
+def test_async_writer_reads_its_write_through_a_shared_cache(monkeypatch):
+    async_scanning_service = pytest.importorskip("async_scanning_service")
+    from async_scanning_service import AsyncRouter, ThreadedDB
+    primary, replica = seeded_pool(), seeded_pool()
+    writer = AsyncRouter(ThreadedDB(primary), [("replica-1", ThreadedDB(replica))])
+    other = AsyncRouter(ThreadedDB(primary), [("replica-1", ThreadedDB(replica))])
+    monkeypatch.setattr(async_scanning_service, "scan_cache", make_response_cache("redis"))
+
+    async def go():
+        client = async_scanning_service.app.test_client()
+
+        async def post(router, path, body):
+            monkeypatch.setattr(async_scanning_service, "db", router)
+            return await (await client.post(path, json=body)).get_json()
+
+        scan = {"uid": "UID-0001"}
+        update = await post(writer, "/update_status", {"uid": "UID-0001", "new_status": "Received", "employee_id": 1})
+        assert update["ok"]
+        assert (await post(other, "/scan", scan))["current_status"] == "Manufactured"
+        assert (await post(writer, "/scan", scan))["current_status"] == "Received"
+        assert (await post(other, "/scan", scan))["current_status"] == "Received"
+        allowed = await post(writer, "/allowed_statuses", {"employee_id": 2, "uid": "UID-0001"})
+        assert allowed["current_status"] == "Received"
+
+    asyncio.run(go())
+    assert writer.stats()["routing"]["sticky_reads"] == 2
+    assert other.stats()["routing"]["replica_reads"] >= 1
@@ -0,0 +1,100 @@
+"""
+warranty.py
+
+Warranty expiry computation and "expiring soon" queries.
+
+Expiry is mfg_date plus warranty_years *calendar* years (a 29 Feb
+manufacturing date expires on 28 Feb in non-leap years). The old
+365-day-year formula drifted a day early for every leap day in the period.
+
+- compute_expiry(): one item
+- expiry_dates(): whole arrays at once (NumPy datetime64 when available)
+- items.expiry_date: STORED generated column with the same rule
+  (MySQL DATE_ADD(... INTERVAL n YEAR) clamps 29 Feb the same way), indexed
+  so find_expiring() is an index range scan; see migrations.py (migration 5)
+"""
+
+from datetime import date
+
+try:
+    import numpy as np
+except ImportError:  # optional, expiry_dates() falls back to pure Python
+    np = None
+
+
+def add_years(d, years):
+    """Calendar-year addition; 29 Feb maps to 28 Feb in non-leap target years"""
+    try:
+        return d.replace(year=d.year + years)
+    except ValueError:
+        return d.replace(year=d.year + years, day=28)
+
+
+def compute_expiry(mfg_date, warranty_years):
+    """expiry = mfg_date + warranty_years (None when either is missing)"""
+    if not mfg_date or not warranty_years:
+        return None
+    return add_years(mfg_date, int(warranty_years))
+
+
+def expiry_dates(mfg_dates, warranty_years):
+    """
+    Vectorized compute_expiry over two equal-length sequences.
+    Missing inputs give None. Returns a list of datetime.date / None.
+    """
+    if np is None:
+        return [compute_expiry(m, w) for m, w in zip(mfg_dates, warranty_years)]
+
+    n = len(mfg_dates)
+    if n == 0:
+        return []
+    valid = np.fromiter((bool(m) and bool(w) for m, w in zip(mfg_dates, warranty_years)), bool, n)
+    days = np.array([m if v else date(1970, 1, 1) for m, v in zip(mfg_dates, valid)], dtype="datetime64[D]")
+    years = np.array([w if v else 0 for w, v in zip(warranty_years, valid)], dtype="int64")
+
+    months = days.astype("datetime64[M]")
+    day_of_month = days - months.astype("datetime64[D]")                  # 0-based
+    target_month = months + years * 12
+    last_day = (target_month + 1).astype("datetime64[D]") - np.timedelta64(1, "D")
+    result = np.minimum(target_month.astype("datetime64[D]") + day_of_month, last_day)
+
+    out = result.astype(object)  # datetime.date objects
+    return [d if v else None for d, v in zip(out, valid)]
+
+
+def find_expiring(conn, start, end, vendor_id=None, lot_no=None, component_type=None,
+                  after=None, limit=100):
+    """
+    Items whose expiry_date falls in [start, end), ordered by (expiry_date, uid).
+    after: (expiry_date, uid) keyset cursor from the previous page.
+    Returns (rows, has_more).
+    """
+    where = ["expiry_date >= %s", "expiry_date < %s"]
+    params = [start, end]
+    if vendor_id:
+        where.append("vendor_id = %s")
+        params.append(vendor_id)
+    if lot_no:
+        where.append("lot_no = %s")
+        params.append(lot_no)
+    if component_type:
+        where.append("component_type = %s")
+        params.append(component_type)
+    if after is not None:
+        where.append("(expiry_date > %s OR (expiry_date = %s AND uid > %s))")
+        params += [after[0], after[0], after[1]]
+
+    cur = conn.cursor(dictionary=True)
+    try:
+        cur.execute(f"""
+            SELECT uid, component_type, vendor_id, lot_no, serial_no, mfg_date, warranty_years,
+                   expiry_date, current_status
+            FROM items
+            WHERE {" AND ".join(where)}
+            ORDER BY expiry_date, uid
+            LIMIT %s
+        """, params + [limit + 1])
+        rows = cur.fetchall()
+    finally:
+        cur.close()
+    return rows[:limit], len(rows) > limit